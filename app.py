@@ -1,15 +1,19 @@
 # -*- coding: utf-8 -*-
 #------A001：匯入套件(開始)：------
-import os, json, re
-from datetime import datetime, timedelta
-from typing import Dict, Any, List, Optional, Tuple
+import os, time, tempfile, threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional
 
-import requests
 import pandas as pd
 import streamlit as st
-from py3dbp import Packer, Bin, Item
-import plotly.graph_objects as go
-from plotly.offline import plot as plotly_offline_plot
+
+# 裝箱 / 報告 / 模板轉換等非畫面邏輯都在 pack_core（批次 CLI、HTTP 服務、process pool worker 共用）
+from pack_core import (
+    _secret, _to_float, _now_tw, _safe_name, GASClient,
+    _sanitize_box, _sanitize_prod, _box_payload, _box_from, _prod_payload, _prod_from,
+    ENGINES, pack_and_render, build_3d_fig, write_report_html, _fmt_dim, _RESULT_CACHE,
+    LOD_MODES, _LOD_EDGES_MAX, gas_stats, _TEMPLATE_STORE, _TEMPLATE_SYNC,
+)
 #------A001：匯入套件(結束)：------
 
 
@@ -86,12 +90,6 @@ div[data-testid="stDownloadButton"] button:hover{
 
 
 #------A003：Secrets/環境變數讀取工具(開始)：------
-def _secret(k:str, d:str='')->str:
-    try:
-        return str(st.secrets.get(k, d))
-    except Exception:
-        return os.getenv(k, d) or d
-
 GAS_URL=_secret('GAS_URL','').strip()
 GAS_TOKEN=_secret('GAS_TOKEN','').strip()
 SHEET_BOX=_secret('SHEET_BOX','box_templates').strip()
@@ -100,31 +98,26 @@ SHEET_PROD=_secret('SHEET_PROD','product_templates').strip()
 
 
 #------A004：通用工具函式(型別/時間/檔名安全)(開始)：------
-def _to_float(x, default=0.0)->float:
+def _force_rerun(scope: str = 'app'):
+    # scope='fragment'：只重跑目前這個片段。整頁執行中不能只重跑片段時不再升級成整頁 rerun
+    # （片段正在這次整頁執行裡重畫）；只有舊版 Streamlit（st.rerun 沒有 scope）才整頁 rerun
+    rerun = getattr(st, 'rerun', None) or getattr(st, 'experimental_rerun', None)
+    if rerun is None:
+        return
     try:
-        return float(x)
+        rerun(scope=scope)
+    except TypeError:
+        rerun()
     except Exception:
-        try:
-            return float(str(x).strip())
-        except Exception:
-            return float(default)
-
-def _now_tw()->datetime:
-    return datetime.utcnow()+timedelta(hours=8)
+        pass
 
-def _safe_name(s:str)->str:
-    s=(s or '').strip() or '訂單'
-    s=re.sub(r'[\\/:*?"<>| ]+','_',s)
-    return s[:60]
+# 各區塊各自 rerun（改表格只重跑該表格，不重畫結果區 / 其他模板區）；舊版 Streamlit 沒有 fragment 時照舊整頁執行
+_fragment = getattr(st, 'fragment', None) or getattr(st, 'experimental_fragment', None) or (lambda f: f)
 
-def _force_rerun():
-    try:
-        st.rerun()
-    except Exception:
-        try:
-            st.experimental_rerun()
-        except Exception:
-            pass
+def _fragment_every(seconds: float):
+    # 定時自動重跑的片段（例如背景同步狀態）；沒有 fragment 時只在整頁 rerun 時更新
+    f = getattr(st, 'fragment', None) or getattr(st, 'experimental_fragment', None)
+    return f(run_every=seconds) if f else (lambda fn: fn)
 
 def _apply_editor_state(df: pd.DataFrame, state: Any) -> pd.DataFrame:
     """
@@ -203,83 +196,23 @@ def _begin_loading(msg: str = '資料讀取中...'):
 def _end_loading():
     _set_loading(False, '')
 
-# ===== GAS cache（減少 list/get 的延遲）=====
-@st.cache_data(ttl=20, show_spinner=False)
-def _cache_gas_list(url: str, token: str, sheet: str) -> List[str]:
-    c = GASClient(url, token)
-    return c.list_names(sheet) if c.ready else []
-
-@st.cache_data(ttl=20, show_spinner=False)
-def _cache_gas_get(url: str, token: str, sheet: str, name: str) -> Optional[Dict[str, Any]]:
-    c = GASClient(url, token)
-    return c.get_payload(sheet, name) if c.ready else None
+# ===== GAS 模板快取（本機 SQLite 副本，所有 session 共用，見 _TEMPLATE_STORE）=====
+def _gas_refresh(sheet: str, listing: Optional[Dict[str, Dict[str, Any]]], name: Optional[str] = None, payload: Optional[Dict[str, Any]] = None):
+    """
+    寫入成功後只更新變動的那張表：有 batch 一併取回的最新清單就整張換掉；
+    沒有（舊版 GAS）則只改這一筆（payload=None 表示已刪除），並標成過期讓背景向 GAS 確認。
+    不清除其他表或任何 st.cache_data（其他使用者不必跟著重抓）。
+    """
+    if listing is not None:
+        _TEMPLATE_STORE.apply_listing(gas, sheet, listing)
+    elif name:
+        _TEMPLATE_STORE.put(gas, sheet, name, payload)
 
-def _gas_cache_clear():
-    try:
-        st.cache_data.clear()
-    except Exception:
-        pass
 #------A004：通用工具函式(型別/時間/檔名安全)(結束)：------
 
 
 
 #------A005：Google Apps Script(GAS) API Client(開始)：------
-class GASClient:
-    def __init__(self,url:str,token:str):
-        self.url=url.strip(); self.token=token.strip()
-
-    @property
-    def ready(self)->bool: 
-        return bool(self.url and self.token)
-
-    def _call(self, action:str, sheet:str, name:str='', payload:Optional[Dict[str,Any]]=None)->Dict[str,Any]:
-        if not self.ready: 
-            return {'ok':False,'error':'missing_gas_config'}
-        params={'action':action,'sheet':sheet,'token':self.token}
-        if name: 
-            params['name']=name
-        try:
-            if action=='upsert':
-                r=requests.post(
-                    self.url, 
-                    params=params, 
-                    json={'payload_json': json.dumps(payload or {}, ensure_ascii=False)}
-                )
-            else:
-                r=requests.get(self.url, params=params)
-            return r.json()
-        except Exception as e:
-            return {'ok':False,'error':str(e)}
-
-    def list_names(self,sheet:str)->List[str]:
-        d=self._call('list',sheet)
-        return list(d.get('items') or []) if d.get('ok') else []
-
-    def get_payload(self,sheet:str,name:str)->Optional[Dict[str,Any]]:
-        d=self._call('get',sheet,name=name)
-        if not d.get('ok'): 
-            return None
-        raw=d.get('payload_json') or ''
-        try: 
-            return json.loads(raw) if raw else {}
-        except Exception: 
-            return None
-
-    def create_only(self,sheet:str,name:str,payload:Dict[str,Any])->Tuple[bool,str]:
-        if name in self.list_names(sheet):
-            return False,'同名模板已存在，請改名後再儲存。'
-        d=self._call('upsert',sheet,name=name,payload=payload)
-        return (True,'已儲存') if d.get('ok') else (False, f"儲存失敗：{d.get('error','未知錯誤')}")
-
-    def upsert(self,sheet:str,name:str,payload:Dict[str,Any])->Tuple[bool,str]:
-        # 覆寫儲存（用於：套用變更後同步回寫雲端模板）
-        d=self._call('upsert',sheet,name=name,payload=payload)
-        return (True,'已更新') if d.get('ok') else (False, f"更新失敗：{d.get('error','未知錯誤')}")
-
-    def delete(self,sheet:str,name:str)->Tuple[bool,str]:
-        d=self._call('delete',sheet,name=name)
-        return (True,'已刪除') if d.get('ok') else (False, f"刪除失敗：{d.get('error','未知錯誤')}")
-
 gas=GASClient(GAS_URL,GAS_TOKEN)
 #------A005：Google Apps Script(GAS) API Client(結束)：------
 
@@ -312,160 +245,38 @@ def _ensure_defaults():
         st.session_state.active_prod_tpl=''
     if 'last_result' not in st.session_state: 
         st.session_state.last_result=None
+    if 'pack_engine' not in st.session_state:
+        st.session_state.pack_engine='py3dbp'
+    if 'pack_optimize' not in st.session_state:
+        st.session_state.pack_optimize=False
+    if 'pack_portfolio' not in st.session_state:
+        st.session_state.pack_portfolio=False
+    if 'pack_time_limit' not in st.session_state:
+        st.session_state.pack_time_limit=10.0
+    if 'pack_time_budget' not in st.session_state:
+        st.session_state.pack_time_budget=0.0
 #------A006：Session State 預設值初始化(結束)：------
 
 
-#------A007：外箱資料清理/防呆(開始)：------
-def _sanitize_box(df:pd.DataFrame)->pd.DataFrame:
-    cols=['選取','名稱','長','寬','高','數量','空箱重量']
-    if df is None:
-        df=pd.DataFrame(columns=cols)
-    df=df.copy()
-    for c in cols:
-        if c not in df.columns:
-            df[c]='' if c=='名稱' else 0
-    df=df[cols].fillna('')
-
-    # 空表就直接回傳空表（不要強塞預設值）
-    if df.empty:
-        return pd.DataFrame(columns=cols)
-
-    df['選取']=df['選取'].astype(bool)
-    df['名稱']=df['名稱'].astype(str).str.strip()
-    for c in ['長','寬','高','空箱重量']:
-        df[c]=df[c].apply(_to_float)
-    df['數量']=df['數量'].apply(lambda x:int(_to_float(x,0)))
-
-    def empty_row(r):
-        return (not r['名稱']) and r['長']==0 and r['寬']==0 and r['高']==0 and r['數量']==0
-
-    df=df[~df.apply(empty_row,axis=1)].reset_index(drop=True)
-
-    # 清理完如果變空，也保持空（不回填預設）
-    if df.empty:
-        return pd.DataFrame(columns=cols)
-
-    return df
-#------A007：外箱資料清理/防呆(結束)：------
-
-
-
-#------A008：商品資料清理/防呆(開始)：------
-def _sanitize_prod(df:pd.DataFrame)->pd.DataFrame:
-    cols=['選取','商品名稱','長','寬','高','重量(kg)','數量','放置方式']
-    if df is None:
-        df=pd.DataFrame(columns=cols)
-    df=df.copy()
-    for c in cols:
-        if c not in df.columns:
-            df[c]='' if c in ('商品名稱',) else 0
-    df=df[cols].fillna('')
-
-    if df.empty:
-        return pd.DataFrame(columns=cols)
-
-    df['選取']=df['選取'].astype(bool)
-    df['商品名稱']=df['商品名稱'].astype(str).str.strip()
-
-    for c in ['長','寬','高','重量(kg)']:
-        df[c]=df[c].apply(_to_float)
-    df['數量']=df['數量'].apply(lambda x:int(_to_float(x,0)))
-
-    # 放置方式防呆
-    allowed = ['自動','長當高','寬當高','高當高']
-    df['放置方式'] = df['放置方式'].astype(str).str.strip()
-    df.loc[~df['放置方式'].isin(allowed), '放置方式'] = '自動'
-    df.loc[df['放置方式'].eq(''), '放置方式'] = '自動'
-
-    def empty_row(r):
-        return (not r['商品名稱']) and r['長']==0 and r['寬']==0 and r['高']==0 and r['數量']==0
-
-    df=df[~df.apply(empty_row,axis=1)].reset_index(drop=True)
-
-    if df.empty:
-        return pd.DataFrame(columns=cols)
-
-    return df
-#------A008：商品資料清理/防呆(結束)：------
-
-
-
-#------A009：外箱/商品 模板 payload 轉換(開始)：------
-def _box_payload(df):
-    rows=[]
-    for _,r in df.fillna('').iterrows():
-        rows.append({
-            'selected':bool(r['選取']),
-            'name':str(r['名稱']).strip(),
-            'l':_to_float(r['長']),
-            'w':_to_float(r['寬']),
-            'h':_to_float(r['高']),
-            'qty':int(_to_float(r['數量'],0)),
-            'tare':_to_float(r['空箱重量'])
-        })
-    return {'rows':rows}
-
-def _box_from(payload):
-    if not isinstance(payload,dict): 
-        raise ValueError('payload is not dict')
-    rows=payload.get('rows',[])
-    if not isinstance(rows,list): 
-        raise ValueError('rows is not list')
-    out=[]
-    for r in rows:
-        if not isinstance(r,dict): 
-            continue
-        out.append({
-            '選取':bool(r.get('selected',False)),
-            '名稱':str(r.get('name','')),
-            '長':_to_float(r.get('l',0)),
-            '寬':_to_float(r.get('w',0)),
-            '高':_to_float(r.get('h',0)),
-            '數量':int(_to_float(r.get('qty',0),0)),
-            '空箱重量':_to_float(r.get('tare',0))
-        })
-    return _sanitize_box(pd.DataFrame(out))
-
-def _prod_payload(df):
-    rows=[]
-    for _,r in df.fillna('').iterrows():
-        rows.append({
-            'selected':bool(r['選取']),
-            'name':str(r['商品名稱']).strip(),
-            'l':_to_float(r['長']),
-            'w':_to_float(r['寬']),
-            'h':_to_float(r['高']),
-            'wt':_to_float(r['重量(kg)']),
-            'qty':int(_to_float(r['數量'],0)),
-            'orient': str(r.get('放置方式','自動') or '自動').strip()
-        })
-    return {'rows':rows}
-
-def _prod_from(payload):
-    if not isinstance(payload,dict): 
-        raise ValueError('payload is not dict')
-    rows=payload.get('rows',[])
-    if not isinstance(rows,list): 
-        raise ValueError('rows is not list')
-    out=[]
-    for r in rows:
-        if not isinstance(r,dict): 
-            continue
-        out.append({
-            '選取':bool(r.get('selected',False)),
-            '商品名稱':str(r.get('name','')),
-            '長':_to_float(r.get('l',0)),
-            '寬':_to_float(r.get('w',0)),
-            '高':_to_float(r.get('h',0)),
-            '重量(kg)':_to_float(r.get('wt',0)),
-            '數量':int(_to_float(r.get('qty',0),0)),
-            '放置方式':str(r.get('orient','自動') or '自動')
-        })
-    return _sanitize_prod(pd.DataFrame(out))
-#------A009：外箱/商品 模板 payload 轉換(結束)：------
-
-
 #------A010：模板區塊 UI（載入 / 儲存 / 刪除）(開始)：------
+@_fragment_every(2)
+def _sync_status_block(sheet: str, active_key: str, key_prefix: str):
+    # 目前套用模板的背景同步狀態（套用變更後由 _TEMPLATE_SYNC 寫回 GAS）
+    tpl = (st.session_state.get(active_key) or '').strip()
+    ss = _TEMPLATE_SYNC.status(gas, sheet, tpl) if (tpl and gas.ready) else None
+    if not ss:
+        return
+    if ss['state'] in ('pending', 'syncing'):
+        st.caption(f"☁️ 模板「{tpl}」背景同步中…")
+    elif ss['state'] == 'synced':
+        st.caption(f"✅ 模板「{tpl}」已同步到雲端（{max(0, int(time.time()-ss['updated']))} 秒前）")
+    else:
+        st.warning(f"模板「{tpl}」同步失敗（已重試 {ss['attempts']} 次）：{ss['error']}")
+        if st.button('🔁 重試同步', key=f'{key_prefix}_sync_retry'):
+            _TEMPLATE_SYNC.retry(gas, sheet, tpl)
+            _force_rerun('fragment')
+
+@_fragment
 def template_block(title:str, sheet:str, active_key:str, df_key:str, to_payload, from_payload, key_prefix:str):
     st.markdown(f"### {title}（載入 / 儲存 / 刪除）")
     if not gas.ready:
@@ -474,8 +285,9 @@ def template_block(title:str, sheet:str, active_key:str, df_key:str, to_payload,
 
     loading = _is_loading()
 
-    # ✅ 用 cache 減少清單讀取延遲
-    names = ['(無)'] + sorted(_cache_gas_list(GAS_URL, GAS_TOKEN, sheet))
+    # ✅ 清單直接讀本機副本（過期時背景向 GAS 確認版本，只下載有變的模板），不必等雲端往返
+    listing = _TEMPLATE_STORE.listing(gas, sheet)
+    names = ['(無)'] + sorted(listing)
 
     # ✅ 整段包在 loading-wrap 內，overlay 才能「覆蓋」控制項
     st.markdown('<div class="loading-wrap">', unsafe_allow_html=True)
@@ -506,7 +318,7 @@ def template_block(title:str, sheet:str, active_key:str, df_key:str, to_payload,
             # ✅ 關鍵：同一次 run 立即渲染 overlay（使用者才看得到）
             st.markdown(_loading_overlay_html('讀取模板中...'), unsafe_allow_html=True)
             try:
-                payload = _cache_gas_get(GAS_URL, GAS_TOKEN, sheet, sel)
+                payload = _TEMPLATE_STORE.get(gas, sheet, sel)
                 if payload is None:
                     st.error('載入失敗：請確認雲端連線 / 權限')
                 else:
@@ -524,8 +336,7 @@ def template_block(title:str, sheet:str, active_key:str, df_key:str, to_payload,
 
                     st.success(f'已載入：{sel}')
 
-                    _gas_cache_clear()
-                    _force_rerun()
+                    _force_rerun()   # 載入會換掉表格內容：整頁 rerun
             except Exception as e:
                 st.error(f'載入解析失敗：{e}')
             finally:
@@ -541,13 +352,19 @@ def template_block(title:str, sheet:str, active_key:str, df_key:str, to_payload,
             # ✅ 關鍵：同一次 run 立即渲染 overlay（使用者才看得到）
             st.markdown(_loading_overlay_html('儲存模板中...'), unsafe_allow_html=True)
             try:
-                ok, msg = gas.create_only(sheet, nm, to_payload(st.session_state[df_key]))
+                body = to_payload(st.session_state[df_key])
+                ok, msg, fresh = gas.create_and_list(sheet, nm, body)
                 if ok:
                     st.session_state[active_key] = nm
                     st.success(msg)
-                    _gas_cache_clear()
-                    _force_rerun()
+                    _gas_refresh(sheet, fresh, nm, body)
+                    _force_rerun('fragment')
                 else:
+                    # 失敗時仍以一併取回的清單為準；沒拿到清單（逾時等）就只讓這張表失效
+                    if fresh is not None:
+                        _gas_refresh(sheet, fresh)
+                    else:
+                        _TEMPLATE_STORE.invalidate(gas, sheet)
                     st.error(msg)
             finally:
                 _end_loading()
@@ -561,25 +378,42 @@ def template_block(title:str, sheet:str, active_key:str, df_key:str, to_payload,
             # ✅ 關鍵：同一次 run 立即渲染 overlay（使用者才看得到）
             st.markdown(_loading_overlay_html('刪除模板中...'), unsafe_allow_html=True)
             try:
-                ok, msg = gas.delete(sheet, del_sel)
-                if ok:
-                    if st.session_state.get(active_key) == del_sel:
-                        st.session_state[active_key] = ''
-                    st.success(msg)
-                    _gas_cache_clear()
-                    _force_rerun()
+                # 正在送出的背景同步要先結束，否則刪除後會被那次寫入重新建立
+                if not _TEMPLATE_SYNC.cancel(gas, sheet, del_sel):
+                    st.error('這個模板的背景同步仍在送出中，請稍後再刪除')
                 else:
-                    st.error(msg)
+                    ok, msg, fresh = gas.delete_and_list(sheet, del_sel)
+                    if ok:
+                        if st.session_state.get(active_key) == del_sel:
+                            st.session_state[active_key] = ''
+                        st.success(msg)
+                        _gas_refresh(sheet, fresh, del_sel, None)
+                        _force_rerun('fragment')
+                    else:
+                        # 失敗時仍以一併取回的清單為準；沒拿到清單（逾時等）就只讓這張表失效
+                        if fresh is not None:
+                            _gas_refresh(sheet, fresh)
+                        else:
+                            _TEMPLATE_STORE.invalidate(gas, sheet)
+                        st.error(msg)
             finally:
                 _end_loading()
 
     st.caption(f"目前套用：{st.session_state.get(active_key) or '未選擇'}")
+    _sync_status_block(sheet, active_key, key_prefix)
+    gs = gas_stats()
+    if gs['errors']:
+        st.caption(
+            f"雲端連線：{gs['calls']} 次呼叫，失敗 {gs['errors']} 次（重試 {gs['retries']}、逾時 {gs['timeouts']}），"
+            f"延遲 p50 {gs['p50']:.2f}s / p95 {gs['p95']:.2f}s；最後錯誤：{gs['last_error'][:80]}"
+        )
     st.markdown('</div>', unsafe_allow_html=True)
 #------A010：模板區塊 UI（載入 / 儲存 / 刪除）(結束)：------
 
 
 
 #------A011：外箱表格 UI（Data Editor + 操作按鈕）(開始)：------
+@_fragment
 def box_table_block():
     st.markdown('### 箱型表格（勾選=參與計算；勾選後可刪除）')
     st.markdown('<div class="muted">只保留一個「選取」欄：要參與裝箱就勾選；要刪除就勾選後按「刪除勾選」。</div>', unsafe_allow_html=True)
@@ -632,17 +466,14 @@ def box_table_block():
             st.session_state['_box_live_df'] = clean.copy()
 
             if gas.ready and (st.session_state.get('active_box_tpl') or '').strip():
+                # ✅ 模板回寫交給背景佇列（連續修改合併成一次寫入），畫面不必等 GAS；同步狀態顯示在模板區
                 tpl = st.session_state['active_box_tpl']
-                ok, msg = gas.upsert(SHEET_BOX, tpl, _box_payload(clean))
-                if ok:
-                    st.success(f'已套用並同步更新模板：{tpl}')
-                else:
-                    st.error(msg)
+                _TEMPLATE_SYNC.submit(gas, SHEET_BOX, tpl, _box_payload(clean))
+                st.success(f'已套用，模板「{tpl}」背景同步中')
             else:
                 st.success('已套用外箱表格變更')
 
-            _gas_cache_clear()
-            _force_rerun()
+            _force_rerun('fragment')
         finally:
             _end_loading()
 
@@ -655,7 +486,7 @@ def box_table_block():
             st.session_state.df_box = d
             st.session_state['_box_live_df'] = d.copy()
             st.success('已刪除勾選外箱')
-            _force_rerun()
+            _force_rerun('fragment')
         finally:
             _end_loading()
 
@@ -667,7 +498,7 @@ def box_table_block():
             st.session_state.active_box_tpl = ''
             st.session_state['_box_live_df'] = empty.copy()
             st.success('已清空全部外箱，並清除「目前套用」狀態')
-            _force_rerun()
+            _force_rerun()   # 「目前套用」顯示在模板區：整頁 rerun
         finally:
             _end_loading()
 
@@ -677,6 +508,7 @@ def box_table_block():
 
 
 #------A012：商品表格 UI（Data Editor + 操作按鈕）(開始)：------
+@_fragment
 def prod_table_block():
     st.markdown('### 商品表格（勾選=參與計算；勾選後可刪除）')
     st.markdown('<div class="muted">只保留一個「選取」欄：要參與計算就勾選；要刪除就勾選後按「刪除勾選」。</div>', unsafe_allow_html=True)
@@ -734,17 +566,14 @@ def prod_table_block():
             st.session_state['_prod_live_df'] = clean.copy()
 
             if gas.ready and (st.session_state.get('active_prod_tpl') or '').strip():
+                # ✅ 模板回寫交給背景佇列（連續修改合併成一次寫入），畫面不必等 GAS；同步狀態顯示在模板區
                 tpl = st.session_state['active_prod_tpl']
-                ok, msg = gas.upsert(SHEET_PROD, tpl, _prod_payload(clean))
-                if ok:
-                    st.success(f'已套用並同步更新模板：{tpl}')
-                else:
-                    st.error(msg)
+                _TEMPLATE_SYNC.submit(gas, SHEET_PROD, tpl, _prod_payload(clean))
+                st.success(f'已套用，模板「{tpl}」背景同步中')
             else:
                 st.success('已套用商品表格變更')
 
-            _gas_cache_clear()
-            _force_rerun()
+            _force_rerun('fragment')
         finally:
             _end_loading()
 
@@ -757,7 +586,7 @@ def prod_table_block():
             st.session_state.df_prod = d
             st.session_state['_prod_live_df'] = d.copy()
             st.success('已刪除勾選商品')
-            _force_rerun()
+            _force_rerun('fragment')
         finally:
             _end_loading()
 
@@ -769,7 +598,7 @@ def prod_table_block():
             st.session_state.active_prod_tpl = ''
             st.session_state['_prod_live_df'] = empty.copy()
             st.success('已清空全部商品，並清除「目前套用」狀態')
-            _force_rerun()
+            _force_rerun()   # 「目前套用」顯示在模板區：整頁 rerun
         finally:
             _end_loading()
 
@@ -779,403 +608,186 @@ def prod_table_block():
 
 
 
-#------A013：外箱選擇/商品展開為 Item(開始)：------
-from decimal import Decimal
+#------A017：商品總件數統計(用於檔名)(開始)：------
+def _total_items(df_prod:pd.DataFrame)->int:
+    if df_prod is None or df_prod.empty: 
+        return 0
+    sel=df_prod['選取'].astype(bool)
+    return int(df_prod.loc[sel,'數量'].apply(lambda x:int(_to_float(x,0))).sum())
+#------A017：商品總件數統計(用於檔名)(結束)：------
 
-def _D(x)->Decimal:
-    # 用字串避免 float 二進位誤差
-    return Decimal(str(_to_float(x, 0)))
 
-class FixedItem(Item):
-    """
-    鎖定方向 + 統一回傳 Decimal 尺寸，避免 Decimal/float 混用造成 TypeError。
-    """
-    def __init__(self, name: str, dx, dy, dz, weight: float):
-        # dx/dy/dz 直接用 Decimal
-        super().__init__(name, dx, dy, dz, weight)
-        self._fixed_dims = (Decimal(str(dx)), Decimal(str(dy)), Decimal(str(dz)))
-
-    def get_dimension(self):
-        return self._fixed_dims
-
-def _build_bins(df_box:pd.DataFrame)->List[Dict[str,Any]]:
-    bins=[]
-    for _,r in df_box.iterrows():
-        if not bool(r.get('選取', False)):
-            continue
-        qty=int(r.get('數量',0) or 0)
-        if qty<=0:
-            continue
-
-        L=_D(r.get('長',0)); W=_D(r.get('寬',0)); H=_D(r.get('高',0))
-        if L<=0 or W<=0 or H<=0:
-            continue
-
-        name=(str(r.get('名稱','') or '').strip() or '外箱')
-        tare=_to_float(r.get('空箱重量',0) or 0)  # 重量維持 float 無妨
-        for i in range(qty):
-            bins.append({'name':name,'l':L,'w':W,'h':H,'tare':tare})
-    return bins
-
-def _apply_manual_orient(L: Decimal, W: Decimal, H: Decimal, mode: str):
+#------A018：結果區塊 UI（開始計算 + 顯示結果 + 下載HTML）(開始)：------
+class _PackJob:
     """
-    座標系：x=長(L), y=寬(W), z=高(H)
-    指定「哪個尺寸當 z(高度)」。
+    背景裝箱工作：在 thread 裡跑 pack_and_render，畫面每次 rerun 讀取進度；
+    cancel 設定後會盡快停止並回傳目前最佳（可能是部分）方案。
     """
-    mode = (mode or '自動').strip()
-    if mode == '高當高':
-        return (L, W, H)   # z=H
-    if mode == '長當高':
-        return (W, H, L)   # z=L
-    if mode == '寬當高':
-        return (L, H, W)   # z=W
-    return (L, W, H)       # 自動：交給 py3dbp 旋轉
-
-def _build_items(df_prod:pd.DataFrame)->List[Item]:
-    items=[]
-    for _,r in df_prod.iterrows():
-        if not bool(r.get('選取', False)):
-            continue
-        qty=int(r.get('數量',0) or 0)
-        if qty<=0:
-            continue
-
-        L=_D(r.get('長',0)); W=_D(r.get('寬',0)); H=_D(r.get('高',0))
-        if L<=0 or W<=0 or H<=0:
-            continue
-
-        nm=(str(r.get('商品名稱','') or '').strip() or '商品')
-        wt=_to_float(r.get('重量(kg)',0) or 0)
-        orient=str(r.get('放置方式','自動') or '自動').strip()
-
-        for i in range(qty):
-            dx, dy, dz = _apply_manual_orient(L, W, H, orient)
-
-            if orient == '自動':
-                # ✅ 自動：Item 尺寸也用 Decimal（重點）
-                items.append(Item(f"{nm}_{i+1}", dx, dy, dz, wt))
-            else:
-                # ✅ 手動：FixedItem 鎖定方向（也用 Decimal）
-                items.append(FixedItem(f"{nm}_{i+1}", dx, dy, dz, wt))
-    return items
-#------A013：外箱選擇/商品展開為 Item(結束)：------
-
-
-
-#------A014：3D 圖表建立（Plotly）(開始)：------
-def build_3d_fig(box:Dict[str,Any], fitted:List[Item], color_map:Dict[str,str]=None)->go.Figure:
-    fig=go.Figure()
-
-    # 統一座標：x=長(L), y=寬(W), z=高(H)
-    L=float(box['l']); W=float(box['w']); H=float(box['h'])
-
-    # 外箱框線
-    edges=[((0,0,0),(L,0,0)),((L,0,0),(L,W,0)),((L,W,0),(0,W,0)),((0,W,0),(0,0,0)),
-           ((0,0,H),(L,0,H)),((L,0,H),(L,W,H)),((L,W,H),(0,W,H)),((0,W,H),(0,0,H)),
-           ((0,0,0),(0,0,H)),((L,0,0),(L,0,H)),((L,W,0),(L,W,H)),((0,W,0),(0,W,H))]
-    for a,b in edges:
-        fig.add_trace(go.Scatter3d(
-            x=[a[0],b[0]],y=[a[1],b[1]],z=[a[2],b[2]],
-            mode='lines', line=dict(width=5,color='#111'),
-            hoverinfo='skip', showlegend=False
-        ))
-
-    def _base_name(n:str)->str:
-        n=str(n or '')
-        return n.rsplit('_',1)[0] if '_' in n else n
-
-    def _rot_dim(it:Item):
-        # ✅ py3dbp 旋轉後尺寸（避免你看到融合/穿透/大小不對）
-        if hasattr(it,'get_dimension'):
-            d=it.get_dimension()  # (w,h,d)
-            return float(d[0]),float(d[1]),float(d[2])
-        return float(it.width),float(it.height),float(it.depth)
-
-    # 若未提供 color_map，就用 fitted 自己建立（但你現在會由 A016 提供，才能跨箱一致）
-    if color_map is None:
-        palette=['#2F3A4A','#4C6A92','#6C757D','#8E9AAF','#A3B18A','#B08968','#C9ADA7','#6D6875']
-        color_map={}
-        ci=0
-        for it in fitted:
-            base=_base_name(getattr(it,'name',''))
-            if base not in color_map:
-                color_map[base]=palette[ci%len(palette)]
-                ci += 1
-
-    # 畫商品：實心、不透明、加邊框
-    for it in fitted:
-        name=str(getattr(it,'name',''))
-        base=_base_name(name)
-        c=color_map.get(base, '#4C6A92')
-
-        px,py,pz=[float(v) for v in (getattr(it,'position',[0,0,0]) or [0,0,0])]
-        dx,dy,dz=_rot_dim(it)
-
-        vx=[px,px+dx,px+dx,px,px,px+dx,px+dx,px]
-        vy=[py,py,py+dy,py+dy,py,py,py+dy,py+dy]
-        vz=[pz,pz,pz,pz,pz+dz,pz+dz,pz+dz,pz+dz]
-
-        faces=[(0,1,2),(0,2,3),(4,5,6),(4,6,7),(0,1,5),(0,5,4),
-               (1,2,6),(1,6,5),(2,3,7),(2,7,6),(3,0,4),(3,4,7)]
-        I,J,K=zip(*faces)
-
-        fig.add_trace(go.Mesh3d(
-            x=vx,y=vy,z=vz, i=I,j=J,k=K,
-            color=c, opacity=1.0, flatshading=True,
-            hovertemplate=f"{base}<br>尺寸:{dx:.1f}×{dy:.1f}×{dz:.1f}<extra></extra>",
-            showlegend=False
-        ))
-
-        item_edges=[(0,1),(1,2),(2,3),(3,0),(4,5),(5,6),(6,7),(7,4),(0,4),(1,5),(2,6),(3,7)]
-        for a,b in item_edges:
-            fig.add_trace(go.Scatter3d(
-                x=[vx[a],vx[b]],y=[vy[a],vy[b]],z=[vz[a],vz[b]],
-                mode='lines', line=dict(width=3,color='#000'),
-                hoverinfo='skip', showlegend=False
-            ))
-
-    fig.update_layout(
-        scene=dict(
-            xaxis=dict(range=[0,L], title='長 (L)'),
-            yaxis=dict(range=[0,W], title='寬 (W)'),
-            zaxis=dict(range=[0,H], title='高 (H)'),
-            aspectmode='data',
-          
-            # ✅ (1) 讓初始 3D 物件看起來小約 20%：相機拉遠（eye 變大）
-            # 你之後想更小/更大，就調整下面三個數字
-            camera=dict(eye=dict(x=1.56, y=1.56, z=1.5))
-        ),
-        margin=dict(l=0,r=0,t=0,b=0),
-        height=650
-    )
-    return fig
-#------A014：3D 圖表建立（Plotly）(結束)：------
-
-
-
-#------A015：HTML 報告輸出（含 Plotly 內嵌）(開始)：------
-def build_report_html(
-    order_name:str,
-    packed_bins:List[Dict[str,Any]],
-    unfitted:List[Item],
-    content_wt:float,
-    total_wt:float,
-    util:float,
-    color_map:Dict[str,str]
-)->str:
-    ts=_now_tw().strftime('%Y-%m-%d %H:%M:%S (台灣時間)')
+    def __init__(self, **kwargs):
+        self.cancel=threading.Event()
+        self.progress={}
+        self.total=0
+        self.result=None
+        self.started=time.monotonic()
+        self._kwargs=kwargs
+        self._thread=threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _on_progress(self, d:Dict[str,Any]):
+        if d.get('stage') == 'pack' and d.get('boxes') == 0:
+            self.total=max(self.total, int(d.get('remaining',0)))
+        self.progress=dict(d)
+
+    def _run(self):
+        try:
+            # 3D 圖由 _box_fig 依選到的箱子即時建立，這裡不必先畫第一箱
+            self.result=pack_and_render(progress=self._on_progress, cancel=self.cancel, render=False, **self._kwargs)
+        except Exception as e:
+            self.result={'ok':False,'error':f'計算失敗：{e}'}
 
-    # 未裝入警示
-    warn=''
-    if unfitted:
-        counts={}
-        for it in unfitted:
-            base=str(it.name).split('_')[0]
-            counts[base]=counts.get(base,0)+1
-        warn="<div class='warn'><b>注意：</b>有部分商品裝不下！（可能是箱型庫存不足或尺寸不夠）</div>"+''.join(
-            [f"<div class='warn2'>⚠ {k}：超過 {v} 個</div>" for k,v in counts.items()]
-        )
+    @property
+    def done(self)->bool:
+        return self.result is not None
 
-    # Legend（同 Streamlit）
-    legend_items=''.join([
-        f"<div class='legrow'><span class='sw' style='background:{c}'></span>{k}</div>"
-        for k,c in color_map.items()
-    ])
-
-    # 每箱圖
-    sections=[]
-    for idx,p in enumerate(packed_bins, start=1):
-        box=p['box']; items=p['items']
-        fig=build_3d_fig(box, items, color_map=color_map)
-        fig_div=plotly_offline_plot(fig, output_type='div', include_plotlyjs=('cdn' if idx==1 else False))
-        sections.append(f"""
-          <div class='boxcard'>
-            <div class='boxtitle'>📦 {p['name']}（裝入 {len(items)} 件）</div>
-            <div class='boxmeta'>箱子尺寸：{box['l']} × {box['w']} × {box['h']}</div>
-            <div class='boxgrid'>
-              <div class='legend'>
-                <div class='legtitle'>分類說明</div>
-                {legend_items}
-              </div>
-              <div class='plot'>{fig_div}</div>
-            </div>
-          </div>
-        """)
-
-    body=''.join(sections) if sections else "<div class='warn'>本次沒有任何箱子成功裝入商品。</div>"
-
-    return f"""<!doctype html><html lang='zh-Hant'><head>
-<meta charset='utf-8'/><meta name='viewport' content='width=device-width,initial-scale=1'/>
-<title>訂單裝箱報告 - {_safe_name(order_name)}</title>
-<style>
-body{{font-family:-apple-system,BlinkMacSystemFont,'Segoe UI','PingFang TC','Microsoft JhengHei',Arial,sans-serif;margin:0;background:#fff}}
-.container{{max-width:1200px;margin:24px auto;padding:0 16px}}
-.card{{border:1px solid #e6e6e6;border-radius:14px;padding:16px 18px;margin:12px 0}}
-h2{{margin:0 0 10px 0}}
-.meta{{display:flex;flex-direction:column;gap:6px;color:#222}}
-.warn{{border:1px solid #f2b8b5;background:#fdecea;padding:10px 12px;border-radius:12px;margin:12px 0}}
-.warn2{{border:1px solid #f2b8b5;background:#fdecea;padding:8px 12px;border-radius:12px;margin:8px 0}}
-.boxcard{{border:1px solid #e6e6e6;border-radius:14px;padding:14px 14px;margin:14px 0}}
-.boxtitle{{font-weight:900;margin-bottom:6px}}
-.boxmeta{{color:#444;margin-bottom:10px}}
-.boxgrid{{display:grid;grid-template-columns:260px 1fr;gap:12px;align-items:start}}
-.legend{{border:1px solid #eee;border-radius:12px;padding:10px 10px}}
-.legtitle{{font-weight:800;margin-bottom:8px}}
-.legrow{{display:flex;align-items:center;gap:8px;margin:6px 0}}
-.sw{{width:14px;height:14px;border:2px solid #111;border-radius:3px;display:inline-block}}
-.plot{{border-radius:12px;overflow:hidden}}
-@media (max-width:900px){{ .boxgrid{{grid-template-columns:1fr}} }}
-</style>
-</head><body>
-<div class='container'>
-  <div class='card'>
-    <h2>🧾 訂單裝箱報告</h2>
-    <div class='meta'>
-      <div>🧾 <b>訂單名稱</b>　{order_name}</div>
-      <div>🕒 <b>計算時間</b>　{ts}</div>
-      <div>📦 <b>使用箱數</b>　<b>{len(packed_bins)}</b> 箱（可混用不同箱型）</div>
-      <div>⚖️ <b>內容淨重</b>　{content_wt:.2f} kg</div>
-      <div>🔴 <b>本次總重</b>　{total_wt:.2f} kg</div>
-      <div>📊 <b>整體空間利用率</b>　{util:.2f}%</div>
-    </div>
-    {warn}
-  </div>
-  {body}
-</div>
-</body></html>"""
-#------A015：HTML 報告輸出（含 Plotly 內嵌）(結束)：------
-
-
-
-#------A016：裝箱計算核心（py3dbp）+ 統計(開始)：------
-def pack_and_render(order_name:str, df_box:pd.DataFrame, df_prod:pd.DataFrame)->Dict[str,Any]:
-    bins=_build_bins(df_box)
-    if not bins:
-        return {'ok':False,'error':'請至少勾選 1 個外箱（且數量>0、尺寸>0）'}
-
-    items=_build_items(df_prod)
-    if not items:
-        return {'ok':False,'error':'請至少勾選 1 個商品（且數量>0、尺寸>0）'}
-
-    # 固定配色：依商品表格順序（跨箱一致）
-    palette=['#2F3A4A','#4C6A92','#6C757D','#8E9AAF','#A3B18A','#B08968','#C9ADA7','#6D6875']
-    def _base_name(n:str)->str:
-        n=str(n or '')
-        return n.rsplit('_',1)[0] if '_' in n else n
-
-    base_order=[]
-    for _,r in df_prod.iterrows():
-        if not bool(r.get('選取', False)): 
-            continue
-        qty=int(r.get('數量',0) or 0)
-        L=_to_float(r.get('長',0) or 0); W=_to_float(r.get('寬',0) or 0); H=_to_float(r.get('高',0) or 0)
-        if qty<=0 or L<=0 or W<=0 or H<=0:
-            continue
-        base_order.append(str(r.get('商品名稱','') or '商品').strip() or '商品')
-
-    color_map={}
-    ci=0
-    for bname in base_order:
-        if bname not in color_map:
-            color_map[bname]=palette[ci%len(palette)]
-            ci += 1
-
-    def _vol(b):
-        # bins 的 l/w/h 已是 Decimal，這裡轉 float 供排序用
-        return float(b['l']*b['w']*b['h'])
-    bins_sorted=sorted(bins, key=_vol, reverse=True)
-
-    def _rot_dim(it:Item):
-        if hasattr(it,'get_dimension'):
-            d=it.get_dimension()
-            return float(d[0]),float(d[1]),float(d[2])
-        return float(it.width),float(it.height),float(it.depth)
-
-    remaining=list(items)
-    packed=[]  # [{'box':..., 'name':..., 'items':[Item...]}]
-
-    for i,b in enumerate(bins_sorted, start=1):
-        if not remaining:
-            break
-
-        packer=Packer()
-
-        # ✅ 重要：不要再 float()，直接用 Decimal 尺寸建立 Bin
-        packer.add_bin(Bin(f"{b['name']}#{i}", b['l'], b['w'], b['h'], 999999))
-
-        for it in remaining:
-            packer.add_item(it)
-
-        # 這裡不用 try/except 了（型別統一後不需要）
-        packer.pack(bigger_first=True, distribute_items=False)
-
-        bb=packer.bins[0]
-        fitted=list(getattr(bb,'items',[]) or [])
-        unfitted=list(getattr(bb,'unfitted_items',[]) or [])
-
-        if fitted:
-            packed.append({'box':b, 'name':bb.name, 'items':fitted})
-
-        remaining=unfitted
-
-    unfitted=remaining
-    all_fitted=[it for p in packed for it in p['items']]
-
-    content_wt=sum(float(getattr(it,'weight',0) or 0) for it in all_fitted)
-    tare_total=sum(float(p['box'].get('tare',0) or 0) for p in packed)
-    total_wt=content_wt+tare_total
-
-    used_item_vol=sum((_rot_dim(it)[0]*_rot_dim(it)[1]*_rot_dim(it)[2]) for it in all_fitted)
-    used_box_vol=sum(float(p['box']['l']*p['box']['w']*p['box']['h']) for p in packed)
-    util=(used_item_vol/used_box_vol*100.0) if used_box_vol>0 else 0.0
-    util=max(0.0, min(100.0, util))
-
-    if packed:
-        fig=build_3d_fig(packed[0]['box'], packed[0]['items'], color_map=color_map)
+@_fragment_every(0.5)
+def _pack_progress_block():
+    """
+    計算中的進度區：只在工作執行期間出現，自己定時重跑（不 sleep、不重跑結果區以外的畫面）；
+    計算完成時整頁 rerun 一次改為顯示結果，進度區不再出現，定時重跑也隨之停止。
+    """
+    job = st.session_state.get('_pack_job')
+    if job is None:
+        return
+    if job.done:
+        _force_rerun()
+        return
+    pg=job.progress
+    el=time.monotonic()-job.started
+    if pg.get('stage') == 'search':
+        n=max(1, int(pg.get('candidates',1)))
+        frac=min(1.0, int(pg.get('evaluated',0))/n)
+        text=(f"平行搜尋中：已評估 {pg.get('evaluated',0)}/{n} 種候選，"
+              f"目前最佳 {pg.get('boxes',0)} 箱、未裝入 {pg.get('remaining',0)} 件（{el:.1f} 秒）")
     else:
-        fig=go.Figure()
-
-    class _MiniBin:
-        def __init__(self, name, items):
-            self.name=name
-            self.items=items
-
-    packer_bins=[_MiniBin(p['name'], p['items']) for p in packed]
-    bins_input=[p['box'] for p in packed]
+        total=max(1, job.total)
+        rem=int(pg.get('remaining', total))
+        frac=min(1.0, (total-rem)/total)
+        text=f"裝箱中：已使用 {pg.get('boxes',0)} 箱，剩餘 {rem} 件待裝（{el:.1f} 秒）"
+    st.progress(frac, text=text)
+
+    if job.cancel.is_set():
+        st.info('正在停止計算，稍後顯示目前最佳結果…')
+    elif st.button('⏹️ 停止計算（保留目前最佳結果）', use_container_width=True, key='cancel_pack'):
+        job.cancel.set()
+
+_REPORT_LOCK = threading.Lock()
+_REPORT_DIR = os.path.join(tempfile.gettempdir(), 'pack_reports')
+_REPORT_MAX_AGE = 24*3600   # 超過一天的報告暫存檔（例如 session 已結束）在下次產生報告時清掉
+
+def _drop_report(res: Optional[Dict[str, Any]]):
+    # 刪除結果對應的報告暫存檔（結果被換掉、或訂單名稱改了要重建時）
+    cached = (res or {}).pop('_report', None)
+    if cached:
+        try:
+            os.remove(cached[1])
+        except OSError:
+            pass
 
-    return {
-        'ok':True,
-        'bins_input': bins_input,
-        'packer_bins': packer_bins,
-        'packed_bins': packed,
-        'used_bin_count': len(packed),
-        'unfitted': unfitted,
-        'content_wt': content_wt,
-        'total_wt': total_wt,
-        'util': util,
-        'fig': fig,
-        'color_map': color_map,
-        'report_html': ''
-    }
-#------A016：裝箱計算核心（py3dbp）+ 統計(結束)：------
+def _sweep_reports():
+    now = time.time()
+    try:
+        names = os.listdir(_REPORT_DIR)
+    except OSError:
+        return
+    for nm in names:
+        path = os.path.join(_REPORT_DIR, nm)
+        try:
+            if now-os.path.getmtime(path) > _REPORT_MAX_AGE:
+                os.remove(path)
+        except OSError:
+            pass
 
+def _report_file(res: Dict[str, Any], order_name: str) -> str:
+    """
+    下載用 HTML 報告：逐段寫入暫存檔（write_report_html），session 裡只記檔案路徑。
+    依 (result_id, 訂單名稱) 快取在結果本身，同一個結果只寫一次；訂單名稱改了就刪掉舊檔重寫。
+    由 download_button 在使用者按下時呼叫（在另一個 thread 執行，不可使用 st.*）。
+    """
+    key = (res.get('result_id'), order_name)
+    with _REPORT_LOCK:
+        cached = res.get('_report')
+        if cached and cached[0] == key and os.path.exists(cached[1]):
+            return cached[1]
+        _drop_report(res)
+        os.makedirs(_REPORT_DIR, exist_ok=True)
+        _sweep_reports()
+        path = os.path.join(_REPORT_DIR, f"{res.get('result_id') or os.getpid()}_{_safe_name(order_name)}.html")
+        write_report_html(
+            path,
+            order_name,
+            packed_bins=res.get('packed_bins') or [],
+            unfitted=res.get('unfitted') or [],
+            content_wt=float(res.get('content_wt', 0.0) or 0.0),
+            total_wt=float(res.get('total_wt', 0.0) or 0.0),
+            util=float(res.get('util', 0.0) or 0.0),
+            color_map=res.get('color_map') or {}
+        )
+        res['_report'] = (key, path)
+        return path
 
+def _report_data(res: Dict[str, Any], order_name: str) -> bytes:
+    # 下載按鈕的 data 是 callable：按下下載時才讀檔，報告內容不會留在 session 或每次 rerun 裡；
+    # 用 with 讀完立即關檔，不靠 GC 關閉（Windows 上開著的檔案無法刪除 / 覆寫）
+    with open(_report_file(res, order_name), 'rb') as f:
+        return f.read()
 
+_FIG_CACHE_MAX = 8   # 每個結果最多保留幾張已建好的 3D 圖（來回切換箱子時不必重建）
 
-#------A017：商品總件數統計(用於檔名)(開始)：------
-def _total_items(df_prod:pd.DataFrame)->int:
-    if df_prod is None or df_prod.empty: 
-        return 0
-    sel=df_prod['選取'].astype(bool)
-    return int(df_prod.loc[sel,'數量'].apply(lambda x:int(_to_float(x,0))).sum())
-#------A017：商品總件數統計(用於檔名)(結束)：------
+def _box_fig(res: Dict[str, Any], idx: int, detail: str):
+    """
+    第 idx 箱的 3D 圖：依 (箱號, detail) 快取在結果本身（同 _report_file），結果換了自然失效。
+    只保留最近用到的 _FIG_CACHE_MAX 張，箱數多時記憶體不會跟著箱數成長。
+    """
+    cache = res.setdefault('_figs', OrderedDict())
+    key = (idx, detail)
+    fig = cache.get(key)
+    if fig is None:
+        p = res['packed_bins'][idx]
+        fig = build_3d_fig(p['box'], p.get('items') or [], color_map=res.get('color_map') or {}, detail=detail)
+        cache[key] = fig
+        while len(cache) > _FIG_CACHE_MAX:
+            cache.popitem(last=False)
+    else:
+        cache.move_to_end(key)
+    return fig
 
+def _box_step(n: int, step: int):
+    # 上一箱 / 下一箱（on_click 在 rerun 前執行，可以直接改選單的值）
+    st.session_state['box3d_sel'] = (int(st.session_state.get('box3d_sel', 0))+step) % max(1, n)
 
-#------A018：結果區塊 UI（開始計算 + 顯示結果 + 下載HTML）(開始)：------
+@_fragment
 def result_block():
     st.markdown('## 3. 裝箱結果與模擬')
 
     loading = _is_loading()
+    job = st.session_state.get('_pack_job')
+    running = job is not None and not job.done
+
+    st.radio(
+        '裝箱引擎',
+        list(ENGINES.keys()),
+        format_func=lambda k: ENGINES.get(k, k),
+        horizontal=True,
+        key='pack_engine',
+        disabled=loading
+    )
+    o1, o2 = st.columns([1, 1], gap='medium')
+    with o1:
+        st.checkbox('箱型組合最佳化（箱數最少 → 體積最小 → 空箱最輕）', key='pack_optimize', disabled=loading)
+        st.checkbox('多起點商品排序（多核心平行，取箱數最少/利用率最高）', key='pack_portfolio', disabled=loading)
+    with o2:
+        st.number_input('最佳化時間上限（秒）', min_value=1.0, max_value=120.0, step=1.0, key='pack_time_limit', disabled=loading)
+        st.number_input('時間預算（秒，0=不限）', min_value=0.0, max_value=600.0, step=5.0, key='pack_time_budget', disabled=loading)
 
     # ✅ 只調整這裡：用 container(key) 包住「開始計算」按鈕
     with st.container(key="run_pack_container"):
@@ -1183,28 +795,40 @@ def result_block():
             '🚀 開始計算與 3D 模擬',
             use_container_width=True,
             key='run_pack',
-            disabled=loading
+            disabled=loading or running
         )
 
-    # ✅ 原本 if st.button(...) 的邏輯完全不變
+    # ✅ 計算改在背景 thread 執行：畫面不再被整個鎖住，可看進度、可中途停止
     if clicked:
-        _begin_loading('計算與 3D 模擬中...')
-        try:
-            df_box_src  = st.session_state.get('_box_live_df',  st.session_state.df_box)
-            df_prod_src = st.session_state.get('_prod_live_df', st.session_state.df_prod)
-
-            st.session_state.df_box  = _sanitize_box(df_box_src)
-            st.session_state.df_prod = _sanitize_prod(df_prod_src)
-
-            with st.spinner('計算中...'):
-                st.session_state.last_result = pack_and_render(
-                    st.session_state.order_name,
-                    st.session_state.df_box,
-                    st.session_state.df_prod
-                )
-            _force_rerun()
-        finally:
-            _end_loading()
+        df_box_src  = st.session_state.get('_box_live_df',  st.session_state.df_box)
+        df_prod_src = st.session_state.get('_prod_live_df', st.session_state.df_prod)
+
+        st.session_state.df_box  = _sanitize_box(df_box_src)
+        st.session_state.df_prod = _sanitize_prod(df_prod_src)
+
+        budget = float(st.session_state.get('pack_time_budget', 0.0) or 0.0)
+        job = st.session_state['_pack_job'] = _PackJob(
+            order_name=st.session_state.order_name,
+            df_box=st.session_state.df_box,
+            df_prod=st.session_state.df_prod,
+            engine=st.session_state.get('pack_engine', 'py3dbp'),
+            optimize=bool(st.session_state.get('pack_optimize', False)),
+            portfolio=bool(st.session_state.get('pack_portfolio', False)),
+            time_limit=float(st.session_state.get('pack_time_limit', 10.0) or 10.0),
+            time_budget=(budget if budget > 0 else None)
+        )
+        running = True
+        _force_rerun('fragment')   # 重畫「開始計算」按鈕為停用；整頁執行中不能只重跑片段時，直接往下顯示進度
+
+    if running:
+        _pack_progress_block()
+        return
+
+    if job is not None and job.done:
+        with _REPORT_LOCK:
+            _drop_report(st.session_state.get('last_result'))
+        st.session_state.last_result = job.result
+        st.session_state.pop('_pack_job', None)
 
     res = st.session_state.get('last_result')
     if not res:
@@ -1217,18 +841,6 @@ def result_block():
     unfitted = res.get('unfitted') or []
     color_map = res.get('color_map') or {}
 
-    # ✅ 每次顯示時都用「目前結果」重建 report_html，確保下載內容與畫面一致
-    res['report_html'] = build_report_html(
-        st.session_state.order_name,
-        packed_bins=packed_bins,
-        unfitted=unfitted,
-        content_wt=float(res.get('content_wt', 0.0) or 0.0),
-        total_wt=float(res.get('total_wt', 0.0) or 0.0),
-        util=float(res.get('util', 0.0) or 0.0),
-        color_map=color_map
-    )
-    st.session_state.last_result = res
-
     # ===== 報告摘要 =====
     st.markdown("### 🧾 訂單裝箱報告")
 
@@ -1247,30 +859,56 @@ def result_block():
         unsafe_allow_html=True
     )
 
+    if res.get('partial'):
+        why = '已手動停止' if res.get('stop_reason') == 'cancelled' else '已達時間預算'
+        st.warning(f'計算{why}（{float(res.get("elapsed",0.0) or 0.0):.1f} 秒）：以下為目前的部分結果，未裝入的商品尚未嘗試其餘箱子。')
+
+    opt = res.get('optimizer')
+    if opt:
+        st.caption(
+            f"平行搜尋：評估 {opt['evaluated']}/{opt['candidates']} 種候選（箱型順序 × 商品排序），耗時 {opt['elapsed']:.2f} 秒"
+            f"{'（已達時間上限）' if opt['timed_out'] else ''}；原本 {opt['baseline_boxes']} 箱 → 目前 {used_bin_count} 箱"
+            f"（商品排序：{opt['best_item_order']}）"
+        )
+
+    if res.get('cache_hit'):
+        cs = _RESULT_CACHE.stats()
+        st.caption(
+            f"⚡ 相同箱型 / 商品 / 設定已計算過，直接取用快取結果（{float(res.get('elapsed',0.0) or 0.0)*1000:.0f} ms）；"
+            f"快取命中率 {cs['hit_rate']*100:.0f}%（{cs['hits']}/{cs['hits']+cs['misses']}），共 {cs['entries']} 筆"
+        )
+
+    bounds = res.get('bounds') or {}
+    if bounds.get('boxes'):
+        st.caption(f"箱數理論下限：{bounds['boxes']} 箱（體積下限 {bounds['volume']} / 大件下限 {bounds['dims']}）")
+
     # 未裝入警示
     if unfitted:
+        oversize = set(bounds.get('oversize') or [])
         counts = {}
-        for it in unfitted:
-            base = str(it.name).split('_')[0]
-            counts[base] = counts.get(base, 0) + 1
+        for sk, n in unfitted:
+            counts[sk.name] = counts.get(sk.name, 0) + n
         st.warning('注意：有部分商品裝不下！（可能是箱型庫存不足或尺寸不夠）')
         for k, v in counts.items():
-            st.error(f"{k}：超過 {v} 個")
+            big = any(sk.name == k and sk.id in oversize for sk, _ in unfitted)
+            st.error(f"{k}：超過 {v} 個{'（尺寸大於所有勾選的箱型）' if big else ''}")
 
 
     # ===== 下載完整報告 =====
     ts = _now_tw().strftime('%Y%m%d_%H%M')
     fname = f"{_safe_name(st.session_state.order_name)}_{ts}_總數{_total_items(st.session_state.df_prod)}件.html"
+    # ✅ 報告在按下下載時才建立（逐段寫入暫存檔、同一個結果只寫一次，見 _report_file），一般 rerun 不再重建
+    order_name = st.session_state.order_name
     st.download_button(
         '⬇️ 下載完整裝箱報告（.html）',
-        data=res['report_html'].encode('utf-8'),
+        data=lambda: _report_data(res, order_name),
         file_name=fname,
         mime='text/html',
         use_container_width=True,
         key='dl_report'
     )
 
-    # ===== 3D：改回 Tabs（每箱一頁）+ 旁邊顯示 legend =====
+    # ===== 3D：一次只畫選到的那一箱（選單 / 上一箱 / 下一箱）+ 旁邊顯示 legend =====
     if not packed_bins:
         st.info("本次沒有任何箱子成功裝入商品（可能全部商品尺寸不合）。")
         return
@@ -1286,25 +924,50 @@ def result_block():
         )
     legend_html += "</div>"
 
-    tab_titles = [f"{p['name']}（裝入 {len(p.get('items') or [])} 件）" for p in packed_bins]
-    tabs = st.tabs(tab_titles)
-
-    for idx, (t, p) in enumerate(zip(tabs, packed_bins), start=1):
-        with t:
-            box_meta = p['box']
-            fitted = list(p.get('items') or [])
-
-            c1, c2 = st.columns([1, 3], gap='large')
-            with c1:
-                st.markdown(legend_html, unsafe_allow_html=True)
-                st.markdown(
-                    f"<div style='margin-top:10px;color:#444'>箱子尺寸：{box_meta['l']} × {box_meta['w']} × {box_meta['h']}</div>",
-                    unsafe_allow_html=True
-                )
-            with c2:
-                fig = build_3d_fig(box_meta, fitted, color_map=color_map)
-                # ✅ 關鍵修正：多箱(tab)時，每個 plotly_chart 必須有唯一 key，避免 DuplicateElementId
-                st.plotly_chart(fig, use_container_width=True, key=f"box3d_{idx}")
+    # ✅ 原本每箱一個 tab、每次 rerun 全部重畫；改成只建立 / 傳送目前這一箱的圖，箱數多也一樣快
+    n_bins = len(packed_bins)
+    if st.session_state.get('box3d_sel', 0) >= n_bins:
+        st.session_state['box3d_sel'] = 0
+    b1, b2, b3 = st.columns([1, 6, 1])
+    with b1:
+        st.button('◀ 上一箱', on_click=_box_step, args=(n_bins, -1), disabled=n_bins <= 1,
+                  use_container_width=True, key='box3d_prev')
+    with b2:
+        idx = st.selectbox(
+            '檢視箱子',
+            list(range(n_bins)),
+            format_func=lambda i: f"第 {i+1}/{n_bins} 箱：{packed_bins[i]['name']}（裝入 {len(packed_bins[i].get('items') or [])} 件）",
+            key='box3d_sel',
+            label_visibility='collapsed'
+        )
+    with b3:
+        st.button('下一箱 ▶', on_click=_box_step, args=(n_bins, 1), disabled=n_bins <= 1,
+                  use_container_width=True, key='box3d_next')
+
+    p = packed_bins[idx]
+    box_meta = p['box']
+    fitted = p.get('items') or []
+
+    c1, c2 = st.columns([1, 3], gap='large')
+    detail = 'auto'
+    with c1:
+        st.markdown(legend_html, unsafe_allow_html=True)
+        st.markdown(
+            f"<div style='margin-top:10px;color:#444'>箱子尺寸：{' × '.join(_fmt_dim(box_meta[k], box_meta.get('scale',1)) for k in ('l','w','h'))}</div>",
+            unsafe_allow_html=True
+        )
+        # 件數多時預設簡化（不畫邊框 / 合併相鄰同款 / 只畫外層），需要時可切換成完整細節
+        if len(fitted) > _LOD_EDGES_MAX:
+            detail = st.radio(
+                '3D 顯示細節',
+                list(LOD_MODES.keys()),
+                format_func=lambda k: LOD_MODES.get(k, k),
+                key=f"box3d_detail_{idx+1}"
+            )
+    with c2:
+        fig = _box_fig(res, idx, detail)
+        # ✅ 關鍵修正：每箱的 plotly_chart 用各自的 key，避免 DuplicateElementId
+        st.plotly_chart(fig, use_container_width=True, key=f"box3d_{idx+1}")
 #------A018：結果區塊 UI（開始計算 + 顯示結果 + 下載HTML）(結束)：------
 
 
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+本機 GAS 模擬伺服器（只用標準函式庫）：實作與 Apps Script 相同的模板協定，測試 / 開發時不必連雲端。
+
+    GET  ?action=list&sheet=S                       {"ok":true,"items":["名稱",...]}
+    GET  ?action=get&sheet=S&name=N                 {"ok":true,"payload_json":"..."}
+    POST ?action=upsert&sheet=S&name=N              body {"payload_json":"..."}  → {"ok":true,"version":"..."}
+    GET  ?action=delete&sheet=S&name=N              {"ok":true}
+    GET  ?action=list_full&sheet=S[&payloads=0]     {"ok":true,"items":[{"name","version","payload_json"?},...]}
+    POST ?action=batch                              body {"ops":[{"action","sheet","name","payload_json"?},...]}
+                                                    → {"ok":true,"results":[每個動作的回應,...]}（依序執行）
+
+- 每個請求都要帶 token（--token），錯誤一律回 {"ok":false,"error":"..."}（HTTP 200，與 Apps Script 相同）。
+- batch 可用的動作：list / get / upsert / delete / list_full，以及 create（同名已存在回 error="exists"）。
+- version：每次寫入遞增的序號 + payload 雜湊，內容沒變就不變。
+- --latency 模擬 Apps Script 每次往返的延遲；--legacy 只支援舊的單一動作（測試用戶端退回舊協定）。
+
+用法：
+    python gas_stub.py --port 8790 --token dev --data /tmp/gas_stub.json --latency 1.5
+    GAS_URL=http://127.0.0.1:8790/exec GAS_TOKEN=dev streamlit run app.py
+"""
+#------D001：匯入套件(開始)：------
+import os, sys, json, time, hashlib, argparse, threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from typing import Dict, Any, Optional
+#------D001：匯入套件(結束)：------
+
+
+#------D002：模板資料（記憶體 + 可選 JSON 檔）(開始)：------
+class TemplateStore:
+    """{sheet: {name: {'payload_json', 'version'}}}；有給 path 時每次寫入後存檔，重啟後沿用。"""
+    def __init__(self, path:Optional[str]=None):
+        self.path=path
+        self._lock=threading.Lock()
+        self._seq=0
+        self.sheets: Dict[str,Dict[str,Dict[str,str]]] = {}
+        if path and os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                d=json.load(f)
+            self.sheets=d.get('sheets') or {}
+            self._seq=int(d.get('seq') or 0)
+
+    def _save(self):
+        if not self.path:
+            return
+        tmp=f'{self.path}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'seq': self._seq, 'sheets': self.sheets}, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+    def _version(self, payload_json:str)->str:
+        self._seq += 1
+        return f"{self._seq}-{hashlib.sha1(payload_json.encode('utf-8')).hexdigest()[:10]}"
+
+    def op(self, action:str, sheet:str, name:str='', payload_json:Optional[str]=None, payloads:bool=True)->Dict[str,Any]:
+        with self._lock:
+            rows=self.sheets.get(sheet) or {}
+            if action == 'list':
+                return {'ok': True, 'items': sorted(rows)}
+            if action == 'list_full':
+                items=[]
+                for nm in sorted(rows):
+                    it={'name': nm, 'version': rows[nm]['version']}
+                    if payloads:
+                        it['payload_json']=rows[nm]['payload_json']
+                    items.append(it)
+                return {'ok': True, 'items': items}
+            if not name:
+                return {'ok': False, 'error': 'missing_name'}
+            if action == 'get':
+                if name not in rows:
+                    return {'ok': False, 'error': 'not_found'}
+                return {'ok': True, 'payload_json': rows[name]['payload_json'], 'version': rows[name]['version']}
+            if action in ('upsert', 'create'):
+                if action == 'create' and name in rows:
+                    return {'ok': False, 'error': 'exists'}
+                body=payload_json if isinstance(payload_json, str) else '{}'
+                cur=rows.get(name)
+                if cur is None or cur['payload_json'] != body:
+                    rows[name]={'payload_json': body, 'version': self._version(body)}
+                    self.sheets[sheet]=rows
+                    self._save()
+                return {'ok': True, 'version': rows[name]['version']}
+            if action == 'delete':
+                if name not in rows:
+                    return {'ok': False, 'error': 'not_found'}
+                del rows[name]
+                self._save()
+                return {'ok': True}
+            return {'ok': False, 'error': f'unknown_action: {action}'}
+#------D002：模板資料（記憶體 + 可選 JSON 檔）(結束)：------
+
+
+#------D003：HTTP 介面(開始)：------
+_LEGACY=('list', 'get', 'upsert', 'delete')
+_BULK=_LEGACY+('list_full', 'create')
+
+class StubHandler(BaseHTTPRequestHandler):
+    server_version='GASStub/1.0'
+    protocol_version='HTTP/1.1'
+    store:Optional[TemplateStore]=None
+    token=''
+    latency=0.0
+    legacy=False
+    quiet=False
+
+    def _send(self, payload:Dict[str,Any]):
+        body=json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self, body:Dict[str,Any]):
+        if self.latency:
+            time.sleep(self.latency)
+        q={k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+        if q.get('token') != self.token:
+            return self._send({'ok': False, 'error': 'unauthorized'})
+        action=q.get('action', '')
+        if action == 'batch' and not self.legacy:
+            ops=body.get('ops')
+            if not isinstance(ops, list):
+                return self._send({'ok': False, 'error': 'missing_ops'})
+            results=[]
+            for o in ops:
+                o=o if isinstance(o, dict) else {}
+                a=str(o.get('action') or '')
+                results.append(self.store.op(a, str(o.get('sheet') or ''), str(o.get('name') or ''),
+                                             o.get('payload_json'), str(o.get('payloads', '1')) != '0')
+                               if a in _BULK else {'ok': False, 'error': f'unknown_action: {a}'})
+            return self._send({'ok': True, 'results': results})
+        if action not in (_LEGACY if self.legacy else _BULK):
+            return self._send({'ok': False, 'error': f'unknown_action: {action}'})
+        self._send(self.store.op(action, q.get('sheet', ''), q.get('name', ''), body.get('payload_json'),
+                                 q.get('payloads', '1') != '0'))
+
+    def do_GET(self):
+        self._handle({})
+
+    def do_POST(self):
+        try:
+            n=int(self.headers.get('Content-Length') or 0)
+            body=json.loads(self.rfile.read(n).decode('utf-8') or '{}') if n > 0 else {}
+        except Exception as e:
+            return self._send({'ok': False, 'error': f'bad_json: {e}'})
+        self._handle(body if isinstance(body, dict) else {})
+
+    def log_message(self, fmt, *args):
+        if not self.quiet:
+            super().log_message(fmt, *args)
+#------D003：HTTP 介面(結束)：------
+
+
+#------D004：程式進入點(開始)：------
+def make_server(host:str='127.0.0.1', port:int=0, token:str='dev', data:Optional[str]=None,
+                latency:float=0.0, legacy:bool=False, quiet:bool=True):
+    store=TemplateStore(data)
+    attrs={'store': store, 'token': token, 'latency': float(latency), 'legacy': legacy, 'quiet': quiet}
+    srv=ThreadingHTTPServer((host, port), type('Handler', (StubHandler,), attrs))
+    srv.daemon_threads=True
+    return srv
+
+def main(argv=None)->int:
+    ap=argparse.ArgumentParser(description='本機 GAS 模板協定模擬伺服器')
+    ap.add_argument('--host', default='127.0.0.1')
+    ap.add_argument('--port', type=int, default=8790)
+    ap.add_argument('--token', default='dev')
+    ap.add_argument('--data', default=None, help='模板存檔（JSON）；不給則只存在記憶體')
+    ap.add_argument('--latency', type=float, default=0.0, help='每次往返的模擬延遲（秒）')
+    ap.add_argument('--legacy', action='store_true', help='只支援舊的單一動作（list / get / upsert / delete）')
+    ap.add_argument('--quiet', action='store_true', help='不輸出每筆請求的存取紀錄')
+    a=ap.parse_args(argv)
+    srv=make_server(a.host, a.port, a.token, a.data, a.latency, a.legacy, a.quiet)
+    print(f'GAS 模擬伺服器：http://{a.host}:{srv.server_address[1]}/exec（token={a.token}）', file=sys.stderr)
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        srv.server_close()
+    return 0
+
+if __name__=='__main__':
+    sys.exit(main())
+#------D004：程式進入點(結束)：------
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""
+批次裝箱（不開 Streamlit）：讀入多筆訂單，用 process pool 平行計算，每筆訂單輸出一行 JSON。
+
+輸入（依副檔名判斷，或用 --format 指定）：
+- JSONL：每行一筆訂單
+    {"order": "訂單A", "boxes": {"rows": [...]}, "products": {"rows": [...]}}
+  boxes / products 與模板 payload 相同（_box_payload / _prod_payload），也可以直接給 rows 陣列。
+- CSV：每列一個外箱或商品，以 order 欄分組：
+    order,kind,selected,name,l,w,h,qty,tare,wt,orient
+  kind=box 用 tare；kind=product 用 wt / orient；selected 空白視為勾選。
+
+用法：
+    python pack_cli.py orders.jsonl -o results.jsonl --engine numpy --workers 8 --html-dir reports/
+"""
+#------B001：匯入套件(開始)：------
+import os, sys, csv, json, time, argparse
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Any, List, Iterator, Optional
+#------B001：匯入套件(結束)：------
+
+
+#------B002：訂單讀取（JSONL / CSV）(開始)：------
+def _rows(v)->List[Dict[str,Any]]:
+    if isinstance(v, dict):
+        v=v.get('rows', [])
+    return [r for r in (v or []) if isinstance(r, dict)]
+
+def read_jsonl(path:str)->Iterator[Dict[str,Any]]:
+    with open(path, encoding='utf-8-sig') as f:
+        for i, line in enumerate(f, start=1):
+            line=line.strip()
+            if not line:
+                continue
+            try:
+                d=json.loads(line)
+            except Exception as e:
+                yield {'order': f'第{i}行', 'error': f'JSON 格式錯誤：{e}'}
+                continue
+            yield {
+                'order': str(d.get('order') or d.get('name') or f'第{i}行'),
+                'boxes': _rows(d.get('boxes')),
+                'products': _rows(d.get('products')),
+            }
+
+def _selected(v)->bool:
+    s=str(v if v is not None else '').strip().lower()
+    return s not in ('0', 'false', 'no', 'n', 'f')
+
+def read_csv(path:str)->Iterator[Dict[str,Any]]:
+    # 依 order 欄分組（保留第一次出現的順序）；整個檔案讀完才知道每筆訂單是否完整
+    orders=OrderedDict()
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        for r in csv.DictReader(f):
+            name=str(r.get('order') or '').strip()
+            if not name:
+                continue
+            o=orders.setdefault(name, {'order': name, 'boxes': [], 'products': []})
+            kind=str(r.get('kind') or '').strip().lower()
+            row={
+                'selected': _selected(r.get('selected')),
+                'name': str(r.get('name') or '').strip(),
+                'l': r.get('l'), 'w': r.get('w'), 'h': r.get('h'),
+                'qty': r.get('qty'),
+            }
+            if kind in ('box', '外箱'):
+                row['tare']=r.get('tare')
+                o['boxes'].append(row)
+            elif kind in ('product', 'prod', '商品'):
+                row['wt']=r.get('wt')
+                row['orient']=str(r.get('orient') or '自動').strip()
+                o['products'].append(row)
+    yield from orders.values()
+#------B002：訂單讀取（JSONL / CSV）(結束)：------
+
+
+#------B003：worker（每個程序只載入一次裝箱核心）(開始)：------
+_W: Dict[str,Any] = {}
+
+def _load_core():
+    # 只載入裝箱核心（不載入 Streamlit / pandas；plotly 只在要輸出 HTML 報告時才載入）
+    import pack_core
+    return pack_core
+
+def _init_worker(opts:Dict[str,Any]):
+    _W['core']=_load_core()
+    _W['opts']=opts
+
+def pack_order(order:Dict[str,Any], opts:Optional[Dict[str,Any]]=None)->Dict[str,Any]:
+    """單筆訂單：rows → 清理（_box_rows / _prod_rows）→ pack_and_render → plan_json（可選擇另存 HTML 報告）。
+    opts 未給時用 _init_worker 設定的批次參數（pack_service 會逐筆請求帶入）。
+    opts['deadline']：絕對截止時間（time.time()）；排隊期間也在倒數，開始計算時才換成剩下的時間預算，已過期就不計算。"""
+    core=_W.get('core') or _load_core()
+    opts=opts if opts is not None else (_W.get('opts') or {})
+    name=order.get('order') or '訂單'
+    if order.get('error'):
+        return {'order': name, 'ok': False, 'error': order['error']}
+    t0=time.monotonic()
+    budget, limit = opts.get('time_budget'), opts.get('time_limit', 10.0)
+    if opts.get('deadline') is not None:
+        left=float(opts['deadline'])-time.time()
+        if left <= 0:
+            return {'order': name, 'ok': False, 'expired': True, 'error': '排隊期間已超過時間預算，未計算', 'elapsed': 0.0}
+        budget=min(budget, left) if budget else left
+        limit=min(limit, left) if limit else limit
+    try:
+        df_box=core._box_rows({'rows': order.get('boxes') or []})
+        df_prod=core._prod_rows({'rows': order.get('products') or []})
+        res=core.pack_and_render(
+            name, df_box, df_prod,
+            engine=opts.get('engine', 'py3dbp'),
+            optimize=opts.get('optimize', False),
+            portfolio=opts.get('portfolio', False),
+            time_limit=limit,
+            workers=1,   # 已經是多程序批次：單筆訂單內不再開 process pool
+            time_budget=budget,
+            use_cache=opts.get('use_cache', True),
+            render=False,
+        )
+        out=core.plan_json(name, res, placements=opts.get('placements', True))
+        html_dir=opts.get('html_dir')
+        if html_dir and res.get('ok'):
+            path=os.path.join(html_dir, f"{core._safe_name(name)}.html")
+            core.write_report_html(
+                path, name,
+                packed_bins=res['packed_bins'],
+                unfitted=res['unfitted'],
+                content_wt=float(res['content_wt']),
+                total_wt=float(res['total_wt']),
+                util=float(res['util']),
+                color_map=res['color_map'],
+                plotlyjs=opts.get('html_plotlyjs', 'inline'),
+            )
+            out['report']=path
+    except Exception as e:
+        out={'order': name, 'ok': False, 'error': f'{type(e).__name__}: {e}'}
+    out['elapsed']=round(time.monotonic()-t0, 3)
+    return out
+#------B003：worker（每個程序只載入一次裝箱核心）(結束)：------
+
+
+#------B004：程式進入點(開始)：------
+def _parse_args(argv:Optional[List[str]]=None):
+    ap=argparse.ArgumentParser(description='批次 3D 裝箱：讀入 CSV / JSONL 訂單，輸出每筆訂單一行 JSON。')
+    ap.add_argument('input', help='訂單檔（.jsonl / .csv）')
+    ap.add_argument('-o', '--output', default='-', help='輸出 JSONL（預設 stdout）')
+    ap.add_argument('--format', choices=['jsonl', 'csv'], help='輸入格式（預設依副檔名）')
+    ap.add_argument('--engine', choices=['py3dbp', 'numpy'], default='py3dbp')
+    ap.add_argument('--optimize', action='store_true', help='箱型組合最佳化（逐筆訂單在本程序內搜尋）')
+    ap.add_argument('--portfolio', action='store_true', help='多起點商品排序')
+    ap.add_argument('--time-limit', type=float, default=10.0, help='最佳化搜尋時間上限（秒）')
+    ap.add_argument('--time-budget', type=float, default=None, help='單筆訂單計算時間預算（秒），超過回傳部分結果')
+    ap.add_argument('--workers', type=int, default=None, help='程序數（預設 CPU 數）')
+    ap.add_argument('--chunksize', type=int, default=16, help='每次派給 worker 的訂單數')
+    ap.add_argument('--html-dir', default=None, help='另存每筆訂單的 HTML 報告到此資料夾')
+    ap.add_argument('--html-plotlyjs', choices=['inline', 'cdn'], default='inline',
+                    help='報告內 plotly.js：inline＝每份報告內嵌（離線可開，約 4.8MB）；cdn＝只放連結')
+    ap.add_argument('--no-placements', action='store_true', help='輸出不含每件商品的擺放位置')
+    ap.add_argument('--no-cache', action='store_true', help='不使用持久結果快取')
+    return ap.parse_args(argv)
+
+def main(argv:Optional[List[str]]=None)->int:
+    a=_parse_args(argv)
+    fmt=a.format or ('csv' if a.input.lower().endswith('.csv') else 'jsonl')
+    orders=read_csv(a.input) if fmt == 'csv' else read_jsonl(a.input)
+    if a.html_dir:
+        os.makedirs(a.html_dir, exist_ok=True)
+    opts={
+        'engine': a.engine, 'optimize': a.optimize, 'portfolio': a.portfolio,
+        'time_limit': a.time_limit, 'time_budget': a.time_budget,
+        'use_cache': not a.no_cache, 'placements': not a.no_placements,
+        'html_dir': a.html_dir, 'html_plotlyjs': a.html_plotlyjs,
+    }
+    workers=a.workers or os.cpu_count() or 1
+
+    out=sys.stdout if a.output == '-' else open(a.output, 'w', encoding='utf-8')
+    t0=time.monotonic(); n=0; failed=0
+    try:
+        if workers <= 1:
+            _init_worker(opts)
+            results=map(pack_order, orders)
+            ex=None
+        else:
+            # 先在主程序載入一次：fork 出來的 worker 直接共用，不必各自重新 import
+            _load_core()
+            ex=ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(opts,))
+            results=ex.map(pack_order, orders, chunksize=max(1, a.chunksize))
+        for r in results:
+            out.write(json.dumps(r, ensure_ascii=False)+'\n')
+            n += 1
+            failed += 0 if r.get('ok') else 1
+            if n % 500 == 0:
+                print(f'已完成 {n} 筆（{n/(time.monotonic()-t0):.1f} 筆/秒）', file=sys.stderr)
+        if ex is not None:
+            ex.shutdown()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    print(f'完成 {n} 筆，失敗 {failed} 筆，耗時 {time.monotonic()-t0:.1f} 秒', file=sys.stderr)
+    return 1 if failed else 0
+
+if __name__=='__main__':
+    sys.exit(main())
+#------B004：程式進入點(結束)：------
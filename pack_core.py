@@ -0,0 +1,2718 @@
+# -*- coding: utf-8 -*-
+"""
+裝箱核心（不含 Streamlit 畫面）：外箱/商品資料清理、裝箱引擎、平行搜尋、結果快取、3D 圖與 HTML 報告。
+app.py（畫面）、pack_cli.py（批次）、pack_service.py（HTTP 服務）與 process pool 的 worker 都從這裡 import。
+
+載入成本：頂層只用標準函式庫；pandas / numpy / plotly / py3dbp / requests 都等到真的用到才 import
+（例如只用 NumPy 引擎、不畫圖的 worker 就完全不載入 pandas / plotly / py3dbp）。
+"""
+#------A001：匯入套件(開始)：------
+import os, sys, json, re, time, random, itertools, threading, hashlib, sqlite3, zlib, pickle, uuid, multiprocessing, tempfile
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Dict, Any, List, Optional, Tuple
+#------A001：匯入套件(結束)：------
+
+
+#------A003：Secrets/環境變數讀取工具(開始)：------
+def _secret(k:str, d:str='')->str:
+    # 在 Streamlit 裡（已載入）才讀 st.secrets；批次 / 服務只讀環境變數，不為此載入 Streamlit
+    st=sys.modules.get('streamlit')
+    if st is not None:
+        try:
+            return str(st.secrets.get(k, d))
+        except Exception:
+            pass
+    return os.getenv(k, d) or d
+#------A003：Secrets/環境變數讀取工具(結束)：------
+
+
+#------A004：通用工具函式(型別/時間/檔名安全)(開始)：------
+def _to_float(x, default=0.0)->float:
+    try:
+        return float(x)
+    except Exception:
+        try:
+            return float(str(x).strip())
+        except Exception:
+            return float(default)
+
+def _now_tw()->datetime:
+    return datetime.utcnow()+timedelta(hours=8)
+
+def _safe_name(s:str)->str:
+    s=(s or '').strip() or '訂單'
+    s=re.sub(r'[\\/:*?"<>| ]+','_',s)
+    return s[:60]
+
+def _cache_file(name:str)->str:
+    """
+    本機快取檔的預設位置：$XDG_CACHE_HOME（未設定時 ~/.cache）/yimimi/name；
+    該資料夾建不起來或不可寫（唯讀家目錄、容器等）改用系統暫存資料夾。不放在程式碼旁邊（部署目錄常是唯讀 / 共用）。
+    """
+    base=os.getenv('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    for d in (os.path.join(base, 'yimimi'), tempfile.gettempdir()):
+        try:
+            os.makedirs(d, exist_ok=True)
+            if os.access(d, os.W_OK):
+                return os.path.join(d, name)
+        except OSError:
+            continue
+    return os.path.join(tempfile.gettempdir(), name)
+#------A004：通用工具函式(型別/時間/檔名安全)(結束)：------
+
+
+
+#------A005：Google Apps Script(GAS) API Client(開始)：------
+_GAS_CONNECT_TIMEOUT=_to_float(_secret('GAS_CONNECT_TIMEOUT','5'), 5.0)    # 連線逾時（秒）
+_GAS_READ_TIMEOUT=_to_float(_secret('GAS_READ_TIMEOUT','30'), 30.0)        # 等待回應逾時（秒）；Apps Script 冷啟動常要數秒
+_GAS_RETRY_BUDGET=_to_float(_secret('GAS_RETRY_BUDGET','45'), 45.0)        # 單次操作（含重試與等待）總時間上限（秒）
+_GAS_MAX_TRIES=4
+_GAS_BACKOFF=(0.5, 8.0)     # 重試等待：random(0, min(上限, 基數*2^n))（full jitter，避免大家同時重打）
+_GAS_RETRY_STATUS={429, 500, 502, 503, 504}
+_GAS_IDEMPOTENT={'list', 'get', 'upsert', 'list_full'}   # 已送達但回應逾時時可安全重送的動作（delete 不重送，避免誤報「找不到」）
+
+_GAS_HTTP: Dict[str,Any] = {}
+_GAS_HTTP_LOCK=threading.Lock()
+
+def _gas_session():
+    """
+    整個程序共用一個 requests.Session（所有 GASClient / 所有 Streamlit session）：
+    連線池保持 keep-alive，不必每次操作都重新 TLS 握手。重試由 GASClient._call 自己控制（adapter 不重試）。
+    """
+    with _GAS_HTTP_LOCK:
+        sess=_GAS_HTTP.get('session')
+        if sess is None:
+            import requests   # 只有真的呼叫 GAS 才載入
+            from requests.adapters import HTTPAdapter
+            sess=requests.Session()
+            adapter=HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=0)
+            sess.mount('https://', adapter)
+            sess.mount('http://', adapter)
+            _GAS_HTTP['session']=sess
+        return sess
+
+class _GASStats:
+    """GAS 呼叫的延遲 / 錯誤計數（整個程序共用），給監控或畫面顯示。"""
+    def __init__(self, window:int=200):
+        self._lock=threading.Lock()
+        self._lat=[]            # 最近 window 次操作的延遲（秒，含重試）
+        self._window=window
+        self._n={'calls': 0, 'ok': 0, 'errors': 0, 'retries': 0, 'timeouts': 0}
+        self._by_action: Dict[str,int] = {}
+        self.last_error=''
+
+    def record(self, action:str, elapsed:float, ok:bool, retries:int, timeouts:int, error:str=''):
+        with self._lock:
+            self._n['calls'] += 1
+            self._n['ok' if ok else 'errors'] += 1
+            self._n['retries'] += retries
+            self._n['timeouts'] += timeouts
+            self._by_action[action]=self._by_action.get(action, 0)+1
+            self._lat.append(elapsed)
+            if len(self._lat) > self._window:
+                del self._lat[0]
+            if error:
+                self.last_error=error
+
+    def snapshot(self)->Dict[str,Any]:
+        with self._lock:
+            lat=sorted(self._lat)
+            out=dict(self._n)
+            out['by_action']=dict(self._by_action)
+            out['last_error']=self.last_error
+        pick=lambda q: round(lat[min(len(lat)-1, int(q*len(lat)))], 3) if lat else 0.0
+        out.update({'p50': pick(0.5), 'p95': pick(0.95), 'max': round(lat[-1], 3) if lat else 0.0})
+        out['error_rate']=(out['errors']/out['calls']) if out['calls'] else 0.0
+        return out
+
+_GAS_STATS=_GASStats()
+
+def gas_stats()->Dict[str,Any]:
+    return _GAS_STATS.snapshot()
+
+_GAS_NO_BULK=set()   # 不支援批次協定（list_full / batch）的 GAS 網址
+
+def _parse_payload(raw)->Optional[Dict[str,Any]]:
+    try: 
+        return json.loads(raw) if raw else {}
+    except Exception: 
+        return None
+
+def _listing(items:List[Any])->Dict[str,Dict[str,Any]]:
+    # list_full 的 items → {名稱: {'payload', 'version'}}；沒帶 payload_json 的項目 payload 為 None
+    out={}
+    for it in items:
+        if not isinstance(it, dict) or not str(it.get('name') or ''):
+            continue
+        out[str(it['name'])]={
+            'payload': _parse_payload(it['payload_json']) if 'payload_json' in it else None,
+            'version': (str(it['version']) if it.get('version') is not None else None),
+        }
+    return out
+
+class GASClient:
+    def __init__(self,url:str,token:str,timeout:Optional[Tuple[float,float]]=None,budget:Optional[float]=None):
+        self.url=url.strip(); self.token=token.strip()
+        self.timeout=timeout or (_GAS_CONNECT_TIMEOUT, _GAS_READ_TIMEOUT)
+        self.budget=_GAS_RETRY_BUDGET if budget is None else float(budget)
+
+    @property
+    def ready(self)->bool: 
+        return bool(self.url and self.token)
+
+    def _send(self, params:Dict[str,Any], body:Optional[Dict[str,Any]], timeout:Tuple[float,float]):
+        sess=_gas_session()
+        if body is not None:
+            return sess.post(self.url, params=params, json=body, timeout=timeout)
+        return sess.get(self.url, params=params, timeout=timeout)
+
+    def _call(self, action:str, sheet:str='', name:str='', payload:Optional[Dict[str,Any]]=None,
+              body:Optional[Dict[str,Any]]=None, extra:Optional[Dict[str,str]]=None)->Dict[str,Any]:
+        """
+        一次 GAS 操作：共用連線池、每次嘗試都有連線 / 讀取逾時；暫時性錯誤（連不上、逾時、429/5xx）
+        依 full jitter 退避重試，總時間不超過 self.budget。結果一律回傳 dict（失敗為 ok=False）；
+        沒收到伺服器回應（連線 / 逾時 / HTTP 錯誤）時另外標 _local=True，和 GAS 回傳的錯誤區分。
+        """
+        if not self.ready: 
+            return {'ok':False,'error':'missing_gas_config','_local':True}
+        params={'action':action,'sheet':sheet,'token':self.token}
+        if name: 
+            params['name']=name
+        params.update(extra or {})
+        if action=='upsert':
+            body={'payload_json': json.dumps(payload or {}, ensure_ascii=False)}
+        import requests
+        t0=time.monotonic(); deadline=t0+self.budget
+        retries=timeouts=0
+        out: Dict[str,Any] = {'ok':False,'error':'未知錯誤'}
+        for attempt in range(_GAS_MAX_TRIES):
+            left=deadline-time.monotonic()
+            if left <= 0:
+                break
+            # 每次嘗試的逾時不超過剩餘預算
+            timeout=(min(self.timeout[0], left), min(self.timeout[1], left))
+            retry=False
+            try:
+                r=self._send(params, body, timeout)
+                if r.status_code in _GAS_RETRY_STATUS:
+                    r.close()
+                    out={'ok':False,'error':f'HTTP {r.status_code}','_local':True}
+                    retry=True
+                else:
+                    try:
+                        out=r.json()
+                    except ValueError:
+                        out={'ok':False,'error':f'回應不是 JSON（HTTP {r.status_code}）','_local':True}
+            except requests.exceptions.ConnectTimeout as e:
+                # 連線都沒建立：請求沒送出，任何動作都可重送
+                out={'ok':False,'error':f'連線逾時：{e}','_local':True}; timeouts += 1; retry=True
+            except requests.exceptions.Timeout as e:
+                out={'ok':False,'error':f'回應逾時：{e}','_local':True}; timeouts += 1; retry=action in _GAS_IDEMPOTENT
+            except requests.exceptions.ConnectionError as e:
+                out={'ok':False,'error':f'連線失敗：{e}','_local':True}; retry=True
+            except Exception as e:
+                out={'ok':False,'error':str(e),'_local':True}
+            if not retry or attempt == _GAS_MAX_TRIES-1:
+                break
+            wait=random.uniform(0, min(_GAS_BACKOFF[1], _GAS_BACKOFF[0]*2**attempt))
+            if time.monotonic()+wait >= deadline:
+                break
+            time.sleep(wait)
+            retries += 1
+        if not isinstance(out, dict):
+            out={'ok':False,'error':'回應格式錯誤','_local':True}
+        _GAS_STATS.record(action, time.monotonic()-t0, bool(out.get('ok')), retries, timeouts,
+                          '' if out.get('ok') else str(out.get('error','')))
+        return out
+
+    # ===== 單一動作（舊協定）=====
+    def list_names(self,sheet:str)->List[str]:
+        d=self._call('list',sheet)
+        return list(d.get('items') or []) if d.get('ok') else []
+
+    def get_payload(self,sheet:str,name:str)->Optional[Dict[str,Any]]:
+        d=self._call('get',sheet,name=name)
+        if not d.get('ok'): 
+            return None
+        return _parse_payload(d.get('payload_json'))
+
+    def create_only(self,sheet:str,name:str,payload:Dict[str,Any])->Tuple[bool,str]:
+        return self.create_and_list(sheet,name,payload)[:2]
+
+    def upsert(self,sheet:str,name:str,payload:Dict[str,Any])->Tuple[bool,str]:
+        # 覆寫儲存（用於：套用變更後同步回寫雲端模板）
+        return self.upsert_and_list(sheet,name,payload)[:2]
+
+    def delete(self,sheet:str,name:str)->Tuple[bool,str]:
+        return self.delete_and_list(sheet,name)[:2]
+
+    # ===== 批次協定（一次往返）=====
+    @property
+    def bulk(self)->bool:
+        return self.url not in _GAS_NO_BULK
+
+    def _bulk_failed(self, d:Dict[str,Any])->bool:
+        # GAS 明確回覆不認得批次動作（舊版 Apps Script：unknown_action）：記下來，之後這個網址一律走舊協定。
+        # token 錯誤、配額用完等其他錯誤只是這次失敗，不能讓整個程序從此停用批次協定
+        err=str(d.get('error') or '').strip().lower().replace(' ', '_')
+        if d.get('ok') or d.get('_local') or not err.startswith('unknown_action'):
+            return False
+        _GAS_NO_BULK.add(self.url)
+        return True
+
+    def list_full(self,sheet:str,payloads:bool=True)->Optional[Dict[str,Dict[str,Any]]]:
+        """
+        一次取回整張表的模板：{名稱: {'payload': dict 或 None, 'version': str 或 None}}，失敗回傳 None。
+        payloads=False 只取名稱與版本。舊版 GAS 退回 list（只有名稱，payload 之後再用 get 補）。
+        """
+        if self.bulk:
+            d=self._call('list_full',sheet,extra={'payloads': '1' if payloads else '0'})
+            if d.get('ok') and isinstance(d.get('items'), list):
+                return _listing(d['items'])
+            if not self._bulk_failed(d):
+                return None
+        d=self._call('list',sheet)
+        return {str(n): {'payload': None, 'version': None} for n in d.get('items') or []} if d.get('ok') else None
+
+    def batch(self, ops:List[Dict[str,Any]])->Optional[List[Dict[str,Any]]]:
+        """
+        多個動作一次送出（依序執行），回傳每個動作的結果；GAS 不支援批次協定回傳 None（呼叫端改走舊協定）。
+        其他失敗（連線、token、配額…）每個動作都回傳同一個錯誤。
+        """
+        if not self.bulk:
+            return None
+        d=self._call('batch',body={'ops': ops})
+        if d.get('ok') and isinstance(d.get('results'), list) and len(d['results']) == len(ops):
+            return d['results']
+        if self._bulk_failed(d):
+            return None
+        return [{'ok': False, 'error': d.get('error', '未知錯誤')} for _ in ops]
+
+    def _write_and_list(self, op:Dict[str,Any], sheet:str)->Tuple[Dict[str,Any], Optional[Dict[str,Dict[str,Any]]]]:
+        # 寫入 + 取回最新清單同一次往返；清單取不到時回傳 None（呼叫端自行重抓）
+        res=self.batch([op, {'action': 'list_full', 'sheet': sheet}])
+        if res is None:
+            return {}, None
+        listing=_listing(res[1].get('items') or []) if res[1].get('ok') else None
+        return res[0], listing
+
+    def create_and_list(self,sheet:str,name:str,payload:Dict[str,Any])->Tuple[bool,str,Optional[Dict[str,Dict[str,Any]]]]:
+        exists='同名模板已存在，請改名後再儲存。'
+        body=json.dumps(payload or {}, ensure_ascii=False)
+        if self.bulk:
+            d, listing=self._write_and_list({'action': 'create', 'sheet': sheet, 'name': name, 'payload_json': body}, sheet)
+            if d:
+                if d.get('ok'):
+                    return True, '已儲存', listing
+                return False, (exists if d.get('error') == 'exists' else f"儲存失敗：{d.get('error','未知錯誤')}"), listing
+        if name in self.list_names(sheet):
+            return False, exists, None
+        d=self._call('upsert',sheet,name=name,payload=payload)
+        return ((True,'已儲存') if d.get('ok') else (False, f"儲存失敗：{d.get('error','未知錯誤')}"))+(None,)
+
+    def upsert_and_list(self,sheet:str,name:str,payload:Dict[str,Any])->Tuple[bool,str,Optional[Dict[str,Dict[str,Any]]]]:
+        if self.bulk:
+            d, listing=self._write_and_list({'action': 'upsert', 'sheet': sheet, 'name': name,
+                                             'payload_json': json.dumps(payload or {}, ensure_ascii=False)}, sheet)
+            if d:
+                return ((True,'已更新') if d.get('ok') else (False, f"更新失敗：{d.get('error','未知錯誤')}"))+(listing,)
+        d=self._call('upsert',sheet,name=name,payload=payload)
+        return ((True,'已更新') if d.get('ok') else (False, f"更新失敗：{d.get('error','未知錯誤')}"))+(None,)
+
+    def delete_and_list(self,sheet:str,name:str)->Tuple[bool,str,Optional[Dict[str,Dict[str,Any]]]]:
+        if self.bulk:
+            d, listing=self._write_and_list({'action': 'delete', 'sheet': sheet, 'name': name}, sheet)
+            if d:
+                return ((True,'已刪除') if d.get('ok') else (False, f"刪除失敗：{d.get('error','未知錯誤')}"))+(listing,)
+        d=self._call('delete',sheet,name=name)
+        return ((True,'已刪除') if d.get('ok') else (False, f"刪除失敗：{d.get('error','未知錯誤')}"))+(None,)
+#------A005：Google Apps Script(GAS) API Client(結束)：------
+
+
+#------A007：外箱資料清理/防呆(開始)：------
+def _sanitize_box(df:'pd.DataFrame')->'pd.DataFrame':
+    import pandas as pd
+    cols=['選取','名稱','長','寬','高','數量','空箱重量']
+    if df is None:
+        df=pd.DataFrame(columns=cols)
+    df=df.copy()
+    for c in cols:
+        if c not in df.columns:
+            df[c]='' if c=='名稱' else 0
+    df=df[cols].fillna('')
+
+    # 空表就直接回傳空表（不要強塞預設值）
+    if df.empty:
+        return pd.DataFrame(columns=cols)
+
+    df['選取']=df['選取'].astype(bool)
+    df['名稱']=df['名稱'].astype(str).str.strip()
+    for c in ['長','寬','高','空箱重量']:
+        df[c]=df[c].apply(_to_float)
+    df['數量']=df['數量'].apply(lambda x:int(_to_float(x,0)))
+
+    def empty_row(r):
+        return (not r['名稱']) and r['長']==0 and r['寬']==0 and r['高']==0 and r['數量']==0
+
+    df=df[~df.apply(empty_row,axis=1)].reset_index(drop=True)
+
+    # 清理完如果變空，也保持空（不回填預設）
+    if df.empty:
+        return pd.DataFrame(columns=cols)
+
+    return df
+#------A007：外箱資料清理/防呆(結束)：------
+
+
+#------A008：商品資料清理/防呆(開始)：------
+ORIENTS=['自動','長當高','寬當高','高當高']
+
+def _sanitize_prod(df:'pd.DataFrame')->'pd.DataFrame':
+    import pandas as pd
+    cols=['選取','商品名稱','長','寬','高','重量(kg)','數量','放置方式']
+    if df is None:
+        df=pd.DataFrame(columns=cols)
+    df=df.copy()
+    for c in cols:
+        if c not in df.columns:
+            df[c]='' if c in ('商品名稱',) else 0
+    df=df[cols].fillna('')
+
+    if df.empty:
+        return pd.DataFrame(columns=cols)
+
+    df['選取']=df['選取'].astype(bool)
+    df['商品名稱']=df['商品名稱'].astype(str).str.strip()
+
+    for c in ['長','寬','高','重量(kg)']:
+        df[c]=df[c].apply(_to_float)
+    df['數量']=df['數量'].apply(lambda x:int(_to_float(x,0)))
+
+    # 放置方式防呆
+    allowed = ORIENTS
+    df['放置方式'] = df['放置方式'].astype(str).str.strip()
+    df.loc[~df['放置方式'].isin(allowed), '放置方式'] = '自動'
+    df.loc[df['放置方式'].eq(''), '放置方式'] = '自動'
+
+    def empty_row(r):
+        return (not r['商品名稱']) and r['長']==0 and r['寬']==0 and r['高']==0 and r['數量']==0
+
+    df=df[~df.apply(empty_row,axis=1)].reset_index(drop=True)
+
+    if df.empty:
+        return pd.DataFrame(columns=cols)
+
+    return df
+#------A008：商品資料清理/防呆(結束)：------
+
+
+#------A009：外箱/商品 模板 payload 轉換(開始)：------
+def _box_payload(df):
+    rows=[]
+    for _,r in df.fillna('').iterrows():
+        rows.append({
+            'selected':bool(r['選取']),
+            'name':str(r['名稱']).strip(),
+            'l':_to_float(r['長']),
+            'w':_to_float(r['寬']),
+            'h':_to_float(r['高']),
+            'qty':int(_to_float(r['數量'],0)),
+            'tare':_to_float(r['空箱重量'])
+        })
+    return {'rows':rows}
+
+def _payload_rows(payload)->List[Dict[str,Any]]:
+    if not isinstance(payload,dict): 
+        raise ValueError('payload is not dict')
+    rows=payload.get('rows',[])
+    if not isinstance(rows,list): 
+        raise ValueError('rows is not list')
+    return [r for r in rows if isinstance(r,dict)]
+
+def _box_rows(payload)->List[Dict[str,Any]]:
+    """
+    payload → 清理後的外箱列（與 _sanitize_box 相同規則，但不經 pandas）：
+    批次 / 服務直接把這個 list 交給 pack_and_render，worker 不必載入 pandas。
+    """
+    out=[]
+    for r in _payload_rows(payload):
+        row={
+            '選取':bool(r.get('selected',False)),
+            '名稱':str(r.get('name','')).strip(),
+            '長':_to_float(r.get('l',0)),
+            '寬':_to_float(r.get('w',0)),
+            '高':_to_float(r.get('h',0)),
+            '數量':int(_to_float(r.get('qty',0),0)),
+            '空箱重量':_to_float(r.get('tare',0))
+        }
+        if (not row['名稱']) and row['長']==0 and row['寬']==0 and row['高']==0 and row['數量']==0:
+            continue
+        out.append(row)
+    return out
+
+def _box_from(payload):
+    # 與畫面編輯後相同的清理（_sanitize_box）：欄位型別 / 空表形狀一致，不依賴 _box_rows 剛好同步
+    import pandas as pd
+    return _sanitize_box(pd.DataFrame(_box_rows(payload), columns=['選取','名稱','長','寬','高','數量','空箱重量']))
+
+def _prod_payload(df):
+    rows=[]
+    for _,r in df.fillna('').iterrows():
+        rows.append({
+            'selected':bool(r['選取']),
+            'name':str(r['商品名稱']).strip(),
+            'l':_to_float(r['長']),
+            'w':_to_float(r['寬']),
+            'h':_to_float(r['高']),
+            'wt':_to_float(r['重量(kg)']),
+            'qty':int(_to_float(r['數量'],0)),
+            'orient': str(r.get('放置方式','自動') or '自動').strip()
+        })
+    return {'rows':rows}
+
+def _prod_rows(payload)->List[Dict[str,Any]]:
+    # payload → 清理後的商品列（與 _sanitize_prod 相同規則，但不經 pandas；見 _box_rows）
+    out=[]
+    for r in _payload_rows(payload):
+        orient=str(r.get('orient','自動') or '自動').strip()
+        row={
+            '選取':bool(r.get('selected',False)),
+            '商品名稱':str(r.get('name','')).strip(),
+            '長':_to_float(r.get('l',0)),
+            '寬':_to_float(r.get('w',0)),
+            '高':_to_float(r.get('h',0)),
+            '重量(kg)':_to_float(r.get('wt',0)),
+            '數量':int(_to_float(r.get('qty',0),0)),
+            '放置方式':orient if orient in ORIENTS else '自動'
+        }
+        if (not row['商品名稱']) and row['長']==0 and row['寬']==0 and row['高']==0 and row['數量']==0:
+            continue
+        out.append(row)
+    return out
+
+def _prod_from(payload):
+    # 同 _box_from：再經 _sanitize_prod
+    import pandas as pd
+    return _sanitize_prod(pd.DataFrame(_prod_rows(payload), columns=['選取','商品名稱','長','寬','高','重量(kg)','數量','放置方式']))
+#------A009：外箱/商品 模板 payload 轉換(結束)：------
+
+
+#------A013：外箱箱型(含數量)/商品 Sku 與放置紀錄(開始)：------
+
+_DECIMALS=3          # 與 py3dbp 預設 number_of_decimals 一致
+_UNIT=10**_DECIMALS  # 整數模式：1 個尺寸單位 = 1000 ticks（剛好等於 py3dbp 的取位精度 → 結果完全一致）
+
+def _D(x)->Decimal:
+    # 用字串避免 float 二進位誤差
+    return Decimal(str(_to_float(x, 0)))
+
+def _ticks(x)->int:
+    # 尺寸 → 整數 ticks（與 py3dbp format_numbers 相同的四捨六入取位，只做一次）
+    return int(_D(x).quantize(Decimal(1).scaleb(-_DECIMALS)).scaleb(_DECIMALS))
+
+def _dim(x, int_units:bool):
+    return _ticks(x) if int_units else _D(x)
+
+def _fmt_dim(v, scale:int=1)->str:
+    # 顯示用：ticks / Decimal → 一般數字
+    return str(float(v)/scale)
+
+def _num(v, scale:int=1)->float:
+    # ticks / Decimal → 原始單位的 float（JSON / 報告用）
+    return float(v)/scale if scale != 1 else float(v)
+
+def _round_half_even(v:int, d:int)->int:
+    # 整數版 Decimal.quantize（ROUND_HALF_EVEN）：v/d 取整
+    q, r = divmod(v, d)
+    if r*2 > d or (r*2 == d and q % 2):
+        q += 1
+    return q
+
+_PY3DBP:Dict[str,Any]={}
+
+def _py3dbp()->Dict[str,Any]:
+    """
+    py3dbp 與其子類別第一次用到（py3dbp 引擎）才載入 / 建立，回傳 {'Packer','Bin','Item','FixedItem','_IntFixedItem','_IntBin'}。
+    """
+    if not _PY3DBP:
+        from py3dbp import Packer, Bin, Item
+        from py3dbp.constants import RotationType
+
+        class FixedItem(Item):
+            """
+            鎖定方向 + 統一回傳 Decimal 尺寸，避免 Decimal/float 混用造成 TypeError。
+            """
+            def __init__(self, name: str, dx, dy, dz, weight: float):
+                # dx/dy/dz 直接用 Decimal
+                super().__init__(name, dx, dy, dz, weight)
+                self._fixed_dims = (Decimal(str(dx)), Decimal(str(dy)), Decimal(str(dz)))
+
+            def get_dimension(self):
+                return self._fixed_dims
+
+        class _IntFixedItem(Item):
+            """
+            整數模式的鎖定方向 Item：尺寸維持 int，不轉 Decimal。
+            """
+            def get_dimension(self):
+                return [self.width, self.height, self.depth]
+
+        class _IntBin(Bin):
+            """
+            整數模式 Bin：put_item 的流程與 py3dbp 原版相同（含「第一個放得進邊界的方向就定案」），
+            但邊界與重疊判斷全部用整數，不經 Decimal / float。max_weight 固定 999999，不做重量檢查。
+            """
+            def put_item(self, item, pivot):
+                valid_item_position = item.position
+                item.position = pivot
+
+                for i in range(0, len(RotationType.ALL)):
+                    item.rotation_type = i
+                    d = item.get_dimension()
+                    if (
+                        self.width < pivot[0] + d[0] or
+                        self.height < pivot[1] + d[1] or
+                        self.depth < pivot[2] + d[2]
+                    ):
+                        continue
+
+                    for cur in self.items:
+                        cd = cur.get_dimension(); cp = cur.position
+                        if (cp[0] < pivot[0]+d[0] and pivot[0] < cp[0]+cd[0] and
+                            cp[1] < pivot[1]+d[1] and pivot[1] < cp[1]+cd[1] and
+                            cp[2] < pivot[2]+d[2] and pivot[2] < cp[2]+cd[2]):
+                            item.position = valid_item_position
+                            return False
+
+                    self.items.append(item)
+                    return True
+
+                item.position = valid_item_position
+                return False
+
+        _PY3DBP.update(Packer=Packer, Bin=Bin, Item=Item, FixedItem=FixedItem, _IntFixedItem=_IntFixedItem, _IntBin=_IntBin)
+    return _PY3DBP
+
+def _records(df)->List[Dict[str,Any]]:
+    # DataFrame（畫面）或已清理的列 list（_box_rows / _prod_rows）→ 每列一個 dict
+    if isinstance(df, list):
+        return df
+    return [r for _,r in df.iterrows()]
+
+def _build_bins(df_box, int_units:bool=True)->List[Dict[str,Any]]:
+    """
+    df_box：外箱 DataFrame 或 _box_rows 的列 list。
+    int_units=True：長寬高一次轉成整數 ticks（scale=_UNIT），後續重疊/體積/利用率都用整數；
+    False：沿用 Decimal（scale=1）。
+    """
+    scale=_UNIT if int_units else 1
+    bins=[]
+    for r in _records(df_box):
+        if not bool(r.get('選取', False)):
+            continue
+        qty=int(r.get('數量',0) or 0)
+        if qty<=0:
+            continue
+
+        L=_dim(r.get('長',0), int_units); W=_dim(r.get('寬',0), int_units); H=_dim(r.get('高',0), int_units)
+        if L<=0 or W<=0 or H<=0:
+            continue
+
+        name=(str(r.get('名稱','') or '').strip() or '外箱')
+        tare=_to_float(r.get('空箱重量',0) or 0)  # 重量維持 float 無妨
+        # ✅ 一列 = 一種箱型（附可用數量），不再展開成 N 個相同 dict
+        bins.append({'name':name,'l':L,'w':W,'h':H,'tare':tare,'qty':qty,'scale':scale})
+    return bins
+
+def _apply_manual_orient(L: Decimal, W: Decimal, H: Decimal, mode: str):
+    """
+    座標系：x=長(L), y=寬(W), z=高(H)
+    指定「哪個尺寸當 z(高度)」。
+    """
+    mode = (mode or '自動').strip()
+    if mode == '高當高':
+        return (L, W, H)   # z=H
+    if mode == '長當高':
+        return (W, H, L)   # z=L
+    if mode == '寬當高':
+        return (L, H, W)   # z=W
+    return (L, W, H)       # 自動：交給 py3dbp 旋轉
+
+class Sku:
+    """
+    一種商品（商品表格的一列）：SKU id / 數量 是正式欄位，不再從 Item 名稱字串反推。
+    dims 為套用「放置方式」後的 (x,y,z) 尺寸；fixed=True 表示鎖定方向。
+    """
+    __slots__=('id','name','dims','wt','qty','orient','fixed','vol')
+
+    def __init__(self, sid:int, name:str, dims:Tuple, wt:float, qty:int, orient:str):
+        self.id=sid
+        self.name=name
+        self.dims=dims
+        self.wt=wt
+        self.qty=qty
+        self.orient=orient
+        self.fixed=(orient != '自動')
+        # 與 py3dbp Item.get_volume() 相同的取位方式（排序要一致）
+        if isinstance(dims[0], int):
+            # ticks³ → 取到小數 3 位（整數運算，與 Decimal 版排序完全一致）
+            self.vol=_round_half_even(dims[0]*dims[1]*dims[2], _UNIT**2)
+        else:
+            q=Decimal(1).scaleb(-_DECIMALS)
+            self.vol=(dims[0].quantize(q)*dims[1].quantize(q)*dims[2].quantize(q)).quantize(q)
+
+    def kind(self)->Tuple:
+        # 同尺寸、同鎖定狀態 → 裝箱時幾何行為完全相同（不同 SKU 也可共用）
+        return (self.dims, self.fixed)
+
+    def __repr__(self):
+        return f"Sku({self.id}, {self.name!r}, {self.dims}, qty={self.qty})"
+
+class Placement:
+    """
+    單件已放置商品：所屬 sku + 位置 + 旋轉後尺寸（x=長, y=寬, z=高）。
+    """
+    __slots__=('sku','x','y','z','dx','dy','dz')
+
+    def __init__(self, sku:Sku, x, y, z, dx, dy, dz):
+        self.sku=sku
+        self.x=x; self.y=y; self.z=z
+        self.dx=dx; self.dy=dy; self.dz=dz
+
+    def pos(self)->Tuple:
+        return (self.x, self.y, self.z)
+
+    def dims(self)->Tuple:
+        return (self.dx, self.dy, self.dz)
+
+    def volume(self):
+        return self.dx*self.dy*self.dz
+
+def _build_items(df_prod, int_units:bool=True)->List[Sku]:
+    # df_prod：商品 DataFrame 或 _prod_rows 的列 list
+    skus=[]
+    for r in _records(df_prod):
+        if not bool(r.get('選取', False)):
+            continue
+        qty=int(r.get('數量',0) or 0)
+        if qty<=0:
+            continue
+
+        L=_dim(r.get('長',0), int_units); W=_dim(r.get('寬',0), int_units); H=_dim(r.get('高',0), int_units)
+        if L<=0 or W<=0 or H<=0:
+            continue
+
+        nm=(str(r.get('商品名稱','') or '').strip() or '商品')
+        wt=_to_float(r.get('重量(kg)',0) or 0)
+        orient=str(r.get('放置方式','自動') or '自動').strip()
+
+        # ✅ 一列 = 一筆 Sku（附數量），不再展開成 qty 個 Item
+        skus.append(Sku(len(skus), nm, _apply_manual_orient(L, W, H, orient), wt, qty, orient))
+    return skus
+
+#------A013：外箱箱型(含數量)/商品 Sku 與放置紀錄(結束)：------
+
+
+#------A014：3D 圖表建立（Plotly）(開始)：------
+_PALETTE=['#2F3A4A','#4C6A92','#6C757D','#8E9AAF','#A3B18A','#B08968','#C9ADA7','#6D6875']
+
+# 單位立方體的 8 個頂點 / 12 個三角面 / 12 條邊（頂點順序同舊版逐件畫法）
+_CUBE_V=((0,0,0),(1,0,0),(1,1,0),(0,1,0),(0,0,1),(1,0,1),(1,1,1),(0,1,1))
+_CUBE_F=((0,1,2),(0,2,3),(4,5,6),(4,6,7),(0,1,5),(0,5,4),
+         (1,2,6),(1,6,5),(2,3,7),(2,7,6),(3,0,4),(3,4,7))
+_CUBE_E=((0,1),(1,2),(2,3),(3,0),(4,5),(5,6),(6,7),(7,4),(0,4),(1,5),(2,6),(3,7))
+
+def _cube_arrays(pos:'np.ndarray', dims:'np.ndarray')->'np.ndarray':
+    # N 件的 (位置, 尺寸) → 每件 8 個頂點座標，shape=(N,8,3)
+    import numpy as np
+    return pos[:,None,:]+np.array(_CUBE_V, dtype=float)[None,:,:]*dims[:,None,:]
+
+def _edge_xyz(V:'np.ndarray')->Tuple['np.ndarray','np.ndarray','np.ndarray']:
+    # 每件 12 條邊串成一條 Scatter3d 線：每段 [a, b, NaN]（NaN＝None，plotly 在此斷線；用 numpy 陣列比 list 快很多）
+    import numpy as np
+    E=np.array(_CUBE_E)
+    seg=V[:,E,:]                                               # (N,12,2,3)
+    seg=np.concatenate([seg, np.full(seg.shape[:2]+(1,3), np.nan)], axis=2).reshape(-1,3)
+    return seg[:,0], seg[:,1], seg[:,2]
+
+# 細節層級（LOD）門檻：件數多時簡化，detail='full' 一律完整畫出
+_LOD_EDGES_MAX=400     # 畫出的方塊超過這麼多個就不畫商品邊框
+_LOD_MERGE_MIN=800     # 一箱超過這麼多件：相鄰同款商品合併成一個方塊
+_LOD_SHELL_MIN=5000    # 一箱超過這麼多件：只畫外層看得到的商品（detail='shell' 則不論件數）
+LOD_MODES={'auto':'自動簡化', 'full':'完整細節', 'shell':'只畫外層'}
+
+def _lod(n:int, detail:str='auto')->Dict[str,bool]:
+    # 依件數決定簡化方式：{'shell','merge','edges'}（edges 在合併 / 外層篩選後依方塊數再判斷一次）
+    if detail == 'full':
+        return {'shell': False, 'merge': False, 'edges': True}
+    return {
+        'shell': detail == 'shell' or n > _LOD_SHELL_MIN,
+        'merge': n > _LOD_MERGE_MIN,
+        'edges': n <= _LOD_EDGES_MAX,
+    }
+
+def _merge_blocks(cubes:List[Tuple])->List[Tuple]:
+    """
+    相鄰同款商品合併：cubes=[(sku, 位置, 尺寸, 件數)]，位置 / 尺寸為原始 ticks 或 Decimal（精確比較）。
+    同 sku、同尺寸的一群依 x → y → z 三軸各掃一次：截面相同且首尾相接的方塊併成一個。
+    """
+    groups={}
+    for c in cubes:
+        groups.setdefault((c[0].id, c[2]), []).append(c)
+    out=[]
+    for g in groups.values():
+        for a in range(3):
+            b, c2 = [i for i in range(3) if i != a]
+            g.sort(key=lambda c: (c[1][b], c[1][c2], c[2][b], c[2][c2], c[1][a]))
+            m=[]
+            for c in g:
+                if m:
+                    q=m[-1]
+                    if (q[1][b] == c[1][b] and q[1][c2] == c[1][c2] and q[2][b] == c[2][b] and q[2][c2] == c[2][c2]
+                            and q[1][a]+q[2][a] == c[1][a]):
+                        d=list(q[2]); d[a]=q[2][a]+c[2][a]
+                        m[-1]=(q[0], q[1], tuple(d), q[3]+c[3])
+                        continue
+                m.append(c)
+            g=m
+        out += g
+    return out
+
+def _shell_only(cubes:List[Tuple])->List[Tuple]:
+    """
+    只留外層：六個面都被「單一相鄰方塊的面完整蓋住」的方塊從外面看不到，移除。
+    （只比對單一鄰居，判斷偏保守：不確定的一律保留）
+    """
+    import numpy as np
+    if not cubes:
+        return cubes
+    lo_at={}; hi_at={}
+    for n, (_, p, d, _) in enumerate(cubes):
+        for a in range(3):
+            lo_at.setdefault((a, p[a]), []).append(n)
+            hi_at.setdefault((a, p[a]+d[a]), []).append(n)
+    P=np.array([[float(v) for v in c[1]] for c in cubes])
+    Q=P+np.array([[float(v) for v in c[2]] for c in cubes])
+    eps=1e-9
+    arr={}
+
+    def _covered(n:int, a:int, key:Tuple, at:Dict)->bool:
+        idx=at.get(key)
+        if not idx:
+            return False
+        ix=arr.get((id(at), key))
+        if ix is None:
+            ix=arr[(id(at), key)]=np.array(idx)
+        o=[i for i in range(3) if i != a]
+        return bool(((P[ix][:,o] <= P[n,o]+eps).all(1) & (Q[ix][:,o] >= Q[n,o]-eps).all(1)).any())
+
+    keep=[]
+    for n, (_, p, d, _) in enumerate(cubes):
+        if not all(_covered(n, a, (a, p[a]+d[a]), lo_at) and _covered(n, a, (a, p[a]), hi_at) for a in range(3)):
+            keep.append(cubes[n])
+    return keep
+
+def _fig_cubes(fitted:List[Placement], detail:str='auto')->Tuple[List[Tuple],bool]:
+    """
+    要畫的方塊 [(sku, 位置, 尺寸, 件數)] 與是否畫商品邊框（3D 圖與 HTML 報告共用）。
+    簡化時先合併相鄰同款（方塊數大減）、再篩外層；邊框依最後的方塊數判斷。
+    """
+    cubes=[(pl.sku, pl.pos(), pl.dims(), 1) for pl in fitted]
+    lod=_lod(len(cubes), detail)
+    if lod['merge']:
+        cubes=_merge_blocks(cubes)
+    if lod['shell']:
+        cubes=_shell_only(cubes)
+    return cubes, lod['edges'] or len(cubes) <= _LOD_EDGES_MAX
+
+def build_3d_fig(box:Dict[str,Any], fitted:List[Placement], color_map:Dict[str,str]=None, batched:bool=True, detail:str='auto')->'go.Figure':
+    """
+    batched=True：同一顏色的商品合併成一個 Mesh3d（頂點串接、面索引位移），所有商品邊框合併成一個 Scatter3d，
+    trace 數 ≈ 顏色數 + 2（舊版每件 13 個）；每件的名稱 / 尺寸放在頂點 customdata，hover 仍顯示該件資訊。
+    batched=False：舊版逐件畫法（每件一個 Mesh3d + 12 條邊），不做簡化。
+    detail：'auto' 依件數簡化（見 _lod：不畫邊框 / 合併相鄰同款 / 只畫外層）；'shell' 一律只畫外層；'full' 完整畫出。
+    """
+    import numpy as np
+    import plotly.graph_objects as go
+    fig=go.Figure()
+
+    # 統一座標：x=長(L), y=寬(W), z=高(H)
+    # box / Placement 可能是整數 ticks（scale=_UNIT）或 Decimal（scale=1），畫圖一律換回尺寸單位
+    sc=float(box.get('scale',1) or 1)
+    L=float(box['l'])/sc; W=float(box['w'])/sc; H=float(box['h'])/sc
+
+    # 外箱框線
+    BV=_cube_arrays(np.zeros((1,3)), np.array([[L,W,H]]))
+    if batched:
+        ex, ey, ez = _edge_xyz(BV)
+        fig.add_trace(go.Scatter3d(
+            x=ex, y=ey, z=ez,
+            mode='lines', line=dict(width=5,color='#111'),
+            hoverinfo='skip', showlegend=False
+        ))
+    else:
+        for a,b in _CUBE_E:
+            fig.add_trace(go.Scatter3d(
+                x=[BV[0,a,0],BV[0,b,0]],y=[BV[0,a,1],BV[0,b,1]],z=[BV[0,a,2],BV[0,b,2]],
+                mode='lines', line=dict(width=5,color='#111'),
+                hoverinfo='skip', showlegend=False
+            ))
+
+    # 若未提供 color_map，就用 fitted 自己建立（但你現在會由 A016 提供，才能跨箱一致）
+    if color_map is None:
+        color_map={}
+        ci=0
+        for pl in fitted:
+            base=pl.sku.name
+            if base not in color_map:
+                color_map[base]=_PALETTE[ci%len(_PALETTE)]
+                ci += 1
+
+    # ✅ Placement 已是旋轉後尺寸（避免你看到融合/穿透/大小不對）
+    cubes, edges = _fig_cubes(fitted, detail if batched else 'full')
+
+    pos=np.array([[float(v) for v in c[1]] for c in cubes], dtype=float).reshape(-1,3)/sc
+    dims=np.array([[float(v) for v in c[2]] for c in cubes], dtype=float).reshape(-1,3)/sc
+    V=_cube_arrays(pos, dims)
+    colors=[color_map.get(c[0].name, '#4C6A92') for c in cubes]
+
+    if not batched:
+        # 畫商品：實心、不透明、加邊框（逐件）
+        I,J,K=zip(*_CUBE_F)
+        for n, c in enumerate(cubes):
+            dx,dy,dz=dims[n]
+            fig.add_trace(go.Mesh3d(
+                x=V[n,:,0],y=V[n,:,1],z=V[n,:,2], i=I,j=J,k=K,
+                color=colors[n], opacity=1.0, flatshading=True,
+                hovertemplate=f"{c[0].name}<br>尺寸:{dx:.1f}×{dy:.1f}×{dz:.1f}<extra></extra>",
+                showlegend=False
+            ))
+            for a,b in _CUBE_E:
+                fig.add_trace(go.Scatter3d(
+                    x=[V[n,a,0],V[n,b,0]],y=[V[n,a,1],V[n,b,1]],z=[V[n,a,2],V[n,b,2]],
+                    mode='lines', line=dict(width=3,color='#000'),
+                    hoverinfo='skip', showlegend=False
+                ))
+    else:
+        # 畫商品：每種顏色一個 Mesh3d（實心、不透明）
+        F=np.array(_CUBE_F)
+        for col in dict.fromkeys(colors):
+            idx=[n for n, cn in enumerate(colors) if cn == col]
+            Vc=V[idx].reshape(-1,3)
+            Fc=(F[None,:,:]+8*np.arange(len(idx))[:,None,None]).reshape(-1,3)
+            # hover：每個方塊 8 個頂點帶同一筆 customdata（名稱、尺寸；合併的方塊附件數）
+            info=np.array([
+                (cubes[n][0].name if cubes[n][3] == 1 else f"{cubes[n][0].name} ×{cubes[n][3]} 件",
+                 f"{dims[n][0]:.1f}×{dims[n][1]:.1f}×{dims[n][2]:.1f}")
+                for n in idx
+            ], dtype=object)
+            custom=np.repeat(info, 8, axis=0)
+            fig.add_trace(go.Mesh3d(
+                x=Vc[:,0],y=Vc[:,1],z=Vc[:,2], i=Fc[:,0],j=Fc[:,1],k=Fc[:,2],
+                color=col, opacity=1.0, flatshading=True,
+                customdata=custom,
+                hovertemplate="%{customdata[0]}<br>尺寸:%{customdata[1]}<extra></extra>",
+                showlegend=False
+            ))
+
+        # 所有商品邊框：一個 Scatter3d（方塊太多時略過）
+        if edges and len(V):
+            ex, ey, ez = _edge_xyz(V)
+            fig.add_trace(go.Scatter3d(
+                x=ex, y=ey, z=ez,
+                mode='lines', line=dict(width=3,color='#000'),
+                hoverinfo='skip', showlegend=False
+            ))
+
+    fig.update_layout(
+        scene=dict(
+            xaxis=dict(range=[0,L], title='長 (L)'),
+            yaxis=dict(range=[0,W], title='寬 (W)'),
+            zaxis=dict(range=[0,H], title='高 (H)'),
+            aspectmode='data',
+          
+            # ✅ (1) 讓初始 3D 物件看起來小約 20%：相機拉遠（eye 變大）
+            # 你之後想更小/更大，就調整下面三個數字
+            camera=dict(eye=dict(x=1.56, y=1.56, z=1.5))
+        ),
+        margin=dict(l=0,r=0,t=0,b=0),
+        height=650
+    )
+    return fig
+#------A014：3D 圖表建立（Plotly）(結束)：------
+
+
+#------A015：HTML 報告輸出（含 Plotly 內嵌）(開始)：------
+# 報告內的 3D 圖在瀏覽器端由共用 script 依幾何資料建立（與 build_3d_fig batched 相同畫法），
+# 每箱只存 位置 / 尺寸索引 / 商品索引 等數字陣列，不再每箱嵌入完整的 Plotly trace JSON
+_REPORT_JS=r"""
+(function(){
+  var R=JSON.parse(document.getElementById('pack-meta').textContent);
+  var V=[[0,0,0],[1,0,0],[1,1,0],[0,1,0],[0,0,1],[1,0,1],[1,1,1],[0,1,1]];
+  var F=[[0,1,2],[0,2,3],[4,5,6],[4,6,7],[0,1,5],[0,5,4],[1,2,6],[1,6,5],[2,3,7],[2,7,6],[3,0,4],[3,4,7]];
+  var E=[[0,1],[1,2],[2,3],[3,0],[4,5],[5,6],[6,7],[7,4],[0,4],[1,5],[2,6],[3,7]];
+  function edges(p,d,xs,ys,zs){
+    E.forEach(function(e){
+      var a=V[e[0]],b=V[e[1]];
+      xs.push(p[0]+a[0]*d[0],p[0]+b[0]*d[0],null);
+      ys.push(p[1]+a[1]*d[1],p[1]+b[1]*d[1],null);
+      zs.push(p[2]+a[2]*d[2],p[2]+b[2]*d[2],null);
+    });
+  }
+  function draw(el){
+    var b=JSON.parse(el.querySelector('script').textContent);
+    var S=b.size, n=b.k.length, traces=[], groups={}, order=[];
+    var fx=[],fy=[],fz=[]; edges([0,0,0],S,fx,fy,fz);
+    traces.push({type:'scatter3d',mode:'lines',x:fx,y:fy,z:fz,line:{width:5,color:'#111'},hoverinfo:'skip',showlegend:false});
+    for(var t=0;t<n;t++){
+      var c=R.skus[b.k[t]][1];
+      if(!groups[c]){groups[c]=[];order.push(c);}
+      groups[c].push(t);
+    }
+    order.forEach(function(color){
+      var x=[],y=[],z=[],I=[],J=[],K=[],cd=[];
+      groups[color].forEach(function(t,m){
+        var p=b.p.slice(3*t,3*t+3), d=b.D[b.d[t]], cnt=b.n?b.n[t]:1, nm=R.skus[b.k[t]][0];
+        var label=cnt>1?(nm+' ×'+cnt+' 件'):nm, size=d.map(function(v){return v.toFixed(1);}).join('×');
+        V.forEach(function(v){x.push(p[0]+v[0]*d[0]);y.push(p[1]+v[1]*d[1]);z.push(p[2]+v[2]*d[2]);cd.push([label,size]);});
+        F.forEach(function(f){I.push(8*m+f[0]);J.push(8*m+f[1]);K.push(8*m+f[2]);});
+      });
+      traces.push({type:'mesh3d',x:x,y:y,z:z,i:I,j:J,k:K,color:color,opacity:1,flatshading:true,customdata:cd,
+        hovertemplate:'%{customdata[0]}<br>尺寸:%{customdata[1]}<extra></extra>',showlegend:false});
+    });
+    if(b.edges){
+      var ex=[],ey=[],ez=[];
+      for(var t2=0;t2<n;t2++){edges(b.p.slice(3*t2,3*t2+3),b.D[b.d[t2]],ex,ey,ez);}
+      traces.push({type:'scatter3d',mode:'lines',x:ex,y:ey,z:ez,line:{width:3,color:'#000'},hoverinfo:'skip',showlegend:false});
+    }
+    var plot=el.querySelector('.plot3d');
+    Plotly.newPlot(plot,traces,{
+      scene:{xaxis:{range:[0,S[0]],title:{text:'長 (L)'}},yaxis:{range:[0,S[1]],title:{text:'寬 (W)'}},zaxis:{range:[0,S[2]],title:{text:'高 (H)'}},
+             aspectmode:'data',camera:{eye:{x:1.56,y:1.56,z:1.5}}},
+      margin:{l:0,r:0,t:0,b:0},height:650
+    },{responsive:true});
+  }
+  // 捲到附近才建立圖表：箱數多時開檔不會一次建立全部 WebGL 畫面
+  var boxes=document.querySelectorAll('.box3d');
+  if('IntersectionObserver' in window){
+    var io=new IntersectionObserver(function(es){
+      es.forEach(function(e){ if(e.isIntersecting){ io.unobserve(e.target); draw(e.target); } });
+    },{rootMargin:'600px'});
+    boxes.forEach(function(el){io.observe(el);});
+  } else {
+    boxes.forEach(draw);
+  }
+})();
+"""
+
+def _json_script(obj:Any, attrs:str='')->str:
+    # JSON 放進 <script type="application/json">：跳脫 </ 避免提早結束 script
+    raw=json.dumps(obj, ensure_ascii=False, separators=(',',':')).replace('</', '<\\/')
+    return f"<script type='application/json'{attrs}>{raw}</script>"
+
+def _box_geometry(p:Dict[str,Any], sku_idx:Dict[str,int], detail:str='auto')->Dict[str,Any]:
+    """
+    一箱的精簡幾何（原始單位、取到小數 3 位）：
+    size=[L,W,H]、p=每個方塊的 x,y,z 攤平、D=尺寸表、d=每個方塊的尺寸索引、k=商品索引、n=合併件數（有合併才有）。
+    方塊依 _fig_cubes 的簡化規則（與畫面相同）。
+    """
+    box=p['box']; sc=box.get('scale',1)
+    cubes, edges = _fig_cubes(p['items'], detail)
+    dims={}; pos=[]; d=[]; k=[]; n=[]
+    for sk, xyz, dxyz, cnt in cubes:
+        pos += [round(_num(v, sc), 3) for v in xyz]
+        key=tuple(round(_num(v, sc), 3) for v in dxyz)
+        d.append(dims.setdefault(key, len(dims)))
+        k.append(sku_idx.get(sk.name, 0))
+        n.append(cnt)
+    out={
+        'size': [round(_num(box[a], sc), 3) for a in ('l','w','h')],
+        'p': pos, 'D': [list(v) for v in dims], 'd': d, 'k': k, 'edges': bool(edges),
+    }
+    if any(c > 1 for c in n):
+        out['n']=n
+    return out
+
+_REPORT_CSS="""
+body{font-family:-apple-system,BlinkMacSystemFont,'Segoe UI','PingFang TC','Microsoft JhengHei',Arial,sans-serif;margin:0;background:#fff}
+.container{max-width:1200px;margin:24px auto;padding:0 16px}
+.card{border:1px solid #e6e6e6;border-radius:14px;padding:16px 18px;margin:12px 0}
+h2{margin:0 0 10px 0}
+.meta{display:flex;flex-direction:column;gap:6px;color:#222}
+.warn{border:1px solid #f2b8b5;background:#fdecea;padding:10px 12px;border-radius:12px;margin:12px 0}
+.warn2{border:1px solid #f2b8b5;background:#fdecea;padding:8px 12px;border-radius:12px;margin:8px 0}
+.boxcard{border:1px solid #e6e6e6;border-radius:14px;padding:14px 14px;margin:14px 0}
+.boxtitle{font-weight:900;margin-bottom:6px}
+.boxmeta{color:#444;margin-bottom:10px}
+.boxgrid{display:grid;grid-template-columns:260px 1fr;gap:12px;align-items:start}
+.legend{border:1px solid #eee;border-radius:12px;padding:10px 10px}
+.legtitle{font-weight:800;margin-bottom:8px}
+.legrow{display:flex;align-items:center;gap:8px;margin:6px 0}
+.sw{width:14px;height:14px;border:2px solid #111;border-radius:3px;display:inline-block}
+.plot{border-radius:12px;overflow:hidden;min-height:650px}
+@media (max-width:900px){ .boxgrid{grid-template-columns:1fr} }
+"""
+
+def _iter_plotlyjs(plotlyjs:str='inline', chunk:int=1<<20):
+    # inline：整份 plotly.js 只嵌入一次（離線可開），直接從套件檔案分段讀出；cdn：只放連結（檔案小，需連網）
+    if plotlyjs == 'cdn':
+        from plotly.offline import get_plotlyjs_version
+        yield f"<script src='https://cdn.plot.ly/plotly-{get_plotlyjs_version()}.min.js' charset='utf-8'></script>"
+        return
+    yield "<script type='text/javascript'>"
+    try:
+        from importlib.resources import files
+        with (files('plotly')/'package_data'/'plotly.min.js').open('r', encoding='utf-8') as f:
+            while True:
+                part=f.read(chunk)
+                if not part:
+                    break
+                yield part
+    except (FileNotFoundError, ModuleNotFoundError):
+        from plotly.offline import get_plotlyjs
+        yield get_plotlyjs()
+    yield "</script>"
+
+def iter_report_html(
+    order_name:str,
+    packed_bins:List[Dict[str,Any]],
+    unfitted:List[Tuple[Sku,int]],
+    content_wt:float,
+    total_wt:float,
+    util:float,
+    color_map:Dict[str,str],
+    plotlyjs:str='inline',
+    detail:str='auto'
+):
+    """
+    離線 HTML 報告（逐段產生字串）：plotly.js 只嵌入一次（plotlyjs='cdn' 則改用連結），每箱只存精簡幾何（見 _box_geometry），
+    圖表由報告內的共用 script 在瀏覽器端建立。detail 同 build_3d_fig（'full'＝不簡化）。
+    每箱的幾何輪到該箱才計算，寫檔時記憶體用量與箱數無關（見 write_report_html）。
+    """
+    ts=_now_tw().strftime('%Y-%m-%d %H:%M:%S (台灣時間)')
+
+    # 未裝入警示
+    warn=''
+    if unfitted:
+        counts={}
+        for sk, n in unfitted:
+            counts[sk.name]=counts.get(sk.name,0)+n
+        warn="<div class='warn'><b>注意：</b>有部分商品裝不下！（可能是箱型庫存不足或尺寸不夠）</div>"+''.join(
+            [f"<div class='warn2'>⚠ {k}：超過 {v} 個</div>" for k,v in counts.items()]
+        )
+
+    # Legend（同 Streamlit）
+    legend_items=''.join([
+        f"<div class='legrow'><span class='sw' style='background:{c}'></span>{k}</div>"
+        for k,c in color_map.items()
+    ])
+
+    # 商品表（名稱、顏色）：每箱的 k 陣列存這裡的索引
+    names=list(color_map)
+    for p in packed_bins:
+        for pl in p['items']:
+            if pl.sku.name not in color_map and pl.sku.name not in names:
+                names.append(pl.sku.name)
+    sku_idx={nm: i for i, nm in enumerate(names)}
+    meta={'skus': [[nm, color_map.get(nm, '#4C6A92')] for nm in names]}
+
+    yield f"""<!doctype html><html lang='zh-Hant'><head>
+<meta charset='utf-8'/><meta name='viewport' content='width=device-width,initial-scale=1'/>
+<title>訂單裝箱報告 - {_safe_name(order_name)}</title>
+<style>{_REPORT_CSS}</style>
+</head><body>
+<div class='container'>
+  <div class='card'>
+    <h2>🧾 訂單裝箱報告</h2>
+    <div class='meta'>
+      <div>🧾 <b>訂單名稱</b>　{order_name}</div>
+      <div>🕒 <b>計算時間</b>　{ts}</div>
+      <div>📦 <b>使用箱數</b>　<b>{len(packed_bins)}</b> 箱（可混用不同箱型）</div>
+      <div>⚖️ <b>內容淨重</b>　{content_wt:.2f} kg</div>
+      <div>🔴 <b>本次總重</b>　{total_wt:.2f} kg</div>
+      <div>📊 <b>整體空間利用率</b>　{util:.2f}%</div>
+    </div>
+    {warn}
+  </div>
+"""
+
+    # 每箱圖（只放幾何資料，圖表由 _REPORT_JS 建立）
+    for p in packed_bins:
+        box=p['box']; items=p['items']
+        yield f"""
+          <div class='boxcard'>
+            <div class='boxtitle'>📦 {p['name']}（裝入 {len(items)} 件）</div>
+            <div class='boxmeta'>箱子尺寸：{' × '.join(_fmt_dim(box[k], box.get('scale',1)) for k in ('l','w','h'))}</div>
+            <div class='boxgrid'>
+              <div class='legend'>
+                <div class='legtitle'>分類說明</div>
+                {legend_items}
+              </div>
+              <div class='plot box3d'>{_json_script(_box_geometry(p, sku_idx, detail))}<div class='plot3d'></div></div>
+            </div>
+          </div>
+        """
+
+    if not packed_bins:
+        yield "<div class='warn'>本次沒有任何箱子成功裝入商品。</div>"
+    yield "\n</div>\n"
+    if packed_bins:
+        yield from _iter_plotlyjs(plotlyjs)
+        yield _json_script(meta, " id='pack-meta'")+f"<script>{_REPORT_JS}</script>"
+    yield "\n</body></html>"
+
+def write_report_html(path:str, *args, **kwargs)->int:
+    """
+    iter_report_html 逐段寫入檔案（參數同 iter_report_html），回傳寫入的位元組數。
+    先寫到同目錄暫存檔再改名，中途失敗不會留下寫一半的報告。
+    """
+    tmp=f"{path}.{os.getpid()}.tmp"
+    n=0
+    try:
+        with open(tmp, 'w', encoding='utf-8', newline='') as f:
+            for part in iter_report_html(*args, **kwargs):
+                f.write(part)
+        n=os.path.getsize(tmp)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return n
+
+def build_report_html(*args, **kwargs)->str:
+    # 整份報告一次組成字串（參數同 iter_report_html）；大訂單請改用 write_report_html
+    return ''.join(iter_report_html(*args, **kwargs))
+#------A015：HTML 報告輸出（含 Plotly 內嵌）(結束)：------
+
+
+#------A016：裝箱計算核心（py3dbp / NumPy 引擎）+ 統計(開始)：------
+_PACK_MEMO_MAX=512   # 單箱裝箱結果快取上限（依引擎 × 箱型 × 剩餘商品序列）
+_PACK_MEMO:'OrderedDict[Tuple, List[Tuple]]'=OrderedDict()
+
+# 裝箱引擎：py3dbp（原始）/ numpy（內建向量化 extreme-point）
+ENGINES={'py3dbp':'py3dbp（原始）', 'numpy':'NumPy（快速）'}
+
+Run=Tuple[Sku,int]   # 連續同一 SKU 的一段：(Sku, 件數)；待裝商品一律以 runs 表示，不展開成每件一個參照
+
+def _runs(pairs)->List[Run]:
+    # (Sku, 件數) 序列 → 合併相鄰同一 SKU、去掉 0 件的 runs
+    out=[]
+    for sk, n in pairs:
+        if n <= 0:
+            continue
+        if out and out[-1][0] is sk:
+            out[-1]=(sk, out[-1][1]+n)
+        else:
+            out.append((sk, n))
+    return out
+
+def _run_total(runs:List[Run])->int:
+    return sum(n for _, n in runs)
+
+def _memo_lookup(key:Tuple, counts:List[int]):
+    for n, c, placed in _PACK_MEMO.get(key, []):
+        # 每段：上次有放不下（c<n）且這次件數仍 > c → 結果相同；或上次全放下且件數完全相同
+        if all((ci<ni and nn>ci) or (ci==ni==nn) for ni, ci, nn in zip(n, c, counts)):
+            _PACK_MEMO.move_to_end(key)
+            return c, placed
+    return None
+
+def _memo_store(key:Tuple, counts:List[int], c:List[int], placed:List[Tuple]):
+    _PACK_MEMO.setdefault(key, []).append((tuple(counts), tuple(c), placed))
+    _PACK_MEMO.move_to_end(key)
+    while len(_PACK_MEMO) > _PACK_MEMO_MAX:
+        _PACK_MEMO.popitem(last=False)
+
+_STOP_EVERY=64   # 引擎內每嘗試這麼多件檢查一次 stop()
+
+def _fill_py3dbp(b:Dict[str,Any], name:str, seq:List[Sku], stop=None)->Optional[List[Tuple[int,Tuple]]]:
+    """
+    py3dbp 單箱裝箱（等同 Packer.pack(bigger_first=True) 只放一個 Bin，seq 已排序）。
+    py3dbp 只能一件一件裝：這裡才展開成 Item。回傳 [(seq 索引, (x,y,z,dx,dy,dz))]，依放入順序；
+    途中 stop() 為 True 則回傳 None（這一箱作廢）。
+    """
+    P=_py3dbp()
+    Item=P['Item']
+    packer=P['Packer']()
+    if isinstance(b['l'], int):
+        # ✅ 整數模式：ticks 已是取位後的值，不再 format_numbers，重疊判斷走 _IntBin
+        bn=P['_IntBin'](name, b['l'], b['w'], b['h'], 999999)
+        for j, sk in enumerate(seq):
+            dx, dy, dz = sk.dims
+            it=P['_IntFixedItem'](sk.name, dx, dy, dz, sk.wt) if sk.fixed else Item(sk.name, dx, dy, dz, sk.wt)
+            it.seq_idx=j
+            packer.pack_to_bin(bn, it)
+            if stop and j % _STOP_EVERY == 0 and stop():
+                return None
+    else:
+        # ✅ 重要：不要再 float()，直接用 Decimal 尺寸建立 Bin
+        bn=P['Bin'](name, b['l'], b['w'], b['h'], 999999)
+        bn.format_numbers(_DECIMALS)
+        for j, sk in enumerate(seq):
+            dx, dy, dz = sk.dims
+            # ✅ 自動：Item 尺寸也用 Decimal（重點）；手動：FixedItem 鎖定方向（也用 Decimal）
+            it=P['FixedItem'](sk.name, dx, dy, dz, sk.wt) if sk.fixed else Item(sk.name, dx, dy, dz, sk.wt)
+            it.format_numbers(_DECIMALS)
+            it.seq_idx=j
+            packer.pack_to_bin(bn, it)
+            if stop and j % _STOP_EVERY == 0 and stop():
+                return None
+
+    out=[]
+    for it in bn.items:
+        # py3dbp 旋轉後尺寸：get_dimension() → (x,y,z)
+        out.append((it.seq_idx, tuple(it.position)+tuple(it.get_dimension())))
+    return out
+
+_NP_EPS=1e-9   # float 誤差容忍（Decimal 模式用；整數模式為 0，完全精確）
+_NP_CHUNK=256  # 每次向量化檢查的候選點數上限（第一批只取 _NP_CHUNK0 個，多數商品前幾個點就放得下）
+_NP_CHUNK0=8
+
+def _np_orients(sk:Sku, dtype)->'np.ndarray':
+    # 允許的擺放方向（x,y,z 尺寸）；鎖定方向只有一種，自動則為 6 種排列去重
+    import numpy as np
+    dx, dy, dz = sk.dims
+    if sk.fixed:
+        return np.array([(dx, dy, dz)], dtype=dtype)
+    perms=[(dx,dy,dz),(dy,dx,dz),(dy,dz,dx),(dz,dy,dx),(dz,dx,dy),(dx,dz,dy)]  # 與 py3dbp RotationType 同序
+    out=[]
+    for p in perms:
+        if p not in out:
+            out.append(p)
+    return np.array(out, dtype=dtype)
+
+# 新 extreme points：三個角點各自沿另外兩軸投影 →（角點軸 a, 投影軸 pa）共 6 組
+_NP_PROJ=[(a, pa) for a in range(3) for pa in range(3) if pa != a]
+
+def _np_new_points(p0:'np.ndarray', p1:'np.ndarray', lo:'np.ndarray', hi:'np.ndarray', eps)->'np.ndarray':
+    """
+    剛放入 [p0,p1) 後的新候選點：三個角點，以及角點沿另外兩軸推到最近已放置面（或箱壁 0）的投影點；
+    6 個投影一次對所有已放置商品向量化計算。
+    """
+    import numpy as np
+    Q=np.repeat(p0[None,:], 3, axis=0)
+    Q[[0,1,2],[0,1,2]]=p1
+    qa=np.array([a for a, _ in _NP_PROJ]); ax=np.array([pa for _, pa in _NP_PROJ])
+    R=Q[qa]                                             # 6 × xyz（投影前）
+    m=(lo[None,:,:] <= R[:,None,:]+eps) & (R[:,None,:] < hi[None,:,:]-eps)
+    m[np.arange(6),:,ax]=True                            # 投影軸本身不需要重疊
+    Hax=hi[:,ax].T                                       # 6 × 已放置商品：投影軸上的上緣
+    m=m.all(-1) & (Hax <= R[np.arange(6),ax][:,None]+eps)
+    R[np.arange(6),ax]=np.where(m, Hax, 0).max(1)
+    return np.vstack([Q, R])
+
+def _fill_numpy(b:Dict[str,Any], name:str, seq:List[Sku], stop=None)->Optional[List[Tuple[int,Tuple]]]:
+    """
+    內建 NumPy 引擎：已放置商品與候選 extreme points 都存在陣列中，
+    「在箱內」與「不重疊」一次對一批候選點 × 所有方向 × 可能碰到的已放置商品做向量化判斷。
+    候選點依 (z,y,x) 由低到高、由內到外嘗試；回傳格式與 _fill_py3dbp 相同。
+    """
+    import numpy as np
+    # 整數 ticks → int64 精確比較；Decimal → float64 + 誤差容忍
+    exact=isinstance(b['l'], int)
+    dtype, eps, num = (np.int64, 0, int) if exact else (np.float64, _NP_EPS, float)
+    conv=int if exact else (lambda v: _D(float(v)))   # 輸出維持與輸入相同的數值型別
+    B=np.array([num(b['l']), num(b['w']), num(b['h'])], dtype=dtype)
+    lo=np.empty((len(seq),3), dtype=dtype); hi=np.empty((len(seq),3), dtype=dtype); n=0
+    P=np.zeros((1,3), dtype=dtype)   # 候選點，維持依 (z,y,x) 排序、不重複
+    orients={}
+    failed=set()   # 在目前箱內狀態下已確定放不下的 kind（狀態改變才重置）
+    out=[]
+
+    for j, sk in enumerate(seq):
+        if stop and j % _STOP_EVERY == 0 and stop():
+            return None
+        k=sk.kind()
+        if k in failed or not len(P):
+            continue
+        O=orients.get(k)
+        if O is None:
+            O=orients[k]=_np_orients(sk, dtype)
+
+        U=P[:,None,:]+O[None,:,:]                      # 候選點 × 方向 × xyz
+        inb=(U <= B+eps).all(-1)
+        cand=np.nonzero(inb.any(1))[0]
+
+        found=None
+        s0, step = 0, _NP_CHUNK0
+        while s0 < len(cand):
+            ci=cand[s0:s0+step]
+            s0 += step; step=min(step*4, _NP_CHUNK)
+            feas=inb[ci]
+            if n:
+                # 只有三軸上緣都超過候選點的已放置商品才可能和從該點放入的商品重疊
+                ahead=(P[ci][:,None,:] < hi[None,:n,:]-eps).all(-1)     # 候選點 × 已放置
+                near=np.nonzero(ahead.any(0))[0]
+                if len(near):
+                    ov=((lo[near][None,None,:,:] < U[ci][:,:,None,:]-eps).all(-1) & ahead[:,None,near]).any(-1)
+                    feas=feas & ~ov
+            hit=np.argwhere(feas)
+            if len(hit):
+                r, oi = hit[0]
+                found=(P[ci[r]], O[oi])
+                break
+
+        if found is None:
+            failed.add(k)
+            continue
+
+        p0, d=found
+        p1=p0+d
+        lo[n]=p0; hi[n]=p1; n += 1
+        failed.clear()
+        out.append((j, tuple(conv(v) for v in p0)+tuple(conv(v) for v in d)))
+
+        # 舊候選點只可能落在剛放入的商品內；新候選點則對所有已放置商品檢查，並移除已貼到箱壁（放不下任何東西）的點
+        P=P[~((p0 <= P+eps) & (P < p1-eps)).all(-1)]
+        new=_np_new_points(p0, p1, lo[:n], hi[:n], eps)
+        inside=((lo[:n][None,:,:] <= new[:,None,:]+eps) & (new[:,None,:] < hi[:n][None,:,:]-eps)).all(-1).any(-1)
+        new=new[~inside & (new < B-eps).all(-1)]
+        if not exact:
+            new=np.round(new, 9)
+        if len(new):
+            new=np.unique(new, axis=0)
+            new=new[~(new[:,None,:] == P[None,:,:]).all(-1).any(-1)]
+            P=np.vstack([P, new])
+            P=P[np.lexsort((P[:,0], P[:,1], P[:,2]))]
+    return out
+
+_FILLERS={'py3dbp':_fill_py3dbp, 'numpy':_fill_numpy}
+
+_GRID_MEMO=OrderedDict()
+_GRID_MEMO_MAX=256   # 格狀排列快取上限（依箱型尺寸 × 商品 kind）
+_GRID_MIN_CAP=64     # 一箱以體積估算可放超過這麼多件才走格狀快速路徑（件數少時引擎本來就快，結果也完全不變）
+_GRID_DEPTH=3        # 剩餘空間再切塊的層數
+_GRID_K_SPAN=3       # 每塊沿切割軸最多少放幾格（留出給其他方向的空間）
+
+def _guillotine(size:Tuple, orients:List[Tuple], depth:int, memo:Dict)->Tuple[int,List[Tuple],List[Tuple]]:
+    """
+    以「切塊」方式在 size 長方體內排同款商品：沿某軸取 k 格厚的一塊，塊內用單一方向 o 排滿格狀，
+    剩下的 3 個長方體再遞迴（最多 depth 層）。回傳 (件數, blocks, free)：
+    blocks=[(相對原點, 方向 o, 各軸格數)]，free=[(相對原點, 大小)] 為最後沒有排商品的空間。
+    """
+    key=(size, depth)
+    if key in memo:
+        return memo[key]
+    zero=tuple(v*0 for v in size)
+    best=(0, [], [(zero, size)])
+    if depth > 0:
+        for o in orients:
+            n=[int(size[i]//o[i]) for i in range(3)]
+            if not all(n):
+                continue
+            for a in range(3):
+                b, c = [i for i in range(3) if i != a]
+                for k in range(n[a], max(0, n[a]-_GRID_K_SPAN), -1):
+                    cnt=[0, 0, 0]; cnt[a]=k; cnt[b]=n[b]; cnt[c]=n[c]
+                    used=[cnt[i]*o[i] for i in range(3)]
+                    # 剩餘：a 軸後段整片 / 塊內 b 軸多出來的 / 塊內 c 軸多出來的
+                    rest=[]
+                    org=list(zero); org[a]=used[a]
+                    sz=list(size); sz[a]=size[a]-used[a]
+                    rest.append((tuple(org), tuple(sz)))
+                    org=list(zero); org[b]=used[b]
+                    sz=list(size); sz[a]=used[a]; sz[b]=size[b]-used[b]
+                    rest.append((tuple(org), tuple(sz)))
+                    org=list(zero); org[c]=used[c]
+                    sz=list(size); sz[a]=used[a]; sz[b]=used[b]; sz[c]=size[c]-used[c]
+                    rest.append((tuple(org), tuple(sz)))
+
+                    total=k*n[b]*n[c]
+                    blocks=[(zero, o, tuple(cnt))]
+                    free=[]
+                    for ro, rs in rest:
+                        if not all(v > 0 for v in rs):
+                            continue
+                        t, bl, fr = _guillotine(rs, orients, depth-1, memo)
+                        total += t
+                        blocks += [(tuple(ro[i]+p[i] for i in range(3)), oo, nn) for p, oo, nn in bl]
+                        free += [(tuple(ro[i]+p[i] for i in range(3)), s) for p, s in fr]
+                    if total > best[0]:
+                        best=(total, blocks, free)
+    memo[key]=best
+    return best
+
+def _grid_layout(b:Dict[str,Any], sk:Sku)->Tuple[List[Tuple],List[Tuple]]:
+    """
+    同一種商品裝滿一箱的格狀排列（解析計算，不逐件碰撞搜尋；可混用不同方向的區塊，見 _guillotine）。
+    回傳 (cells, free)：cells=[(x,y,z,dx,dy,dz)] 依 層 → 行 → 列 排序；free=沒排到商品的長方體空間。
+    結果依 箱型尺寸 × kind 快取。
+    """
+    box=(_q(b['l']), _q(b['w']), _q(b['h']))
+    key=(box, sk.kind())
+    hit=_GRID_MEMO.get(key)
+    if hit is not None:
+        _GRID_MEMO.move_to_end(key)
+        return hit
+
+    d=tuple(_q(v) for v in sk.dims)
+    if sk.fixed:
+        orients=[d]
+    else:
+        orients=[]
+        for o in itertools.permutations(d):
+            if o not in orients:
+                orients.append(o)
+
+    _, blocks, free = _guillotine(box, orients, _GRID_DEPTH, {})
+    cells=[
+        (org[0]+ix*o[0], org[1]+iy*o[1], org[2]+iz*o[2])+tuple(o)
+        for org, o, n in blocks
+        for iz in range(n[2]) for iy in range(n[1]) for ix in range(n[0])
+    ]
+    cells.sort(key=lambda g: (g[2], g[1], g[0]))
+    out=(cells, free)
+    _GRID_MEMO[key]=out
+    while len(_GRID_MEMO) > _GRID_MEMO_MAX:
+        _GRID_MEMO.popitem(last=False)
+    return out
+
+def _grid_fill(b:Dict[str,Any], name:str, seq:List[Sku], n0:int, engine:str, stop=None)->Optional[List[Tuple[int,Tuple]]]:
+    """
+    大量同款商品的快速路徑：seq 整段都是同一 kind（n0 件），直接用 _grid_layout 的格狀位置放入（最多排滿一整箱）；
+    不足一整箱時改用「放得下 n0 件的最低高度」排列，上方整片空間留著。
+    格狀沒用到的剩餘空間（含沒用到的格子），再以 _fill_units 補裝同款剩下的（換方向塞進縫隙）。
+    回傳格式與 _fill_py3dbp 相同；一箱可放件數不多（引擎本來就快）或不足一整層則回傳 []，由呼叫端改走一般引擎。
+    """
+    unit_vol=_q(seq[0].dims[0])*_q(seq[0].dims[1])*_q(seq[0].dims[2])
+    L, W, H = _q(b['l']), _q(b['w']), _q(b['h'])
+    if L*W*H//unit_vol <= _GRID_MIN_CAP:
+        return []
+    cells, free = _grid_layout(b, seq[0])
+    if not cells:
+        return []
+    # 不足一整層（底層格數）：擺法差異大，交給引擎
+    if n0 < sum(1 for g in cells if g[2] == cells[0][2]):
+        return []
+    if n0 < len(cells):
+        # 最後一箱：二分搜尋可排下 n0 件的最低高度（候選高度＝商品各邊長的整數倍）
+        hs=sorted({k*d for d in {_q(v) for v in seq[0].dims} for k in range(1, int(H//d)+1)})
+        lo, hi = 0, len(hs)-1
+        while lo < hi:
+            mid=(lo+hi)//2
+            if len(_grid_layout(dict(b, h=hs[mid]), seq[0])[0]) >= n0:
+                hi=mid
+            else:
+                lo=mid+1
+        c2, f2 = _grid_layout(dict(b, h=hs[lo]), seq[0])
+        if len(c2) >= n0:
+            cells=c2
+            free=f2+([((L*0, W*0, hs[lo]), (L, W, H-hs[lo]))] if H > hs[lo] else [])
+        # 沒用到的格子也還給剩餘空間
+        free=free+[(g[:3], g[3:]) for g in cells[n0:]]
+        cells=cells[:n0]
+    C=len(cells)
+
+    geo=list(enumerate(cells))
+    rest=list(range(C, len(seq)))
+    for org, size in sorted(free, key=lambda f: f[1][0]*f[1][1]*f[1][2], reverse=True):
+        if not rest:
+            break
+        # 剩餘空間當成一個小箱子，遞迴套用同一套裝箱流程（含同款截斷 / 格狀 / 快取）
+        rb={'name':name, 'l':size[0], 'w':size[1], 'h':size[2], 'scale':b.get('scale',1)}
+        ok={}
+        def _fits(sk, rb=rb, ok=ok):
+            k=sk.kind()
+            if k not in ok:
+                ok[k]=_sku_fits_box(sk, rb)
+            return ok[k]
+        g=_fill_units(rb, name, [(seq[j], 1) for j in rest], engine, stop, _fits)
+        if g is None:
+            return None
+        for jj, (x, y, z, dx, dy, dz) in g:
+            geo.append((rest[jj], (x+org[0], y+org[1], z+org[2], dx, dy, dz)))
+        placed={rest[jj] for jj, _ in g}
+        rest=[j for j in rest if j not in placed]
+    return geo
+
+def _fill_units(b:Dict[str,Any], name:str, runs:List[Run], engine:str='py3dbp', stop=None, fits=None)->Optional[List[Tuple[int,Tuple]]]:
+    """
+    單一空間（整箱或箱內剩餘的長方體）裝箱。runs=[(Sku, 件數)] 已依裝箱順序排好；
+    回傳 [(runs 索引, (x,y,z,dx,dy,dz))]（依放入順序，每個 run 放入的一定是它的前幾件）；引擎途中被 stop() 中斷則回傳 None。
+    相同引擎 + 箱型遇到「可套用」的剩餘商品序列時，直接重用上次的擺放結果，不再重跑引擎；
+    整段都是同款的大量商品改用格狀排列（_grid_fill）。
+    fits(sku)：只把回傳 True 的商品交給引擎（放不進空箱的商品交給引擎也只會失敗且不改變箱內狀態，結果相同）。
+    """
+    # 連續同 kind 的一段（可跨多個 run / SKU）：兩個引擎放不下某件時箱內狀態都不變，同段後面的也一定放不下，
+    # 每段實際裝入的必定是該段的前 c 件；而且最多只可能放 箱體積/單件體積 件
+    # → 每段只取前這麼多件（pieces）交給引擎，結果完全相同，工作量只跟箱子容量有關、與訂單件數無關
+    bv=_q(b['l'])*_q(b['w'])*_q(b['h'])
+    kinds=[]; counts=[]; pieces=[]   # pieces[段]=[(runs 索引, 取用件數)]
+    cap=0
+    for ri, (sk, n) in enumerate(runs):
+        if n <= 0 or (fits and not fits(sk)):
+            continue
+        k=sk.kind()
+        if not kinds or kinds[-1] != k:
+            kinds.append(k); counts.append(0); pieces.append([])
+            cap=int(bv//(_q(sk.dims[0])*_q(sk.dims[1])*_q(sk.dims[2])))
+        take=min(n, cap-counts[-1])
+        if take > 0:
+            pieces[-1].append((ri, take))
+            counts[-1] += take
+    # 單件體積就大於箱子的段（沒給 fits 時）一件都放不下：直接去掉
+    segs=[(k, c, p) for k, c, p in zip(kinds, counts, pieces) if c > 0]
+    if not segs:
+        return []
+    kinds, counts, pieces = [list(v) for v in zip(*segs)]
+    kinds=tuple(kinds)
+    key=(engine, b.get('scale',1), b['l'], b['w'], b['h'], kinds)
+
+    hit=_memo_lookup(key, counts)
+    if hit is not None:
+        c, placed = hit
+        src=[]
+        for seg, ci in zip(pieces, c):
+            for ri, m in seg:
+                t=min(m, ci)
+                src.extend([ri]*t)
+                ci -= t
+        return list(zip(src, placed))
+
+    # 格狀結果另存一組 key：格狀擺法隨件數改變，只能在件數完全相同時重用（已截到整箱容量，整箱那幾箱都會命中）
+    gkey=key+('grid',)
+    if len(kinds) == 1:
+        hit=_memo_lookup(gkey, counts)
+        if hit is not None:
+            src=[ri for ri, m in pieces[0] for _ in range(m)]
+            return list(zip(src, hit[1]))
+
+    src=[ri for seg in pieces for ri, m in seg for _ in range(m)]   # 每件 → runs 索引（件數已依容量截斷）
+    seq=[runs[ri][0] for ri in src]
+    # 整段都是同款商品（大量）先走格狀快速路徑；混裝時格狀會佔走其他商品需要的空間，一律交給引擎
+    geo=_grid_fill(b, name, seq, counts[0], engine, stop) if len(kinds) == 1 else []
+    if geo is None:
+        return None
+    if geo:
+        # 同款各件可互換：依件序排列後，第 i 個擺放就是第 i 件，命中時直接對回 runs
+        geo.sort(key=lambda t: t[0])
+        _memo_store(gkey, counts, list(counts), [g for _, g in geo])
+    else:
+        geo=_FILLERS[engine](b, name, seq, stop)
+        if geo is None:
+            return None
+        got={j for j, _ in geo}
+        c=[]; j=0
+        for ni in counts:
+            c.append(sum(1 for t in range(j, j+ni) if t in got)); j += ni
+        _memo_store(key, counts, c, [g for _, g in geo])
+    return [(src[j], g) for j, g in geo]
+
+def _pack_one_bin(b:Dict[str,Any], name:str, runs:List[Run], engine:str='py3dbp', stop=None, fits=None)->Optional[Tuple[List[Placement],List[Run]]]:
+    """
+    單一實體箱裝箱。runs=[(Sku, 件數)] 已依商品排序方式排好（見 _order_units），依序嘗試（見 _fill_units）。
+    回傳 (placements, unfitted)，unfitted 為扣掉裝入件數後的 runs（維持原本的順序）；引擎途中被 stop() 中斷則回傳 None。
+    """
+    geo=_fill_units(b, name, runs, engine, stop, fits)
+    if geo is None:
+        return None
+    taken=[0]*len(runs)
+    placements=[]
+    for ri, g in geo:
+        placements.append(Placement(runs[ri][0], *g))
+        taken[ri] += 1
+    return placements, _runs((sk, n-t) for (sk, n), t in zip(runs, taken))
+
+def _box_vol(b:Dict[str,Any]):
+    return b['l']*b['w']*b['h']
+
+def _q(v):
+    # 與引擎相同的取位（整數 ticks 已取過位；Decimal 取到小數 3 位）→ 判斷結果與 py3dbp 一致
+    return v if isinstance(v, int) else v.quantize(Decimal(1).scaleb(-_DECIMALS))
+
+def _sku_fits_box(sk:Sku, b:Dict[str,Any])->bool:
+    """
+    單件商品能否以任何允許的方向放進空箱：鎖定方向只比對 (x,y,z)，自動則排序後逐邊比對（6 種旋轉皆可）。
+    """
+    d=tuple(_q(v) for v in sk.dims)
+    box=(_q(b['l']), _q(b['w']), _q(b['h']))
+    if sk.fixed:
+        return all(a <= c for a, c in zip(d, box))
+    return all(a <= c for a, c in zip(sorted(d), sorted(box)))
+
+def _fit_table(bins:List[Dict[str,Any]], skus:List[Sku])->Dict[int,frozenset]:
+    # sku id → 放得下的箱型索引集合（空集合＝任何箱子都放不下，完全不必交給引擎）
+    return {sk.id: frozenset(t for t, b in enumerate(bins) if _sku_fits_box(sk, b)) for sk in skus}
+
+def _lower_bounds(bins:List[Dict[str,Any]], skus:List[Sku], fits:Dict[int,frozenset])->Dict[str,Any]:
+    """
+    箱數下限（只計放得下的商品）：
+    - volume：由大到小取用有庫存的箱子，總體積首次 ≥ 商品總體積所需的箱數；
+    - dims：每個方向、每種箱型下三邊都超過箱子一半的「大件」兩兩無法同箱，每件至少一箱。
+    oversize＝任何箱型都放不下的 sku id。
+    """
+    ok=[sk for sk in skus if fits[sk.id]]
+
+    need=sum(sk.dims[0]*sk.dims[1]*sk.dims[2]*sk.qty for sk in ok)
+    lb_vol=0
+    for b in sorted(bins, key=lambda b: _box_vol(b), reverse=True):
+        for _ in range(int(b.get('qty',1) or 1)):
+            if need <= 0:
+                break
+            need -= _box_vol(b)
+            lb_vol += 1
+    if need > 0:
+        lb_vol += 1   # 庫存不足：至少還差一箱
+
+    def _big(sk:Sku)->bool:
+        orients=[sk.dims] if sk.fixed else set(itertools.permutations(sk.dims))
+        return all(
+            all(2*a > c for a, c in zip(o, (b['l'], b['w'], b['h'])))
+            for b in bins for o in orients
+        )
+    lb_dims=sum(sk.qty for sk in ok if _big(sk))
+
+    return {'volume': lb_vol, 'dims': lb_dims, 'boxes': max(lb_vol, lb_dims), 'oversize': [sk.id for sk in skus if not fits[sk.id]]}
+
+def _base_area(sk:Sku):
+    # 底面積：鎖定方向用 x*y；自動則取最大兩邊（可旋轉成最大底面）
+    if sk.fixed:
+        return sk.dims[0]*sk.dims[1]
+    a, b, _ = sorted(sk.dims, reverse=True)
+    return a*b
+
+# 商品排序方式（皆為「由大到小」的穩定排序；volume 即 py3dbp bigger_first=True）
+ITEM_ORDERS={
+    'volume': lambda sk: sk.vol,
+    'edge':   lambda sk: (max(sk.dims), sk.vol),
+    'area':   lambda sk: (_base_area(sk), sk.vol),
+    'weight': lambda sk: (sk.wt, sk.vol),
+    'sku':    lambda sk: -sk.id,   # 依商品表格順序、同 SKU 集中
+}
+
+def _order_units(skus:List[Sku], item_order:str='volume')->List[Run]:
+    """
+    排好裝箱順序，回傳 runs=[(Sku, 件數)]（不展開成每件）：排序鍵只看 SKU，穩定排序下同 SKU 必定相鄰，
+    排 SKU 即等同逐件排序。'random:<seed>' 為固定種子的逐件隨機排列（只有這種需要先展開再壓回 runs）。
+    之後每一箱都沿用這個相對順序（未裝入的件數保持原順序往下一箱）。
+    """
+    if item_order.startswith('random:'):
+        units=[sk for sk in skus for _ in range(sk.qty)]
+        random.Random(item_order.split(':',1)[1]).shuffle(units)
+        return _runs((sk, 1) for sk in units)
+    return _runs((sk, sk.qty) for sk in sorted(skus, key=ITEM_ORDERS.get(item_order, ITEM_ORDERS['volume']), reverse=True))
+
+def _pack_plan(
+    bins:List[Dict[str,Any]],
+    skus:List[Sku],
+    engine:str='py3dbp',
+    order:Optional[List[int]]=None,
+    item_order:str='volume',
+    progress=None,
+    stop=None
+)->Tuple[List[Dict[str,Any]],List[Run],bool]:
+    """
+    依箱型順序 order（bins 的索引；預設依體積大→小）逐型、逐箱裝箱，商品依 item_order 排序。
+    progress(dict)：每裝完一箱回報 已用箱數 / 剩餘件數；stop()：回傳 True 就在下一箱前停止。
+    回傳 (packed, remaining, stopped)：packed=[{'box','name','items':[Placement],'tid'}]，
+    remaining=未裝入商品的 runs [(Sku, 件數)]；stopped=True 表示中途停止（remaining 還沒試完所有箱子）。
+    每一箱的工作量只跟 runs 段數與箱子容量有關，不隨訂單件數成長。
+    """
+    if order is None:
+        order=sorted(range(len(bins)), key=lambda t: float(_box_vol(bins[t])), reverse=True)
+
+    fits=_fit_table(bins, skus)
+    runs=_order_units(skus, item_order)
+    # 預先排除：任何箱型都放不下的商品直接列入未裝入，不交給引擎
+    remaining=_runs(r for r in runs if fits[r[0].id])
+    rejected=[r for r in runs if not fits[r[0].id]]
+    n_rejected=_run_total(rejected)
+    packed=[]
+    if progress:
+        progress({'stage':'pack', 'boxes':0, 'remaining':_run_total(runs)})
+
+    # ✅ 依「箱型 × 可用數量」逐型裝箱；箱號 i 仍依實體箱順序編號（與舊版一致）
+    i=0
+    for n, t in enumerate(order):
+        b=bins[t]
+        qty=int(b.get('qty',1) or 1)
+        later=set(order[n:])
+        if not any(fits[sk.id] & later for sk, _ in remaining):
+            break   # 剩下的商品沒有任何一件放得進剩下的箱型
+        if not any(t in fits[sk.id] for sk, _ in remaining):
+            i += qty   # 這個箱型一件都放不下：整型跳過（箱號照樣保留）
+            continue
+        for k in range(qty):
+            if not remaining:
+                break
+            if stop and stop():
+                return packed, remaining+rejected, True
+            i += 1
+            name=f"{b['name']}#{i}"
+            one=_pack_one_bin(b, name, remaining, engine, stop, fits=lambda sk, t=t: t in fits[sk.id])
+            if one is None:
+                return packed, remaining+rejected, True
+            fitted, unfitted = one
+
+            if not fitted:
+                # 同箱型 + 同一批剩餘商品 → 結果必定相同（一件都裝不下），其餘同型箱直接跳過
+                i += qty-k-1
+                break
+
+            packed.append({'box':b, 'name':name, 'items':fitted, 'tid':t})
+            remaining=unfitted
+            if progress:
+                progress({'stage':'pack', 'boxes':len(packed), 'remaining':_run_total(remaining)+n_rejected})
+        if not remaining:
+            break
+    return packed, remaining+rejected, False
+
+def _plan_metrics(packed:List[Dict[str,Any]], remaining:List[Run])->Tuple:
+    # (未裝入件數, 箱數, 總箱體積, 空箱總重, 已裝商品總體積)
+    return (
+        _run_total(remaining),
+        len(packed),
+        sum(_box_vol(p['box']) for p in packed),
+        round(sum(float(p['box'].get('tare',0) or 0) for p in packed), 6),
+        sum(pl.volume() for p in packed for pl in p['items'])
+    )
+
+def _cost_box_mix(m:Tuple)->Tuple:
+    # 箱型組合最佳化目標：未裝入最少 → 箱數最少 → 總箱體積最小 → 空箱重量最輕
+    return m[:4]
+
+def _cost_util(m:Tuple)->Tuple:
+    # 多起點排序組合目標：未裝入最少 → 箱數最少 → 利用率最高
+    return (m[0], m[1], -float(m[4]/m[2]) if m[2] else 0.0)
+
+def pack_and_render(
+    order_name:str,
+    df_box,
+    df_prod,
+    engine:str='py3dbp',
+    int_units:bool=True,
+    optimize:bool=False,
+    portfolio:bool=False,
+    time_limit:float=10.0,
+    workers:Optional[int]=None,
+    time_budget:Optional[float]=None,
+    progress=None,
+    cancel:Optional[threading.Event]=None,
+    use_cache:bool=True,
+    render:bool=True
+)->Dict[str,Any]:
+    """
+    time_budget：整次計算的時間預算（秒，None=不限）；cancel：外部設定後盡快停止。
+    兩者觸發時回傳「目前最佳」的方案（partial=True 表示仍有商品還沒試完所有箱子）。
+    progress(dict)：裝箱/搜尋進度回報（見 _pack_plan / _search_plans）。
+    use_cache：相同箱型 / 商品 / 引擎設定直接取用持久快取的方案（見 A022）；中途停止或搜尋逾時的結果不寫入。
+    render=False：不建立 3D 圖（fig=None），給批次 / 服務等不需要畫面的呼叫端。
+    df_box / df_prod：DataFrame（畫面）或 _box_rows / _prod_rows 的列 list（批次 / 服務，不需 pandas）。
+    """
+    t0=time.monotonic()
+    deadline=(t0+float(time_budget)) if time_budget else None
+
+    def _stop()->bool:
+        return bool((cancel is not None and cancel.is_set()) or (deadline is not None and time.monotonic() >= deadline))
+
+    if engine not in _FILLERS:
+        return {'ok':False,'error':f'未知的裝箱引擎：{engine}'}
+
+    bins=_build_bins(df_box, int_units)
+    if not bins:
+        return {'ok':False,'error':'請至少勾選 1 個外箱（且數量>0、尺寸>0）'}
+
+    skus=_build_items(df_prod, int_units)
+    if not skus:
+        return {'ok':False,'error':'請至少勾選 1 個商品（且數量>0、尺寸>0）'}
+
+    # 固定配色：依商品表格順序（跨箱一致）
+    color_map={}
+    ci=0
+    for sk in skus:
+        if sk.name not in color_map:
+            color_map[sk.name]=_PALETTE[ci%len(_PALETTE)]
+            ci += 1
+
+    bounds=_lower_bounds(bins, skus, _fit_table(bins, skus))
+
+    opt_info=None
+    cache_key=None
+    cached=None
+    if use_cache:
+        cache_key=_result_key(bins, skus, {
+            'engine': engine,
+            'optimize': bool(optimize),
+            'portfolio': _portfolio_orders(workers) if portfolio else None,
+        })
+        cached=_RESULT_CACHE.get(cache_key)
+
+    if cached is not None:
+        packed, remaining = _plan_from_compact(bins, skus, _compact_load(cached['plan']))
+        opt_info=cached.get('optimizer')
+        stopped=False
+    elif optimize or portfolio:
+        if deadline is not None:
+            time_limit=min(float(time_limit), max(0.0, deadline-time.monotonic()))
+        packed, remaining, stopped, opt_info = _search_plans(
+            bins, skus, engine, box_mix=optimize, portfolio=portfolio, time_limit=time_limit, workers=workers,
+            progress=progress, stop=_stop
+        )
+    else:
+        packed, remaining, stopped = _pack_plan(bins, skus, engine, progress=progress, stop=_stop)
+
+    if cache_key and cached is None and not stopped and not (opt_info or {}).get('timed_out'):
+        _RESULT_CACHE.put(cache_key, {'plan': _compact_dump(_plan_compact(packed, remaining)), 'optimizer': opt_info})
+    stop_reason=None
+    if stopped:
+        stop_reason='cancelled' if (cancel is not None and cancel.is_set()) else 'time_budget'
+
+    # 未裝入：依 SKU 彙總件數 [(Sku, n)]
+    left={}
+    for sk, n in remaining:
+        left[sk.id]=left.get(sk.id,0)+n
+    unfitted=[(sk, left[sk.id]) for sk in skus if sk.id in left]
+    all_fitted=[pl for p in packed for pl in p['items']]
+
+    content_wt=sum(float(pl.sku.wt or 0) for pl in all_fitted)
+    tare_total=sum(float(p['box'].get('tare',0) or 0) for p in packed)
+    total_wt=content_wt+tare_total
+
+    # 整數模式下體積全程是整數（ticks³），只有最後的比例才轉成 float
+    used_item_vol=sum(pl.volume() for pl in all_fitted)
+    used_box_vol=sum(p['box']['l']*p['box']['w']*p['box']['h'] for p in packed)
+    util=float(used_item_vol*100/used_box_vol) if used_box_vol>0 else 0.0
+    util=max(0.0, min(100.0, util))
+
+    if not render:
+        fig=None
+    elif packed:
+        fig=build_3d_fig(packed[0]['box'], packed[0]['items'], color_map=color_map)
+    else:
+        import plotly.graph_objects as go
+        fig=go.Figure()
+
+    class _MiniBin:
+        def __init__(self, name, items):
+            self.name=name
+            self.items=items
+
+    packer_bins=[_MiniBin(p['name'], p['items']) for p in packed]
+    bins_input=[p['box'] for p in packed]
+
+    return {
+        'ok':True,
+        'bins_input': bins_input,
+        'packer_bins': packer_bins,
+        'packed_bins': packed,
+        'used_bin_count': len(packed),
+        'unfitted': unfitted,
+        'content_wt': content_wt,
+        'total_wt': total_wt,
+        'util': util,
+        'fig': fig,
+        'color_map': color_map,
+        'engine': engine,
+        'int_units': int_units,
+        'optimizer': opt_info,
+        'partial': stopped,
+        'stop_reason': stop_reason,
+        'cache_hit': cached is not None,
+        'bounds': bounds,
+        'elapsed': round(time.monotonic()-t0, 3),
+        'result_id': uuid.uuid4().hex,   # 每次計算結果一個 id：報告 / 圖表快取以此為 key
+    }
+#------A016：裝箱計算核心（py3dbp / NumPy 引擎）+ 統計(結束)：------
+
+
+#------A021：平行搜尋（箱型組合最佳化 / 多起點商品排序）(開始)：------
+_OPT_MAX_ORDERS=720   # 箱型順序候選上限（6 種箱型以內直接窮舉）
+_OPT_MAX_CANDIDATES=2000   # 箱型順序 × 商品排序 的候選總數上限
+_OPT_CTX:Dict[str,Any]={}
+
+def _portfolio_orders(workers:Optional[int]=None)->List[str]:
+    # 固定排序 + 固定種子隨機排列；隨機數量隨核心數增加，讓每顆核心都有事做
+    n=max(11, (workers or os.cpu_count() or 1)*2-5)
+    return ['volume','edge','area','weight','sku']+[f'random:{i}' for i in range(n)]
+
+def _opt_orders(bins:List[Dict[str,Any]])->List[Tuple[int,...]]:
+    """
+    候選箱型順序：第一個一定是原本的「體積大→小」，
+    箱型 ≤6 種時窮舉所有排列；更多時用 小→大、每型先用一次、固定種子隨機排列補滿。
+    """
+    base=tuple(sorted(range(len(bins)), key=lambda t: float(_box_vol(bins[t])), reverse=True))
+    if len(base) <= 6:
+        return [base]+[p for p in itertools.permutations(base) if p != base]
+
+    orders=[base, tuple(reversed(base))]
+    orders += [(t,)+tuple(x for x in base if x != t) for t in base]
+    rnd=random.Random(0)
+    for _ in range(_OPT_MAX_ORDERS*4):
+        if len(orders) >= _OPT_MAX_ORDERS:
+            break
+        p=list(base); rnd.shuffle(p)
+        orders.append(tuple(p))
+    seen=set(); out=[]
+    for o in orders:
+        if o not in seen:
+            seen.add(o); out.append(o)
+    return out
+
+def _opt_candidates(box_orders:List[Tuple[int,...]], item_orders:List[str], limit:int)->List[Tuple]:
+    """
+    箱型順序 × 商品排序 依對角線交錯列出（(0,0),(0,1),(1,0),(0,2),(1,1),(2,0)...），取前 limit 個：
+    超過上限截斷時兩邊都有取樣，不會只剩前幾個箱型順序配上全部商品排序；第一個一定是 (原本順序, 第一種商品排序)。
+    """
+    n, m = len(box_orders), len(item_orders)
+    pairs=((box_orders[i], item_orders[d-i]) for d in range(n+m-1) for i in range(max(0, d-m+1), min(n, d+1)))
+    return list(itertools.islice(pairs, limit))
+
+def _downsize_last(bins:List[Dict[str,Any]], packed:List[Dict[str,Any]], engine:str)->List[Dict[str,Any]]:
+    """
+    末箱換小：把最後一箱的內容改裝進「體積更小、還有庫存」的箱型，由小到大找第一個全裝得下的。
+    """
+    if not packed:
+        return packed
+    last=packed[-1]
+    used={}
+    for p in packed[:-1]:
+        used[p['tid']]=used.get(p['tid'],0)+1
+
+    units=_runs((pl.sku, 1) for pl in last['items'])
+    need=sum(pl.volume() for pl in last['items'])
+    cur_vol=_box_vol(last['box'])
+    no=last['name'].rsplit('#',1)[-1]
+    for t in sorted(range(len(bins)), key=lambda t: float(_box_vol(bins[t]))):
+        b=bins[t]
+        if _box_vol(b) >= cur_vol or used.get(t,0) >= int(b.get('qty',1) or 1):
+            continue
+        if _box_vol(b) < need or not all(_sku_fits_box(sk, b) for sk in {sk.id: sk for sk, _ in units}.values()):
+            continue   # 體積不夠或有商品放不進去：不必交給引擎
+        name=f"{b['name']}#{no}"
+        fitted, left = _pack_one_bin(b, name, units, engine)
+        if not left:
+            return packed[:-1]+[{'box':b, 'name':name, 'items':fitted, 'tid':t}]
+    return packed
+
+def _opt_eval(bins:List[Dict[str,Any]], skus:List[Sku], engine:str, cand:Tuple, downsize:bool=True, progress=None, stop=None)->Tuple:
+    """
+    評估一個候選 cand=(箱型順序, 商品排序)：回傳 (metrics, cand, 精簡版結果, stopped)。
+    精簡版只含索引與數字，跨程序傳遞較省。
+    """
+    order, item_order = cand
+    packed, remaining, stopped = _pack_plan(bins, skus, engine, list(order), item_order, progress, stop)
+    if downsize and not stopped:
+        packed=_downsize_last(bins, packed, engine)
+    return _plan_metrics(packed, remaining), cand, _plan_compact(packed, remaining), stopped
+
+def _plan_compact(packed:List[Dict[str,Any]], remaining:List[Run])->Tuple:
+    # 精簡版方案：([(箱型索引, 箱名, [(sku id, x,y,z,dx,dy,dz)])], [(未裝入 sku id, 件數)])
+    return (
+        [(p['tid'], p['name'], [(pl.sku.id,)+pl.pos()+pl.dims() for pl in p['items']]) for p in packed],
+        [(sk.id, n) for sk, n in remaining]
+    )
+
+def _opt_init(bins, skus, engine, downsize, halt=None, deadline=None):
+    # worker 程序初始化：箱型/商品只傳一次；halt（multiprocessing.Event）/ deadline（time.time()）讓執行中的候選及時停下
+    _OPT_CTX.update(bins=bins, skus=skus, engine=engine, downsize=downsize, halt=halt, deadline=deadline)
+
+def _opt_stop()->bool:
+    # 主程序已結束搜尋（時間到 / 取消，見 _run_parallel 的 halt）或超過截止時間：候選在下一箱（或引擎檢查點）停下
+    halt, deadline = _OPT_CTX.get('halt'), _OPT_CTX.get('deadline')
+    return bool((halt is not None and halt.is_set()) or (deadline is not None and time.time() >= deadline))
+
+def _opt_task(cand):
+    return _opt_eval(_OPT_CTX['bins'], _OPT_CTX['skus'], _OPT_CTX['engine'], cand, _OPT_CTX['downsize'], stop=_opt_stop)
+
+def _plan_from_compact(bins:List[Dict[str,Any]], skus:List[Sku], compact:Tuple)->Tuple[List[Dict[str,Any]],List[Run]]:
+    by_id={sk.id: sk for sk in skus}
+    rows, left = compact
+    packed=[{
+        'box':bins[t], 'name':name, 'tid':t,
+        'items':[Placement(by_id[g[0]], *g[1:]) for g in geo]
+    } for t, name, geo in rows]
+    return packed, [(by_id[i], n) for i, n in left]
+
+def _run_parallel(
+    task,
+    args:List[Any],
+    time_limit:float,
+    workers:Optional[int]=None,
+    initializer=None,
+    initargs=(),
+    stop=None,
+    on_result=None,
+    halt=None
+)->Tuple[List[Any],bool]:
+    """
+    用 process pool 平行執行 task(arg)，在 time_limit 秒內（或 stop() 為 True 前）盡量收集結果。
+    每收到一個結果就呼叫 on_result(r)。回傳 (results, stopped_early)；
+    workers<=1（例如已在批次 / 服務的 worker 程序內）或多程序不可用時（例如環境限制）改在本程序內依序執行。
+    halt：跨程序的 Event（經 initargs 交給 worker），結束收集時 set()；已在執行的 task 要自己檢查它才會停下
+    （shutdown(cancel_futures=True) 只能取消還沒開始的）。
+    """
+    deadline=time.monotonic()+max(0.0, float(time_limit))
+    results=[]
+    ex=None
+
+    def _serial()->Tuple[List[Any],bool]:
+        out=[]
+        if initializer:
+            initializer(*initargs)
+        for a in args:
+            if time.monotonic() >= deadline or (stop and stop()):
+                return out, True
+            out.append(task(a))
+            if on_result:
+                on_result(out[-1])
+        return out, False
+
+    if workers is not None and workers <= 1:
+        return _serial()
+    try:
+        # 函式必須能以參照 pickle（定義在可 import 的模組，例如本模組）；定義在 __main__ 的函式
+        # 在 Streamlit rerun 換掉 __main__ 後會在 feeder 執行緒出錯並卡住 shutdown → 先檢查，不行就依序執行
+        pickle.dumps((task, initializer))
+        ex=ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1, initializer=initializer, initargs=initargs)
+        pending={ex.submit(task, a) for a in args}
+        while pending:
+            left=deadline-time.monotonic()
+            if left <= 0 or (stop and stop()):
+                break
+            # 分段等待，才能及時反應取消
+            done, pending = wait(pending, timeout=min(left, 0.2), return_when=FIRST_COMPLETED)
+            for f in done:
+                results.append(f.result())
+                if on_result:
+                    on_result(results[-1])
+        return results, bool(pending)
+    except Exception:
+        return _serial()
+    finally:
+        if halt is not None:
+            halt.set()
+        if ex is not None:
+            # 不等待仍在跑的候選（時間到就回傳目前最佳）；它們看到 halt 後在下一箱停下
+            ex.shutdown(wait=False, cancel_futures=True)
+
+def _search_plans(
+    bins:List[Dict[str,Any]],
+    skus:List[Sku],
+    engine:str,
+    box_mix:bool=True,
+    portfolio:bool=False,
+    time_limit:float=10.0,
+    workers:Optional[int]=None,
+    progress=None,
+    stop=None
+)->Tuple[List[Dict[str,Any]],List[Run],bool,Dict[str,Any]]:
+    """
+    平行搜尋裝箱方案，時間內回傳找到的最佳方案：
+    - box_mix：評估多種箱型順序（各自再做末箱換小），目標 未裝入 → 箱數 → 總體積 → 空箱重量。
+    - portfolio：同一組箱型用多種商品排序（體積/最長邊/底面積/重量/SKU 分組/隨機）各跑一次，
+      目標 未裝入 → 箱數 → 利用率（兩者同時開啟時以箱型組合目標為準）。
+    原本的「大→小 + 體積排序」貪婪解一定會先在本程序內算出，作為保底；
+    保底解若被 stop() 中斷，直接回傳該部分結果（stopped=True）。
+    progress(dict)：每評估完一個候選回報 已評估 / 候選總數 / 目前最佳箱數與未裝入件數。
+    """
+    t0=time.monotonic()
+    box_orders=_opt_orders(bins) if box_mix else _opt_orders(bins)[:1]
+    item_orders=_portfolio_orders(workers) if portfolio else ['volume']
+    cands=_opt_candidates(box_orders, item_orders, _OPT_MAX_CANDIDATES)
+    cost=_cost_box_mix if box_mix else _cost_util
+
+    best=_opt_eval(bins, skus, engine, cands[0], box_mix, progress, stop)
+    baseline=best[0]
+    state={'best':best, 'evaluated':1}
+
+    def _on_result(r):
+        state['evaluated'] += 1
+        # 中途停下的候選還沒試完所有箱子，指標不可比
+        if not r[3] and cost(r[0]) < cost(state['best'][0]):
+            state['best']=r
+        if progress:
+            m=state['best'][0]
+            progress({'stage':'search', 'evaluated':state['evaluated'], 'candidates':len(cands), 'boxes':m[1], 'remaining':m[0]})
+
+    timed_out=False
+    if len(cands) > 1 and not best[3]:
+        left=max(0.0, float(time_limit)-(time.monotonic()-t0))
+        try:
+            halt=multiprocessing.Event()
+        except Exception:
+            halt=None   # 環境不支援跨程序同步（例如沒有共享記憶體）：只靠截止時間停下
+        _, timed_out = _run_parallel(
+            _opt_task, cands[1:], left, workers, _opt_init, (bins, skus, engine, box_mix, halt, time.time()+left),
+            stop=stop, on_result=_on_result, halt=halt
+        )
+    best=state['best']
+
+    packed, remaining = _plan_from_compact(bins, skus, best[2])
+    order, item_order = best[1]
+    info={
+        'candidates': len(cands),
+        'evaluated': state['evaluated'],
+        'timed_out': timed_out,
+        'elapsed': round(time.monotonic()-t0, 3),
+        'baseline_boxes': baseline[1],
+        'best_order': [bins[t]['name'] for t in order],
+        'best_item_order': item_order,
+    }
+    return packed, remaining, best[3], info
+#------A021：平行搜尋（箱型組合最佳化 / 多起點商品排序）(結束)：------
+
+
+#------A022：裝箱結果快取（SQLite，跨重啟 / 跨 session）(開始)：------
+_RESULT_CACHE_VER=4   # 裝箱演算法有改動時 +1，舊快取自動失效
+_RESULT_CACHE_DB=_secret('PACK_CACHE_DB','').strip() or _cache_file('pack_cache.sqlite3')
+_RESULT_CACHE_MAX_BYTES=int(_to_float(_secret('PACK_CACHE_MAX_MB','64'), 64)*1024*1024)
+
+def _result_key(bins:List[Dict[str,Any]], skus:List[Sku], settings:Dict[str,Any])->str:
+    """
+    內容定址：以「勾選 + 清理後」實際參與計算的箱型 / 商品（順序有意義：箱號、配色、SKU id 都依此）
+    加上引擎設定做 canonical JSON → sha256。訂單名稱等不影響結果的欄位不列入。
+    """
+    doc={
+        'v': _RESULT_CACHE_VER,
+        'bins': [[b['name'], str(b['l']), str(b['w']), str(b['h']), b['tare'], b['qty'], b['scale']] for b in bins],
+        'skus': [[sk.name, [str(d) for d in sk.dims], sk.wt, sk.qty, sk.orient] for sk in skus],
+        'settings': settings,
+    }
+    raw=json.dumps(doc, ensure_ascii=False, sort_keys=True, separators=(',',':'))
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+def _compact_dump(compact:Tuple)->List:
+    # Decimal 座標轉字串（整數模式本來就是 int）
+    rows, left = compact
+    return [
+        [[t, name, [[v if isinstance(v, int) else str(v) for v in g] for g in geo]] for t, name, geo in rows],
+        left
+    ]
+
+def _compact_load(doc:List)->Tuple:
+    rows, left = doc
+    return (
+        [(t, name, [tuple(v if isinstance(v, int) else Decimal(v) for v in g) for g in geo]) for t, name, geo in rows],
+        left
+    )
+
+class _ResultCache:
+    """
+    裝箱結果的持久快取：只存方案（JSON + zlib），不存 Plotly 圖；命中後由方案重建統計與 3D 圖。
+    依總大小做 LRU 淘汰（last_used 最舊者先刪），並累計命中率。快取失敗一律當作未命中，不影響計算。
+    """
+    def __init__(self, path:str, max_bytes:int):
+        self.path=path
+        self.max_bytes=max_bytes
+        self._lock=threading.Lock()
+        self._ready=False
+
+    def _conn(self)->sqlite3.Connection:
+        con=sqlite3.connect(self.path, timeout=5)
+        if not self._ready:
+            con.execute('PRAGMA journal_mode=WAL')
+            con.execute('CREATE TABLE IF NOT EXISTS results(k TEXT PRIMARY KEY, plan BLOB NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)')
+            con.execute('CREATE INDEX IF NOT EXISTS results_lru ON results(last_used)')
+            con.execute('CREATE TABLE IF NOT EXISTS stats(k TEXT PRIMARY KEY, v INTEGER NOT NULL)')
+            con.commit()
+            self._ready=True
+        return con
+
+    def _count(self, con, k:str):
+        con.execute('INSERT INTO stats(k,v) VALUES(?,1) ON CONFLICT(k) DO UPDATE SET v=v+1', (k,))
+
+    def get(self, key:str)->Optional[Dict[str,Any]]:
+        try:
+            with self._lock:
+                con=self._conn()
+                try:
+                    row=con.execute('SELECT plan FROM results WHERE k=?', (key,)).fetchone()
+                    if row:
+                        con.execute('UPDATE results SET last_used=? WHERE k=?', (time.time(), key))
+                    self._count(con, 'hits' if row else 'misses')
+                    con.commit()
+                finally:
+                    con.close()
+            return json.loads(zlib.decompress(row[0]).decode('utf-8')) if row else None
+        except Exception:
+            return None
+
+    def put(self, key:str, doc:Dict[str,Any]):
+        try:
+            blob=zlib.compress(json.dumps(doc, ensure_ascii=False, separators=(',',':')).encode('utf-8'))
+            if len(blob) > self.max_bytes:
+                return
+            with self._lock:
+                con=self._conn()
+                try:
+                    con.execute('INSERT OR REPLACE INTO results(k,plan,size,last_used) VALUES(?,?,?,?)', (key, blob, len(blob), time.time()))
+                    total=con.execute('SELECT COALESCE(SUM(size),0) FROM results').fetchone()[0]
+                    # 超過上限：從最久沒用到的開始刪
+                    for k, size in con.execute('SELECT k,size FROM results WHERE k<>? ORDER BY last_used', (key,)).fetchall():
+                        if total <= self.max_bytes:
+                            break
+                        con.execute('DELETE FROM results WHERE k=?', (k,))
+                        total -= size
+                    con.commit()
+                finally:
+                    con.close()
+        except Exception:
+            pass
+
+    def stats(self)->Dict[str,Any]:
+        try:
+            with self._lock:
+                con=self._conn()
+                try:
+                    n, size = con.execute('SELECT COUNT(*), COALESCE(SUM(size),0) FROM results').fetchone()
+                    st_=dict(con.execute('SELECT k,v FROM stats').fetchall())
+                finally:
+                    con.close()
+        except Exception:
+            return {'entries':0, 'bytes':0, 'hits':0, 'misses':0, 'hit_rate':0.0}
+        hits, misses = st_.get('hits',0), st_.get('misses',0)
+        return {
+            'entries': n, 'bytes': size, 'hits': hits, 'misses': misses,
+            'hit_rate': (hits/(hits+misses)) if (hits+misses) else 0.0
+        }
+
+    def clear(self):
+        try:
+            with self._lock:
+                con=self._conn()
+                try:
+                    con.execute('DELETE FROM results')
+                    con.execute('DELETE FROM stats')
+                    con.commit()
+                finally:
+                    con.close()
+        except Exception:
+            pass
+
+_RESULT_CACHE=_ResultCache(_RESULT_CACHE_DB, _RESULT_CACHE_MAX_BYTES)
+#------A022：裝箱結果快取（SQLite，跨重啟 / 跨 session）(結束)：------
+
+
+#------A023：裝箱結果 JSON 輸出（批次 CLI / 服務共用）(開始)：------
+def plan_json(order_name:str, res:Dict[str,Any], placements:bool=True)->Dict[str,Any]:
+    """
+    pack_and_render 的結果轉成純 JSON（不含 Plotly 圖、Sku 物件）：
+    箱數 / 利用率 / 重量 / 未裝入件數，placements=True 時附每箱每件的位置與尺寸（原始單位）。
+    """
+    if not res.get('ok'):
+        return {'order': order_name, 'ok': False, 'error': res.get('error', '未知錯誤')}
+    out={
+        'order': order_name,
+        'ok': True,
+        'engine': res.get('engine'),
+        'box_count': res['used_bin_count'],
+        'util': round(float(res['util']), 4),
+        'content_wt': round(float(res['content_wt']), 4),
+        'total_wt': round(float(res['total_wt']), 4),
+        'unfitted': [{'sku': sk.id, 'name': sk.name, 'qty': n} for sk, n in res['unfitted']],
+        'partial': bool(res.get('partial')),
+        'cache_hit': bool(res.get('cache_hit')),
+        'elapsed': res.get('elapsed'),
+    }
+    if res.get('bounds'):
+        out['lower_bound']=res['bounds']['boxes']
+    if placements:
+        boxes=[]
+        for p in res['packed_bins']:
+            b=p['box']; sc=b.get('scale',1)
+            boxes.append({
+                'name': p['name'],
+                'type': b['name'],
+                'size': [_num(b[k], sc) for k in ('l','w','h')],
+                'items': [
+                    {'sku': pl.sku.id, 'name': pl.sku.name, 'pos': [_num(v, sc) for v in pl.pos()], 'dims': [_num(v, sc) for v in pl.dims()]}
+                    for pl in p['items']
+                ],
+            })
+        out['boxes']=boxes
+    return out
+#------A023：裝箱結果 JSON 輸出（批次 CLI / 服務共用）(結束)：------
+
+
+#------A024：模板本機快取（SQLite，stale-while-revalidate）(開始)：------
+_TEMPLATE_DB=_secret('TEMPLATE_CACHE_DB','').strip() or os.path.join(os.path.dirname(os.path.abspath(__file__)), '.template_cache.sqlite3')
+_TEMPLATE_FRESH=_to_float(_secret('TEMPLATE_FRESH_SECONDS','20'), 20.0)   # 本機副本多久內視為最新（秒），超過就在背景重新驗證
+
+class _SingleFlight:
+    """
+    同一個 key 同時只有一個請求真的向 GAS 發出：其他 thread（其他 session）等它完成、共用結果（request coalescing）。
+    例外也會傳給所有等待者；完成後 key 立即釋放，下一次呼叫重新發出。
+    """
+    def __init__(self):
+        self._lock=threading.Lock()
+        self._calls: Dict[Any,Dict[str,Any]] = {}
+
+    def busy(self, key)->bool:
+        with self._lock:
+            return key in self._calls
+
+    def do(self, key, fn):
+        with self._lock:
+            call=self._calls.get(key)
+            leader=call is None
+            if leader:
+                call=self._calls[key]={'done': threading.Event(), 'result': None, 'error': None}
+        if not leader:
+            call['done'].wait()
+        else:
+            try:
+                call['result']=fn()
+            except BaseException as e:
+                call['error']=e
+            finally:
+                with self._lock:
+                    self._calls.pop(key, None)
+                call['done'].set()
+        if call['error'] is not None:
+            raise call['error']
+        return call['result']
+
+class _TemplateStore:
+    """
+    GAS 模板的本機副本（SQLite，跨重啟、同一台主機所有 session 共用）：以 (GAS 網址, 表, 名稱) 為 key，記錄伺服器版本。
+    讀取一律直接回本機副本；超過 fresh 秒沒確認就在背景重新驗證（stale-while-revalidate）：
+    只抓版本清單（list_full payloads=0），版本變了的模板才用一次 batch 下載 payload。
+    舊版 GAS 沒有版本：只同步名稱，payload 在載入時才抓。本機快取失敗一律直接問 GAS，不影響功能。
+    同一張表的重新驗證、同一個模板的下載，同時只會有一個真的送到 GAS（_SingleFlight）；
+    失效只針對變動的表 / 模板（invalidate），不會清掉其他表或其他快取。
+    """
+    def __init__(self, path:str, fresh:float):
+        self.path=path
+        self.fresh=fresh
+        self._ready=False
+        self._flight=_SingleFlight()
+        self._pin_lock=threading.Lock()
+        self._pinned: Dict[Tuple[str,str],Dict[str,int]] = {}   # 尚未寫回 GAS 的模板：重新驗證時保留本機內容
+
+    def _conn(self)->sqlite3.Connection:
+        con=sqlite3.connect(self.path, timeout=5)
+        if not self._ready:
+            con.execute('PRAGMA journal_mode=WAL')
+            con.execute('CREATE TABLE IF NOT EXISTS templates(src TEXT NOT NULL, sheet TEXT NOT NULL, name TEXT NOT NULL, version TEXT, payload TEXT, PRIMARY KEY(src, sheet, name))')
+            con.execute('CREATE TABLE IF NOT EXISTS sheets(src TEXT NOT NULL, sheet TEXT NOT NULL, checked REAL NOT NULL, PRIMARY KEY(src, sheet))')
+            con.commit()
+            self._ready=True
+        return con
+
+    @staticmethod
+    def _src(client:GASClient)->str:
+        # 只存網址雜湊（不存 token）：換了 GAS 部署就是另一份副本
+        return hashlib.sha1(client.url.encode('utf-8')).hexdigest()[:16]
+
+    def _read(self, src:str, sheet:str)->Optional[Tuple[float, Dict[str,Dict[str,Any]]]]:
+        con=self._conn()
+        try:
+            row=con.execute('SELECT checked FROM sheets WHERE src=? AND sheet=?', (src, sheet)).fetchone()
+            if row is None:
+                return None
+            rows=con.execute('SELECT name, version, payload FROM templates WHERE src=? AND sheet=?', (src, sheet)).fetchall()
+        finally:
+            con.close()
+        return row[0], {n: {'payload': _parse_payload(p) if p is not None else None, 'version': v} for n, v, p in rows}
+
+    def pin(self, client:GASClient, sheet:str, name:str, on:bool=True):
+        # 背景同步排隊中的模板（見 _TemplateSync）：本機版本比雲端新，驗證 / 清單不可覆蓋
+        key=(self._src(client), sheet)
+        with self._pin_lock:
+            names=self._pinned.setdefault(key, {})
+            names[name]=names.get(name, 0)+(1 if on else -1)
+            if names[name] <= 0:
+                names.pop(name)
+
+    def _write(self, src:str, sheet:str, listing:Dict[str,Dict[str,Any]], checked:float):
+        # 整張表換成 listing；新清單沒帶 payload、但版本與本機相同的，沿用本機 payload。
+        # checked＝這份清單向 GAS 取得的時間：本機已有更新的副本（例如驗證途中剛寫入）就不覆蓋
+        with self._pin_lock:
+            pinned=set(self._pinned.get((src, sheet)) or ())
+        con=self._conn()
+        try:
+            row=con.execute('SELECT checked FROM sheets WHERE src=? AND sheet=?', (src, sheet)).fetchone()
+            if row is not None and row[0] > checked:
+                return
+            old={n: (v, p) for n, v, p in con.execute('SELECT name, version, payload FROM templates WHERE src=? AND sheet=?', (src, sheet))}
+            rows=[(src, sheet, n, old[n][0], old[n][1]) for n in pinned if n in old]
+            for n, it in listing.items():
+                if n in pinned:
+                    continue
+                v=it.get('version')
+                if it.get('payload') is not None:
+                    p=json.dumps(it['payload'], ensure_ascii=False)
+                else:
+                    p=old[n][1] if (v is not None and n in old and old[n][0] == v) else None
+                rows.append((src, sheet, n, v, p))
+            con.execute('DELETE FROM templates WHERE src=? AND sheet=?', (src, sheet))
+            con.executemany('INSERT INTO templates(src, sheet, name, version, payload) VALUES(?,?,?,?,?)', rows)
+            con.execute('INSERT OR REPLACE INTO sheets(src, sheet, checked) VALUES(?,?,?)', (src, sheet, checked))
+            con.commit()
+        finally:
+            con.close()
+
+    def revalidate(self, client:GASClient, sheet:str)->bool:
+        """向 GAS 確認版本：只下載新增 / 版本變了的模板。GAS 連不上時保留本機副本，回傳 False。"""
+        return self._flight.do(('sheet', client.url, sheet), lambda: self._revalidate(client, sheet))
+
+    def _revalidate(self, client:GASClient, sheet:str)->bool:
+        src=self._src(client)
+        t0=time.time()
+        try:
+            snap=self._read(src, sheet)
+        except Exception:
+            snap=None
+        # 還沒有本機副本：名稱 + payload 一次抓完；已有副本：只抓版本
+        versions=client.list_full(sheet, payloads=snap is None)
+        if versions is None:
+            return False
+        local=snap[1] if snap else {}
+        need=[n for n, it in versions.items()
+              if it['version'] is not None and it['payload'] is None
+              and (n not in local or local[n]['version'] != it['version'] or local[n]['payload'] is None)]
+        if need:
+            res=client.batch([{'action': 'get', 'sheet': sheet, 'name': n} for n in need]) or []
+            for n, d in zip(need, res):
+                if d.get('ok'):
+                    versions[n]={'payload': _parse_payload(d.get('payload_json')), 'version': str(d.get('version') or versions[n]['version'])}
+        try:
+            self._write(src, sheet, versions, t0)
+        except Exception:
+            pass
+        return True
+
+    def _revalidate_async(self, client:GASClient, sheet:str):
+        # 已經有人在驗證這張表（背景或同步）就不再開 thread
+        if self._flight.busy(('sheet', client.url, sheet)):
+            return
+        threading.Thread(target=self.revalidate, args=(client, sheet), name='template-revalidate', daemon=True).start()
+
+    def listing(self, client:GASClient, sheet:str)->Dict[str,Dict[str,Any]]:
+        """{名稱: {'payload', 'version'}}：有本機副本就立即回傳（過期則背景更新），第一次才同步向 GAS 抓。"""
+        if not client.ready:
+            return {}
+        src=self._src(client)
+        try:
+            snap=self._read(src, sheet)
+            if snap is None:
+                self.revalidate(client, sheet)
+                snap=self._read(src, sheet)
+        except Exception:
+            return client.list_full(sheet) or {}
+        if snap is None:
+            return {}
+        if time.time()-snap[0] > self.fresh:
+            self._revalidate_async(client, sheet)
+        return snap[1]
+
+    def get(self, client:GASClient, sheet:str, name:str)->Optional[Dict[str,Any]]:
+        # 本機有 payload 直接用；沒有（舊版 GAS / 還沒下載）才向 GAS 抓，並存回本機
+        src=self._src(client)
+        it=None
+        try:
+            snap=self._read(src, sheet)
+            it=(snap[1] if snap else {}).get(name)
+            if it and it['payload'] is not None:
+                return it['payload']
+        except Exception:
+            snap=None
+        payload=self._flight.do(('get', client.url, sheet, name), lambda: client.get_payload(sheet, name))
+        if payload is not None and snap is not None:
+            self.put(client, sheet, name, payload, version=(it or {}).get('version'), stale=False)
+        return payload
+
+    def apply_listing(self, client:GASClient, sheet:str, listing:Dict[str,Dict[str,Any]]):
+        # 寫入時 batch 一併取回的最新清單：直接成為本機副本（視為剛確認過）
+        try:
+            self._write(self._src(client), sheet, listing, time.time())
+        except Exception:
+            pass
+
+    def put(self, client:GASClient, sheet:str, name:str, payload:Optional[Dict[str,Any]], version:Optional[str]=None, stale:bool=True):
+        """
+        寫入成功但沒拿到最新清單時（舊版 GAS）：本機先改（payload=None 表示已刪除），
+        stale=True 時把這張表標成過期，下次讀取時在背景向 GAS 確認版本。
+        """
+        src=self._src(client)
+        try:
+            con=self._conn()
+            try:
+                if payload is None:
+                    con.execute('DELETE FROM templates WHERE src=? AND sheet=? AND name=?', (src, sheet, name))
+                else:
+                    con.execute('INSERT OR REPLACE INTO templates(src, sheet, name, version, payload) VALUES(?,?,?,?,?)',
+                                (src, sheet, name, version, json.dumps(payload, ensure_ascii=False)))
+                if stale:
+                    con.execute('UPDATE sheets SET checked=0 WHERE src=? AND sheet=?', (src, sheet))
+                con.commit()
+            finally:
+                con.close()
+        except Exception:
+            pass
+
+    def invalidate(self, client:GASClient, sheet:str, name:Optional[str]=None):
+        """
+        只讓指定的表（或表中的一個模板）失效：表標成過期，下次讀取時背景驗證；
+        指定 name 時清掉該模板的本機 payload / 版本，下次載入或驗證時重新下載（例如寫入逾時、不確定雲端是否已更新）。
+        """
+        src=self._src(client)
+        try:
+            con=self._conn()
+            try:
+                if name:
+                    con.execute('UPDATE templates SET payload=NULL, version=NULL WHERE src=? AND sheet=? AND name=?', (src, sheet, name))
+                con.execute('UPDATE sheets SET checked=0 WHERE src=? AND sheet=?', (src, sheet))
+                con.commit()
+            finally:
+                con.close()
+        except Exception:
+            pass
+
+_TEMPLATE_STORE=_TemplateStore(_TEMPLATE_DB, _TEMPLATE_FRESH)
+#------A024：模板本機快取（SQLite，stale-while-revalidate）(結束)：------
+
+
+
+#------A025：模板背景同步（write-behind）(開始)：------
+_SYNC_DELAY=0.5        # 排入後等多久才送出（秒）：這段時間內同一模板的連續修改合併成一次 upsert
+_SYNC_MAX_TRIES=3      # 自動重試次數；用完後停在「同步失敗」，等使用者按重試
+_SYNC_BACKOFF=(2.0, 30.0)
+
+class _TemplateSync:
+    """
+    套用變更時的模板回寫改成背景佇列：本機模板副本立即更新，GAS upsert 交給單一背景 thread。
+    以 (GAS 網址, 表, 名稱) 為 key 只保留最新內容，連續修改合併成一次寫入；
+    失敗依退避自動重試，之後停在 failed 等 retry()。佇列只在記憶體（程序結束時尚未送出的修改會遺失）。
+    送出中的 upsert 連同寫回本機清單都在 syncing 狀態內完成；cancel() 會等它結束，之後的刪除不會被這次寫入蓋回去。
+    """
+    def __init__(self, store:_TemplateStore):
+        self.store=store
+        self._cv=threading.Condition()
+        self._jobs: Dict[Tuple[str,str,str],Dict[str,Any]] = {}
+        self._inflight: Dict[Tuple[str,str,str],Dict[str,Any]] = {}   # 正在送出的 job（已取消的也算，直到 upsert 結束）
+        self._thread: Optional[threading.Thread] = None
+
+    @staticmethod
+    def _key(client:GASClient, sheet:str, name:str)->Tuple[str,str,str]:
+        return (client.url, sheet, name)
+
+    def submit(self, client:GASClient, sheet:str, name:str, payload:Dict[str,Any]):
+        """排入回寫（立即返回）；本機副本先更新，載入 / 清單馬上看得到新內容。"""
+        key=self._key(client, sheet, name)
+        with self._cv:
+            job=self._jobs.get(key)
+            if job is None:
+                job=self._jobs[key]={'client': client, 'sheet': sheet, 'name': name, 'rev': 0, 'state': 'synced'}
+            if not job.get('pinned'):
+                self.store.pin(client, sheet, name)
+                job['pinned']=True
+            job.update({'client': client, 'payload': payload, 'rev': job['rev']+1, 'attempts': 0,
+                        'state': 'pending' if job.get('state') != 'syncing' else 'syncing',
+                        'due': time.monotonic()+_SYNC_DELAY, 'error': '', 'updated': time.time()})
+            self._ensure_worker()
+            self._cv.notify()
+        self.store.put(client, sheet, name, payload, stale=False)
+
+    def retry(self, client:GASClient, sheet:str, name:str):
+        with self._cv:
+            job=self._jobs.get(self._key(client, sheet, name))
+            if job and job['state'] == 'failed':
+                job.update({'state': 'pending', 'attempts': 0, 'due': time.monotonic(), 'error': ''})
+                self._cv.notify()
+
+    def _unpin(self, job:Dict[str,Any]):
+        # 呼叫端持有 self._cv
+        if job.get('pinned'):
+            self.store.pin(job['client'], job['sheet'], job['name'], on=False)
+            job['pinned']=False
+
+    def cancel(self, client:GASClient, sheet:str, name:str, timeout:float=30.0)->bool:
+        """
+        模板被刪除 / 改用雲端版本時：丟掉尚未送出的修改。
+        正在送出（syncing）的也標成取消，並等那次 upsert 結束（結果不再標成已同步、也不寫回本機清單），
+        呼叫端接著刪除時才不會被這次寫入重新建立。等不到（逾時）回傳 False。
+        """
+        key=self._key(client, sheet, name)
+        end=time.monotonic()+timeout
+        with self._cv:
+            job=self._jobs.pop(key, None)
+            if job is not None:
+                job['cancelled']=True
+                self._unpin(job)
+            while key in self._inflight:
+                left=end-time.monotonic()
+                if left <= 0:
+                    return False
+                self._cv.wait(min(left, 0.1))
+        return True
+
+    def status(self, client:GASClient, sheet:str, name:str)->Optional[Dict[str,Any]]:
+        """{'state': pending/syncing/synced/failed, 'error', 'attempts', 'updated'}；從未排入回傳 None。"""
+        with self._cv:
+            job=self._jobs.get(self._key(client, sheet, name))
+            return {k: job.get(k) for k in ('state', 'error', 'attempts', 'updated')} if job else None
+
+    def flush(self, timeout:float=30.0)->bool:
+        # 等佇列送完（測試 / 關閉前用）；failed 不算在等待內
+        end=time.monotonic()+timeout
+        with self._cv:
+            while any(j['state'] in ('pending', 'syncing') for j in self._jobs.values()):
+                left=end-time.monotonic()
+                if left <= 0:
+                    return False
+                self._cv.wait(min(left, 0.1))
+        return True
+
+    def _ensure_worker(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread=threading.Thread(target=self._run, name='template-sync', daemon=True)
+            self._thread.start()
+
+    def _next(self)->Tuple[Optional[Dict[str,Any]], Optional[float]]:
+        now=time.monotonic(); wait=None
+        for job in self._jobs.values():
+            if job['state'] != 'pending':
+                continue
+            if job['due'] <= now:
+                return job, None
+            wait=min(wait, job['due']-now) if wait is not None else job['due']-now
+        return None, wait
+
+    def _run(self):
+        while True:
+            with self._cv:
+                job, wait=self._next()
+                while job is None:
+                    self._cv.wait(wait)
+                    job, wait=self._next()
+                job['state']='syncing'; job['attempts'] += 1
+                client, sheet, name, payload, rev=job['client'], job['sheet'], job['name'], job['payload'], job['rev']
+                key=self._key(client, sheet, name)
+                self._inflight[key]=job
+            try:
+                ok, msg, listing=client.upsert_and_list(sheet, name, payload)
+            except Exception as e:
+                ok, msg, listing=False, str(e), None
+            with self._cv:
+                # 已取消 / 送出途中又有新的修改：這次結果不寫回本機；解除 pin 後新清單才會寫入這個模板
+                done=ok and not job.get('cancelled') and job['rev'] == rev
+                if done:
+                    self._unpin(job)
+            if done:
+                # 仍在 syncing：cancel() 會等這一步完成
+                if listing is not None:
+                    self.store.apply_listing(client, sheet, listing)
+                else:
+                    self.store.invalidate(client, sheet)
+            with self._cv:
+                newer=job['rev'] != rev   # 送出途中又有新的修改：這次結果不算，立即再送一次最新內容
+                if job.get('cancelled'):
+                    job['state']='cancelled'
+                elif done and not newer:
+                    job.update({'state': 'synced', 'error': '', 'updated': time.time()})
+                elif ok or newer:
+                    job.update({'state': 'pending', 'attempts': 0})
+                elif job['attempts'] < _SYNC_MAX_TRIES:
+                    job.update({'state': 'pending', 'error': msg,
+                                'due': time.monotonic()+random.uniform(0, min(_SYNC_BACKOFF[1], _SYNC_BACKOFF[0]*2**job['attempts']))})
+                else:
+                    job.update({'state': 'failed', 'error': msg, 'updated': time.time()})
+                self._inflight.pop(key, None)
+                self._cv.notify_all()
+
+_TEMPLATE_SYNC=_TemplateSync(_TEMPLATE_STORE)
+#------A025：模板背景同步（write-behind）(結束)：------
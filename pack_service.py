@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""
+裝箱 HTTP 服務（只用標準函式庫 + 現有套件）：給倉儲系統直接呼叫。
+
+    POST /pack    body：{"order": "...", "boxes": [...], "products": [...], "options": {...}}
+                  boxes / products 與模板 payload 相同（也可給 {"rows": [...]}）
+                  options：engine / optimize / portfolio / time_limit / time_budget / placements / use_cache
+                  回傳 plan_json（與 pack_cli 每行輸出相同）
+    GET  /health  目前負載與累計統計
+
+- 計算交給固定大小的 process pool；排隊名額（--queue）也固定，滿了直接回 429，不會無限堆積。
+- 每筆請求有逾時（--timeout，options.timeout 只能更短）：從收到請求開始算（排隊時間也算在內），
+  以絕對截止時間交給 worker，開始計算時剩多少就給裝箱核心多少時間預算，
+  時間到就回傳目前為止的部分結果（partial=true）；排隊就已過期的不再計算，與超過逾時 + 寬限的一樣回 504。
+
+用法：
+    python pack_service.py --port 8765 --workers 4 --queue 32 --timeout 30
+"""
+#------C001：匯入套件(開始)：------
+import os, sys, json, time, argparse, threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Any, Optional, Tuple
+
+import pack_cli
+#------C001：匯入套件(結束)：------
+
+
+#------C002：請求排程（固定 worker 數 + 固定排隊名額）(開始)：------
+_OPTION_KEYS=('engine', 'optimize', 'portfolio', 'time_limit', 'time_budget', 'placements', 'use_cache')
+_GRACE=5.0           # 時間預算用完後，等 worker 收尾並回傳部分結果的寬限（秒）
+_MAX_BODY=8*2**20    # 單筆請求上限 8MB
+
+class PackScheduler:
+    """
+    process pool 外面包一層名額控管：執行中 + 排隊中的請求數不超過 workers+queue。
+    名額在 worker 真的算完時才歸還（不是回應送出時），逾時的請求仍佔著名額直到停下來，
+    避免逾時後立刻又塞進新工作、讓 pool 越排越長。
+    """
+    def __init__(self, workers:int, queue:int, timeout:float):
+        self.workers=max(1, int(workers))
+        self.capacity=self.workers+max(0, int(queue))
+        self.timeout=float(timeout)
+        self._slots=threading.BoundedSemaphore(self.capacity)
+        self._lock=threading.Lock()
+        self._inflight=0
+        self.stats={'ok': 0, 'failed': 0, 'rejected': 0, 'timeout': 0, 'partial': 0}
+        self._ex=self._new_pool()
+
+    def _new_pool(self):
+        return ProcessPoolExecutor(max_workers=self.workers, initializer=pack_cli._init_worker, initargs=({},))
+
+    def _count(self, key:str):
+        with self._lock:
+            self.stats[key] += 1
+
+    def _release(self, _fut=None):
+        with self._lock:
+            self._inflight -= 1
+        self._slots.release()
+
+    def health(self)->Dict[str,Any]:
+        with self._lock:
+            return {'ok': True, 'workers': self.workers, 'capacity': self.capacity,
+                    'inflight': self._inflight, 'timeout': self.timeout, 'stats': dict(self.stats)}
+
+    def submit(self, req:Dict[str,Any])->Tuple[int, Dict[str,Any]]:
+        """回傳 (HTTP 狀態碼, JSON 內容)。"""
+        order={
+            'order': str(req.get('order') or req.get('name') or '訂單'),
+            'boxes': pack_cli._rows(req.get('boxes')),
+            'products': pack_cli._rows(req.get('products')),
+        }
+        raw=req.get('options') if isinstance(req.get('options'), dict) else {}
+        opts={k: raw[k] for k in _OPTION_KEYS if k in raw}
+        try:
+            timeout=min(self.timeout, float(raw.get('timeout', self.timeout)))
+            if opts.get('time_budget') is not None:
+                opts['time_budget']=float(opts['time_budget'])
+            if opts.get('time_limit') is not None:
+                opts['time_limit']=float(opts['time_limit'])
+        except (TypeError, ValueError):
+            return 400, {'ok': False, 'error': 'options 的 timeout / time_budget / time_limit 必須是數字'}
+        timeout=max(0.1, timeout)
+        # 時間預算不超過逾時：核心會在預算內停下、回傳部分結果，而不是被 HTTP 端放棄；
+        # 截止時間從現在算起（worker 在排隊後才開始，見 pack_cli.pack_order）
+        opts['time_budget']=min(opts.get('time_budget') or timeout, timeout)
+        opts['deadline']=time.time()+timeout
+        if opts.get('optimize'):
+            opts['time_limit']=min(float(opts.get('time_limit') or 10.0), timeout)
+        opts['html_dir']=None
+
+        if not self._slots.acquire(blocking=False):
+            self._count('rejected')
+            return 429, {'ok': False, 'error': '服務忙碌中，請稍後再試', 'capacity': self.capacity}
+        with self._lock:
+            self._inflight += 1
+            ex=self._ex
+        try:
+            fut=ex.submit(pack_cli.pack_order, order, opts)
+        except (BrokenProcessPool, RuntimeError) as e:
+            self._release()
+            self._restart(ex, e)
+            self._count('failed')
+            return 503, {'ok': False, 'error': f'worker 異常，已重新啟動：{e}'}
+        fut.add_done_callback(self._release)
+
+        try:
+            # 排隊時間也算在逾時內；寬限是留給 worker 收尾回傳部分結果
+            out=fut.result(timeout=timeout+_GRACE)
+        except FutureTimeout:
+            fut.cancel()   # 還在排隊就直接取消；已在執行的會在時間預算到時自行停下
+            self._count('timeout')
+            return 504, {'ok': False, 'order': order['order'], 'error': f'超過 {timeout:g} 秒仍未完成'}
+        except BrokenProcessPool as e:
+            self._restart(ex, e)
+            self._count('failed')
+            return 503, {'ok': False, 'order': order['order'], 'error': f'worker 異常，已重新啟動：{e}'}
+
+        if out.get('expired'):
+            self._count('timeout')
+            return 504, {'ok': False, 'order': order['order'], 'error': f'超過 {timeout:g} 秒仍未開始計算'}
+        if not out.get('ok'):
+            self._count('failed')
+            return 422, out
+        self._count('partial' if out.get('partial') else 'ok')
+        return 200, out
+
+    def _restart(self, broken, err):
+        # 某個 worker 被系統砍掉（例如 OOM）時整個 pool 會失效：換一個新的，舊的讓它自己結束。
+        # 同一個 pool 失效時多筆請求會一起來重建：只有第一筆（self._ex 仍是失效的那個）真的換，
+        # 其他的不能再把剛建好、可能已有新請求在排隊的 pool 關掉
+        with self._lock:
+            if self._ex is not broken:
+                return
+            old, self._ex=self._ex, self._new_pool()
+        print(f'process pool 失效，已重建：{err}', file=sys.stderr)
+        old.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        self._ex.shutdown(wait=False, cancel_futures=True)
+#------C002：請求排程（固定 worker 數 + 固定排隊名額）(結束)：------
+
+
+#------C003：HTTP 介面(開始)：------
+class PackHandler(BaseHTTPRequestHandler):
+    server_version='PackService/1.0'
+    protocol_version='HTTP/1.1'
+    scheduler:Optional[PackScheduler]=None
+    quiet=False
+
+    def _send(self, code:int, payload:Dict[str,Any]):
+        body=json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        if code == 429:
+            self.send_header('Retry-After', '1')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip('/') in ('', '/health'):
+            return self._send(200, self.scheduler.health())
+        self._send(404, {'ok': False, 'error': f'找不到路徑：{self.path}'})
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/pack':
+            return self._send(404, {'ok': False, 'error': f'找不到路徑：{self.path}'})
+        try:
+            n=int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            n=-1
+        if n < 0 or n > _MAX_BODY:
+            self.close_connection=True
+            return self._send(413, {'ok': False, 'error': '請求內容過大或長度不正確'})
+        try:
+            req=json.loads(self.rfile.read(n).decode('utf-8') or '{}')
+        except Exception as e:
+            return self._send(400, {'ok': False, 'error': f'JSON 格式錯誤：{e}'})
+        if not isinstance(req, dict):
+            return self._send(400, {'ok': False, 'error': '請求內容必須是 JSON 物件'})
+        code, out=self.scheduler.submit(req)
+        self._send(code, out)
+
+    def log_message(self, fmt, *args):
+        if not self.quiet:
+            super().log_message(fmt, *args)
+#------C003：HTTP 介面(結束)：------
+
+
+#------C004：程式進入點(開始)：------
+def make_server(host:str, port:int, workers:int, queue:int, timeout:float, quiet:bool=False):
+    # 先在主程序載入裝箱核心：fork 出來的 worker 直接共用，不必各自重新 import
+    pack_cli._load_core()
+    sched=PackScheduler(workers, queue, timeout)
+    handler=type('Handler', (PackHandler,), {'scheduler': sched, 'quiet': quiet})
+    srv=ThreadingHTTPServer((host, port), handler)
+    srv.daemon_threads=True
+    return srv, sched
+
+def main(argv=None)->int:
+    ap=argparse.ArgumentParser(description='3D 裝箱 HTTP 服務')
+    ap.add_argument('--host', default='127.0.0.1')
+    ap.add_argument('--port', type=int, default=8765)
+    ap.add_argument('--workers', type=int, default=None, help='worker 程序數（預設 CPU 數）')
+    ap.add_argument('--queue', type=int, default=None, help='排隊名額（預設 workers*4），滿了回 429')
+    ap.add_argument('--timeout', type=float, default=30.0, help='單筆請求逾時（秒）')
+    ap.add_argument('--quiet', action='store_true', help='不輸出每筆請求的存取紀錄')
+    a=ap.parse_args(argv)
+    workers=a.workers or os.cpu_count() or 1
+    queue=a.queue if a.queue is not None else workers*4
+    srv, sched=make_server(a.host, a.port, workers, queue, a.timeout, a.quiet)
+    print(f'裝箱服務：http://{a.host}:{srv.server_address[1]}（workers={workers}，排隊={queue}，逾時={a.timeout:g}s）', file=sys.stderr)
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        srv.server_close()
+        sched.shutdown()
+    return 0
+
+if __name__=='__main__':
+    sys.exit(main())
+#------C004：程式進入點(結束)：------
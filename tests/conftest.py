@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+import os, sys, threading
+
+import pytest
+
+# 測試直接 import 專案根目錄的模組（pack_core / gas_stub ...）
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gas_stub
+import pack_core
+
+
+@pytest.fixture
+def stub():
+    # 本機 GAS 模擬伺服器：stub(**make_server 參數) → /exec 網址；測試結束自動關閉
+    servers=[]
+
+    def _start(**kw):
+        srv=gas_stub.make_server(token='dev', **kw)
+        threading.Thread(target=srv.serve_forever, daemon=True).start()
+        servers.append(srv)
+        url=f'http://127.0.0.1:{srv.server_address[1]}/exec'
+        pack_core._GAS_NO_BULK.discard(url)
+        return url
+
+    yield _start
+    for srv in servers:
+        srv.shutdown()
+        srv.server_close()
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""GAS 用戶端對本機模擬伺服器（gas_stub）：批次協定、舊協定退回、暫時性錯誤不停用批次。"""
+import pack_core
+
+
+def _client(url, token='dev'):
+    return pack_core.GASClient(url, token, timeout=(2.0, 5.0), budget=5.0)
+
+
+def test_batch_create_upsert_and_list(stub):
+    gas=_client(stub())
+    ok, msg, listing = gas.create_and_list('box', '甲', {'rows': [1]})
+    assert ok and listing['甲']['payload'] == {'rows': [1]}
+    ok, msg, _ = gas.create_and_list('box', '甲', {'rows': [2]})
+    assert not ok and '已存在' in msg
+    ok, _, listing = gas.upsert_and_list('box', '甲', {'rows': [3]})
+    assert ok and listing['甲']['payload'] == {'rows': [3]}
+
+    res=gas.batch([
+        {'action': 'get', 'sheet': 'box', 'name': '甲'},
+        {'action': 'get', 'sheet': 'box', 'name': '乙'},
+        {'action': 'nope', 'sheet': 'box'},
+    ])
+    assert res[0]['ok'] and res[0]['version'] == listing['甲']['version']
+    assert res[1] == {'ok': False, 'error': 'not_found'}
+    assert not res[2]['ok']
+
+    ok, _, listing = gas.delete_and_list('box', '甲')
+    assert ok and listing == {}
+    assert gas.bulk
+
+
+def test_list_full_versions_only(stub):
+    gas=_client(stub())
+    gas.upsert('prod', '甲', {'a': 1})
+    gas.upsert('prod', '乙', {'b': 2})
+    full=gas.list_full('prod')
+    slim=gas.list_full('prod', payloads=False)
+    assert full['乙']['payload'] == {'b': 2}
+    assert set(slim) == {'甲', '乙'}
+    assert all(it['payload'] is None and it['version'] == full[n]['version'] for n, it in slim.items())
+
+    # 內容沒變就不換版本
+    v=full['甲']['version']
+    gas.upsert('prod', '甲', {'a': 1})
+    assert gas.list_full('prod', payloads=False)['甲']['version'] == v
+
+
+def test_legacy_server_falls_back(stub):
+    url=stub(legacy=True)
+    gas=_client(url)
+    ok, _, listing = gas.create_and_list('box', '甲', {'rows': [1]})
+    assert ok and listing is None
+    assert not gas.bulk and url in pack_core._GAS_NO_BULK
+    assert gas.list_full('box') == {'甲': {'payload': None, 'version': None}}
+    assert gas.get_payload('box', '甲') == {'rows': [1]}
+    ok, msg, _ = gas.create_and_list('box', '甲', {'rows': [2]})
+    assert not ok and '已存在' in msg
+    assert gas.delete('box', '甲')[0] and gas.list_names('box') == []
+
+
+def test_unauthorized_does_not_disable_bulk(stub):
+    url=stub()
+    bad=_client(url, token='wrong')
+    assert bad.list_full('box') is None
+    assert [r['error'] for r in bad.batch([{'action': 'list', 'sheet': 'box'}])] == ['unauthorized']
+    ok, msg, _ = bad.upsert_and_list('box', '甲', {})
+    assert not ok and 'unauthorized' in msg
+    assert url not in pack_core._GAS_NO_BULK
+
+    gas=_client(url)
+    assert gas.bulk and gas.upsert_and_list('box', '甲', {'x': 1})[2]['甲']['payload'] == {'x': 1}
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""格狀快速路徑（_grid_fill）：只是加速，箱數不可以比引擎本身多。"""
+import random
+
+import pytest
+
+import pack_core
+
+
+def _box(l, w, h, qty=9):
+    return {'selected': True, 'name': '箱', 'l': l, 'w': w, 'h': h, 'qty': qty, 'tare': 0}
+
+def _prod(name, l, w, h, qty, orient='自動'):
+    return {'selected': True, 'name': name, 'l': l, 'w': w, 'h': h, 'qty': qty, 'wt': 1, 'orient': orient}
+
+def _pack(boxes, prods, engine, grid=True, monkeypatch=None):
+    pack_core._PACK_MEMO.clear()
+    pack_core._GRID_MEMO.clear()
+    if not grid:
+        monkeypatch.setattr(pack_core, '_grid_fill', lambda *a, **k: [])
+    try:
+        res=pack_core.pack_and_render(
+            '測試', pack_core._box_rows({'rows': boxes}), pack_core._prod_rows({'rows': prods}),
+            engine=engine, use_cache=False, render=False,
+        )
+    finally:
+        if monkeypatch is not None:
+            monkeypatch.undo()
+    assert res['ok'], res.get('error')
+    left=sum(n for _, n in res['unfitted'])
+    return left, [len(p['items']) for p in res['packed_bins']]
+
+
+@pytest.mark.parametrize('engine', ['py3dbp', 'numpy'])
+def test_mixed_load_keeps_engine_result(engine, monkeypatch):
+    # 混裝：70 件 10³ + 30 件 9³ 一箱裝得下，格狀不可以佔走小件的空間
+    boxes=[_box(100, 100, 10)]
+    prods=[_prod('大', 10, 10, 10, 70), _prod('小', 9, 9, 9, 30)]
+    got=_pack(boxes, prods, engine)
+    assert got == _pack(boxes, prods, engine, grid=False, monkeypatch=monkeypatch)
+    assert got == (0, [100])
+
+
+@pytest.mark.parametrize('engine', ['py3dbp', 'numpy'])
+@pytest.mark.parametrize('homogeneous', [True, False])
+def test_box_count_never_above_engine(engine, homogeneous, monkeypatch):
+    R=random.Random(f'{engine}-{homogeneous}')
+    for _ in range(12):
+        boxes=[_box(R.choice([30, 40, 50]), R.choice([20, 30]), R.choice([10, 20, 30]), R.randint(1, 12))]
+        if R.random() < 0.5:
+            boxes.append(_box(R.choice([20, 30]), R.choice([20, 30]), R.choice([10, 20]), R.randint(1, 12)))
+        kinds=1 if homogeneous else R.randint(2, 3)
+        prods=[
+            _prod(f'商品{i}', R.randint(3, 10), R.randint(3, 10), R.randint(3, 10), R.randint(20, 200),
+                  R.choice(['自動', '自動', '高當高']))
+            for i in range(kinds)
+        ]
+        left, bins = _pack(boxes, prods, engine)
+        left0, bins0 = _pack(boxes, prods, engine, grid=False, monkeypatch=monkeypatch)
+        assert (left, len(bins)) <= (left0, len(bins0)), (boxes, prods)
+
+
+@pytest.mark.parametrize('engine', ['py3dbp', 'numpy'])
+def test_time_grows_linearly_with_quantity(engine):
+    # 待裝商品以 (Sku, 件數) 表示、整箱格狀結果重用：件數 ×4，時間不可以跟著平方成長（原本約 ×16）
+    import time
+
+    def _t(n):
+        best=None
+        for _ in range(3):
+            t=time.perf_counter()
+            left, bins = _pack([_box(60, 40, 40, 100000)], [_prod('大量', 10, 8, 6, n)], engine)
+            dt=time.perf_counter()-t
+            best=dt if best is None else min(best, dt)
+        assert left == 0 and sum(bins) == n
+        return best
+
+    t10, t40 = _t(10000), _t(40000)
+    assert t40 < 6*t10, (t10, t40)
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""NumPy 引擎：擺放合法（在箱內、不重疊），500 件訂單一秒內算完。"""
+import itertools
+import time
+
+import pack_core
+
+
+def _order():
+    boxes=[{'selected': True, 'name': '箱', 'l': 60, 'w': 40, 'h': 40, 'qty': 20, 'tare': 0}]
+    prods=[
+        {'selected': True, 'name': n, 'l': l, 'w': w, 'h': h, 'qty': 125, 'wt': 1, 'orient': '自動'}
+        for n, l, w, h in [('甲', 10, 8, 6), ('乙', 12, 10, 5), ('丙', 7, 7, 7), ('丁', 15, 10, 4)]
+    ]
+    return pack_core._box_rows({'rows': boxes}), pack_core._prod_rows({'rows': prods})
+
+def _pack():
+    pack_core._PACK_MEMO.clear()
+    pack_core._GRID_MEMO.clear()
+    df_box, df_prod = _order()
+    return pack_core.pack_and_render('測試', df_box, df_prod, engine='numpy', use_cache=False, render=False)
+
+
+def test_placements_inside_and_disjoint():
+    res=_pack()
+    assert res['ok'] and not res['unfitted']
+    assert sum(len(p['items']) for p in res['packed_bins']) == 500
+    for p in res['packed_bins']:
+        B=(p['box']['l'], p['box']['w'], p['box']['h'])
+        cubes=[((pl.x, pl.y, pl.z), (pl.x+pl.dx, pl.y+pl.dy, pl.z+pl.dz)) for pl in p['items']]
+        for a, c in cubes:
+            assert all(0 <= a[i] and c[i] <= B[i] for i in range(3))
+        for (a0, a1), (b0, b1) in itertools.combinations(cubes, 2):
+            assert not all(a0[i] < b1[i] and b0[i] < a1[i] for i in range(3))
+
+
+def test_500_units_under_a_second():
+    _pack()   # 暖身：numpy / 引擎載入不計入
+    t0=time.perf_counter()
+    _pack()
+    assert time.perf_counter()-t0 < 1.0
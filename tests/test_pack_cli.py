@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""批次 CLI（pack_cli）：CSV / JSONL 讀取（壞行、selected 判斷、依 order 分組）與結束碼。"""
+import json
+import os
+
+import pack_cli
+
+
+DATA=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+
+def test_read_csv_groups_by_order_and_parses_selected():
+    orders=list(pack_cli.read_csv(os.path.join(DATA, 'orders.csv')))
+    # 依第一次出現的順序分組；沒有 order 的列略過；BOM 不影響第一欄名稱
+    assert [o['order'] for o in orders] == ['訂單A', '訂單B']
+    a, b = orders
+    assert [r['name'] for r in a['boxes']] == ['大箱']
+    # 未知 kind 的列不列入
+    assert [r['name'] for r in a['products']] == ['杯子', '不要的', '也不要']
+    assert [r['name'] for r in b['boxes']] == ['小箱']
+    assert [r['name'] for r in b['products']] == ['筆', '關掉的']
+    # selected：空白 / 1 / true 視為勾選；0 / No / F 不勾選
+    assert [r['selected'] for r in a['products']] == [True, False, False]
+    assert a['boxes'][0]['selected'] and b['boxes'][0]['selected']
+    assert [r['selected'] for r in b['products']] == [True, False]
+    # 外箱帶 tare；商品帶 wt / orient（空白為「自動」）
+    assert a['boxes'][0]['tare'] == '0.5' and 'wt' not in a['boxes'][0]
+    assert a['products'][0]['orient'] == '高當高' and b['products'][0]['orient'] == '自動'
+
+
+def test_selected_values():
+    for v in ('', None, '1', 'true', 'Yes', 'y', '是'):
+        assert pack_cli._selected(v), v
+    for v in ('0', 'false', 'FALSE', 'no', 'N', 'f', ' 0 '):
+        assert not pack_cli._selected(v), v
+
+
+def test_read_jsonl_bad_lines_and_rows():
+    orders=list(pack_cli.read_jsonl(os.path.join(DATA, 'orders.jsonl')))
+    # 空行略過，行號照實際行數
+    assert [o['order'] for o in orders] == ['訂單A', '訂單B', '第4行', '第5行']
+    a, b, bad, empty = orders
+    assert [r['name'] for r in a['boxes']] == ['大箱']           # {"rows": [...]}
+    assert [r['name'] for r in b['boxes']] == ['小箱']           # 直接給陣列；非物件的列略過
+    assert 'JSON 格式錯誤' in bad['error'] and 'boxes' not in bad
+    assert empty == {'order': '第5行', 'boxes': [], 'products': []}
+
+
+def _run(tmp_path, name, *extra):
+    out=tmp_path/'out.jsonl'
+    code=pack_cli.main([os.path.join(DATA, name), '-o', str(out), '--workers', '1', '--no-cache', '--engine', 'numpy', *extra])
+    return code, [json.loads(l) for l in out.read_text(encoding='utf-8').splitlines()]
+
+
+def test_exit_code_zero_when_all_orders_pack(tmp_path):
+    code, rows = _run(tmp_path, 'orders.csv')
+    assert code == 0
+    assert [r['order'] for r in rows] == ['訂單A', '訂單B']
+    assert all(r['ok'] for r in rows)
+
+
+def test_exit_code_one_when_any_order_fails(tmp_path):
+    code, rows = _run(tmp_path, 'orders.jsonl')
+    assert code == 1
+    assert [r['ok'] for r in rows] == [True, True, False, False]
+    assert 'JSON 格式錯誤' in rows[2]['error']
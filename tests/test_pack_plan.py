@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""逐型裝箱（_pack_plan）：相同箱型 × 相同剩餘商品重用結果，引擎呼叫次數不隨箱子庫存 / 訂單件數成長。"""
+import pytest
+
+import pack_core
+
+
+def _box(l, w, h, qty):
+    return {'selected': True, 'name': '箱', 'l': l, 'w': w, 'h': h, 'qty': qty, 'tare': 0}
+
+def _prod(name, l, w, h, qty):
+    return {'selected': True, 'name': name, 'l': l, 'w': w, 'h': h, 'qty': qty, 'wt': 1, 'orient': '自動'}
+
+def _pack(stock, qty, engine, monkeypatch):
+    pack_core._PACK_MEMO.clear()
+    pack_core._GRID_MEMO.clear()
+    calls=[0]
+    fill=pack_core._FILLERS[engine]
+
+    def _count(*a, **k):
+        calls[0] += 1
+        return fill(*a, **k)
+
+    monkeypatch.setitem(pack_core._FILLERS, engine, _count)
+    try:
+        res=pack_core.pack_and_render(
+            '測試', pack_core._box_rows({'rows': [_box(40, 30, 20, stock)]}),
+            pack_core._prod_rows({'rows': [_prod('甲', 7, 5, 4, qty), _prod('乙', 6, 6, 5, qty)]}),
+            engine=engine, use_cache=False, render=False,
+        )
+    finally:
+        monkeypatch.undo()
+    assert res['ok'], res.get('error')
+    assert not res['unfitted']
+    assert sum(len(p['items']) for p in res['packed_bins']) == 2*qty
+    return calls[0], len(res['packed_bins'])
+
+
+@pytest.mark.parametrize('engine', ['py3dbp', 'numpy'])
+def test_engine_calls_do_not_scale_with_stock_or_quantity(engine, monkeypatch):
+    calls, bins = _pack(50, 300, engine, monkeypatch)
+    assert (calls, bins) == _pack(5000, 300, engine, monkeypatch)
+    calls4, bins4 = _pack(5000, 1200, engine, monkeypatch)
+    assert bins4 > 3*bins
+    assert calls4 == calls
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""裝箱服務排程（PackScheduler）：名額滿回 429、排隊逾時回 504、截止時間含排隊時間、worker 被砍後重建 pool。"""
+import os
+import signal
+import threading
+import time
+
+import pytest
+
+import pack_cli
+import pack_service
+
+
+# 大訂單：py3dbp 在時間預算內算不完，用來佔住 worker
+BIG={
+    'order': '大單',
+    'boxes': [{'selected': True, 'name': '箱', 'l': 60, 'w': 40, 'h': 40, 'qty': 999}],
+    'products': [{'selected': True, 'name': f'商品{i}', 'l': 3+i, 'w': 4+i % 3, 'h': 5+i % 2, 'qty': 3000, 'wt': 1}
+                 for i in range(4)],
+}
+SMALL={
+    'order': '小單',
+    'boxes': [{'selected': True, 'name': '箱', 'l': 30, 'w': 20, 'h': 10, 'qty': 5}],
+    'products': [{'selected': True, 'name': '商品', 'l': 5, 'w': 5, 'h': 5, 'qty': 4, 'wt': 1}],
+}
+
+
+@pytest.fixture
+def scheduler():
+    made=[]
+
+    def _make(workers, queue, timeout):
+        s=pack_service.PackScheduler(workers, queue, timeout)
+        made.append(s)
+        return s
+
+    yield _make
+    for s in made:
+        s.shutdown()
+
+def _req(order, timeout, **opts):
+    return dict(order, options=dict({'engine': 'py3dbp', 'use_cache': False, 'timeout': timeout}, **opts))
+
+def _background(fn, *args):
+    out=[]
+    t=threading.Thread(target=lambda: out.append(fn(*args)), daemon=True)
+    t.start()
+    return t, out
+
+def _wait(cond, timeout=5.0):
+    end=time.monotonic()+timeout
+    while not cond():
+        assert time.monotonic() < end
+        time.sleep(0.02)
+
+
+def test_full_capacity_returns_429(scheduler):
+    s=scheduler(1, 0, 10)
+    t, out = _background(s.submit, _req(BIG, 1.0))
+    _wait(lambda: s.health()['inflight'] == 1)
+    code, body = s.submit(_req(SMALL, 1.0))
+    assert code == 429 and not body['ok'] and body['capacity'] == 1
+    t.join(10)
+    code, body = out[0]
+    assert code == 200 and body['partial']
+    assert s.health()['stats']['rejected'] == 1
+    _wait(lambda: s.health()['inflight'] == 0)
+    assert s.submit(_req(SMALL, 5.0))[0] == 200
+
+
+def test_queued_request_times_out_504_and_is_not_packed_late(scheduler, monkeypatch):
+    monkeypatch.setattr(pack_service, '_GRACE', 0.2)
+    s=scheduler(1, 1, 10)
+    t, out = _background(s.submit, _req(BIG, 1.5))
+    _wait(lambda: s.health()['inflight'] == 1)
+    t0=time.monotonic()
+    code, body = s.submit(_req(SMALL, 0.3))
+    assert code == 504 and not body['ok']
+    assert time.monotonic()-t0 < 1.5
+    t.join(10)
+    assert out   # 寬限縮短了，大訂單本身回 200 或 504 都可能
+    # 排隊的那筆已過截止時間：worker 拿到後不再計算，名額很快歸還
+    _wait(lambda: s.health()['inflight'] == 0, 2.0)
+    assert s.health()['stats']['timeout'] >= 1
+
+
+def test_deadline_counts_queue_time():
+    past=pack_cli.pack_order(BIG, {'engine': 'py3dbp', 'use_cache': False, 'deadline': time.time()-1})
+    assert past['expired'] and not past['ok'] and past['elapsed'] == 0.0
+
+    # 截止時間比 time_budget 早：以剩下的時間為準
+    t0=time.monotonic()
+    out=pack_cli.pack_order(BIG, {'engine': 'py3dbp', 'use_cache': False, 'time_budget': 30, 'deadline': time.time()+0.5})
+    assert out['ok'] and out['partial']
+    assert time.monotonic()-t0 < 3
+
+
+def test_killed_worker_rebuilds_pool(scheduler):
+    s=scheduler(1, 0, 10)
+    t, out = _background(s.submit, _req(BIG, 5.0))
+    _wait(lambda: s.health()['inflight'] == 1 and s._ex._processes)
+    broken=s._ex
+    for p in list(broken._processes.values()):
+        os.kill(p.pid, signal.SIGKILL)
+    t.join(10)
+    code, body = out[0]
+    assert code == 503 and not body['ok']
+    assert s._ex is not broken
+    _wait(lambda: s.health()['inflight'] == 0)
+    code, body = s.submit(_req(SMALL, 5.0))
+    assert code == 200 and body['ok']
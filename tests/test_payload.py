@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""模板 payload ↔ 表格：_box_from / _prod_from 與畫面清理（_sanitize_box / _sanitize_prod）結果一致，來回轉換不變。"""
+import pandas as pd
+from pandas.testing import assert_frame_equal
+
+import pack_core
+
+
+BOX_ROWS=[
+    {'selected': True, 'name': ' 大箱 ', 'l': '40', 'w': 30, 'h': 20.5, 'qty': '3', 'tare': '0.5'},
+    {'selected': False, 'name': '小箱', 'l': 20, 'w': 'x', 'h': None, 'qty': 2.7},
+    {'selected': True, 'name': '', 'l': 0, 'w': 0, 'h': 0, 'qty': 0},   # 空白列：略過
+    {'name': '只有名稱'},
+    '不是物件',
+]
+PROD_ROWS=[
+    {'selected': True, 'name': '杯子', 'l': 8, 'w': '8', 'h': 10, 'qty': '6', 'wt': '0.3', 'orient': '高當高'},
+    {'selected': True, 'name': '筆', 'l': 15, 'w': 2, 'h': 2, 'qty': 10, 'wt': 0.02, 'orient': '斜放'},   # 不認得：自動
+    {'selected': False, 'name': '盒', 'l': 5, 'w': 5, 'h': 5, 'qty': 1, 'orient': ''},
+    {'selected': True, 'name': '', 'l': 0, 'w': 0, 'h': 0, 'qty': 0, 'wt': 1},
+]
+
+
+def test_from_payload_matches_sanitize():
+    for rows in (BOX_ROWS, [], [{'name': ''}]):
+        df=pack_core._box_from({'rows': rows})
+        assert_frame_equal(df, pack_core._sanitize_box(df))
+    for rows in (PROD_ROWS, [], [{'name': ''}]):
+        df=pack_core._prod_from({'rows': rows})
+        assert_frame_equal(df, pack_core._sanitize_prod(df))
+
+    box=pack_core._box_from({'rows': BOX_ROWS})
+    assert list(box['名稱']) == ['大箱', '小箱', '只有名稱']
+    assert box['數量'].dtype == 'int64' and box['長'].dtype == 'float64' and box['選取'].dtype == bool
+    prod=pack_core._prod_from({'rows': PROD_ROWS})
+    assert list(prod['放置方式']) == ['高當高', '自動', '自動']
+
+
+def test_round_trip_from_editor_table():
+    # 畫面表格（使用者輸入的字串 / 空值）→ 清理 → payload → 表格：與清理後的表格完全相同
+    box=pd.DataFrame({
+        '選取': [True, False, True], '名稱': ['大箱', ' 小箱', None], '長': ['40', 20, None],
+        '寬': [30, '10.5', None], '高': [20, 10, None], '數量': ['3', 1.0, None], '空箱重量': [0.5, '', None],
+    })
+    clean=pack_core._sanitize_box(box)
+    assert_frame_equal(pack_core._box_from(pack_core._box_payload(clean)), clean)
+
+    prod=pd.DataFrame({
+        '選取': [True, True], '商品名稱': ['杯子', '筆'], '長': [8, '15'], '寬': [8, 2], '高': ['10', 2],
+        '重量(kg)': [0.3, '0.02'], '數量': [6, '10'], '放置方式': ['長當高', None],
+    })
+    clean=pack_core._sanitize_prod(prod)
+    assert_frame_equal(pack_core._prod_from(pack_core._prod_payload(clean)), clean)
+
+    # 空表也一樣
+    empty=pack_core._sanitize_box(None)
+    assert_frame_equal(pack_core._box_from(pack_core._box_payload(empty)), empty)
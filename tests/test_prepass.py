@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+裝箱前置檢查（_fit_table / _lower_bounds / 提早結束）的性質測試：隨機訂單下
+箱數下限不超過實際箱數；判定放不下的商品真的裝不進任何箱子；提早結束時剩下的商品真的放不進剩下的箱子。
+"""
+import random
+
+import pytest
+
+import pack_core
+
+
+def _order(R):
+    boxes=[{'selected': True, 'name': f'箱{i}', 'l': R.choice([20, 30, 40, 60]), 'w': R.choice([15, 20, 30]),
+            'h': R.choice([10, 20, 30]), 'qty': R.randint(1, 6), 'tare': 0}
+           for i in range(R.randint(1, 3))]
+    prods=[]
+    for i in range(R.randint(1, 4)):
+        big=R.random() < 0.25   # 偶爾出現比箱子大、或一箱只能放一件的大件
+        lo, hi = (12, 45) if big else (2, 12)
+        dims=[R.choice([R.randint(lo, hi), round(R.uniform(lo, hi), 2)]) for _ in range(3)]
+        prods.append({'selected': True, 'name': f'商品{i}', 'l': dims[0], 'w': dims[1], 'h': dims[2],
+                      'qty': R.randint(1, 40), 'wt': 1, 'orient': R.choice(['自動', '自動', '高當高', '長當高'])})
+    return boxes, prods
+
+def _holds_one(b, sk, engine):
+    # 引擎本身能否把一件放進空箱（不經過 _fit_table 的預先排除）
+    fitted, _ = pack_core._pack_one_bin(b, '檢查', [(sk, 1)], engine)
+    return bool(fitted)
+
+
+@pytest.mark.parametrize('engine', ['py3dbp', 'numpy'])
+@pytest.mark.parametrize('int_units', [True, False])
+def test_prepass_properties(engine, int_units):
+    R=random.Random(f'{engine}-{int_units}')
+    for _ in range(15):
+        boxes, prods = _order(R)
+        df_box, df_prod = pack_core._box_rows({'rows': boxes}), pack_core._prod_rows({'rows': prods})
+        pack_core._PACK_MEMO.clear()
+        res=pack_core.pack_and_render('性質', df_box, df_prod, engine=engine, int_units=int_units,
+                                      use_cache=False, render=False)
+        assert res['ok'], res.get('error')
+        bins=pack_core._build_bins(df_box, int_units)
+        skus=pack_core._build_items(df_prod, int_units)
+        fits=pack_core._fit_table(bins, skus)
+        bounds=res['bounds']
+        left={sk.id: n for sk, n in res['unfitted']}
+        packed=res['packed_bins']
+
+        # 放得下與否：預先判定與引擎逐件試的結果一致
+        for sk in skus:
+            for t, b in enumerate(bins):
+                assert (t in fits[sk.id]) == _holds_one(b, sk, engine), (boxes, prods, sk.name, b['name'])
+
+        # 判定放不下的商品：整筆都在未裝入，也沒有出現在任何箱子裡
+        oversize=set(bounds['oversize'])
+        assert oversize == {sk.id for sk in skus if not fits[sk.id]}
+        for sid in oversize:
+            assert left.get(sid) == next(sk.qty for sk in skus if sk.id == sid)
+        assert not any(pl.sku.id in oversize for p in packed for pl in p['items'])
+
+        # 下限：放得下的都裝完時，實際箱數不會少於下限
+        if not set(left) - oversize:
+            assert bounds['boxes'] <= len(packed), (boxes, prods, bounds)
+
+        # 提早結束：還有沒裝的，就代表沒有任何剩餘庫存的箱型放得下它
+        used={}
+        for p in packed:
+            used[p['tid']]=used.get(p['tid'], 0)+1
+        spare=[b for t, b in enumerate(bins) if used.get(t, 0) < int(b.get('qty', 1) or 1)]
+        for sk in skus:
+            if left.get(sk.id) and sk.id not in oversize:
+                assert not any(_holds_one(b, sk, engine) for b in spare), (boxes, prods, sk.name)
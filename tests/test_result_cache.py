@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""裝箱結果快取（_ResultCache / _result_key）：命中、未命中、key 穩定、依位元組上限 LRU 淘汰、預設位置與寫不進去時不影響計算。"""
+import os
+import random
+import time
+
+import pack_core
+
+
+def _inputs(l=40, qty=10, name='商品'):
+    boxes=[{'selected': True, 'name': '箱', 'l': l, 'w': 30, 'h': 20, 'qty': 5, 'tare': 0.2}]
+    prods=[{'selected': True, 'name': name, 'l': 5, 'w': 5, 'h': 5, 'qty': qty, 'wt': 1, 'orient': '自動'}]
+    return (pack_core._build_bins(pack_core._box_rows({'rows': boxes})),
+            pack_core._build_items(pack_core._prod_rows({'rows': prods})))
+
+def _blob(seed, n=4000):
+    # 壓不小的內容：LRU 測試需要可預期的大小
+    r=random.Random(seed)
+    return {'plan': ''.join(r.choice('abcdefghijklmnopqrstuvwxyz0123456789') for _ in range(n))}
+
+
+def test_hit_and_miss(tmp_path):
+    c=pack_core._ResultCache(str(tmp_path/'c.sqlite3'), 2**20)
+    assert c.get('k') is None
+    c.put('k', {'plan': [1, 2], 'x': '甲'})
+    assert c.get('k') == {'plan': [1, 2], 'x': '甲'}
+    st=c.stats()
+    assert (st['entries'], st['hits'], st['misses']) == (1, 1, 1) and st['hit_rate'] == 0.5
+    c.clear()
+    assert c.get('k') is None and c.stats()['entries'] == 0
+
+
+def test_key_stable_and_content_addressed():
+    settings={'engine': 'numpy', 'optimize': False}
+    k=pack_core._result_key(*_inputs(), settings)
+    assert k == pack_core._result_key(*_inputs(), dict(reversed(list(settings.items()))))
+    assert k != pack_core._result_key(*_inputs(l=41), settings)
+    assert k != pack_core._result_key(*_inputs(qty=11), settings)
+    assert k != pack_core._result_key(*_inputs(), dict(settings, engine='py3dbp'))
+
+
+def test_lru_eviction_by_bytes(tmp_path):
+    c=pack_core._ResultCache(str(tmp_path/'c.sqlite3'), 1)
+    c.put('probe', _blob(0))
+    assert c.stats()['entries'] == 0   # 單筆就超過上限：不存
+    size=len(pack_core.zlib.compress(pack_core.json.dumps(_blob(0), separators=(',', ':')).encode('utf-8')))
+
+    c=pack_core._ResultCache(str(tmp_path/'c2.sqlite3'), int(size*2.5))
+    c.put('a', _blob(1)); time.sleep(0.01)
+    c.put('b', _blob(2)); time.sleep(0.01)
+    assert c.get('a') is not None   # a 剛用過，b 變成最久沒用
+    time.sleep(0.01)
+    c.put('c', _blob(3))
+    assert c.get('b') is None
+    assert c.get('a') == _blob(1) and c.get('c') == _blob(3)
+    assert c.stats()['bytes'] <= c.max_bytes
+
+
+def test_unwritable_cache_is_a_miss(tmp_path):
+    c=pack_core._ResultCache(str(tmp_path/'missing'/'dir'/'c.sqlite3'), 2**20)
+    c.put('k', {'plan': 1})
+    assert c.get('k') is None
+    assert c.stats()['entries'] == 0
+
+
+def test_default_location(tmp_path, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path))
+    assert pack_core._cache_file('x.sqlite3') == os.path.join(str(tmp_path), 'yimimi', 'x.sqlite3')
+    # 快取資料夾建不起來：改用系統暫存資料夾
+    blocker=tmp_path/'file'
+    blocker.write_text('')
+    monkeypatch.setenv('XDG_CACHE_HOME', str(blocker))
+    assert pack_core._cache_file('x.sqlite3') == os.path.join(pack_core.tempfile.gettempdir(), 'x.sqlite3')
+    assert os.path.dirname(pack_core._RESULT_CACHE_DB) != os.path.dirname(os.path.abspath(pack_core.__file__))
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""平行搜尋（_search_plans）：時間到執行中的候選也要停下；候選截斷時箱型順序與商品排序都要有取樣。"""
+import multiprocessing
+import threading
+import time
+
+import pack_core
+
+
+def _big():
+    boxes=[{'selected': True, 'name': f'箱{i}', 'l': 60-5*i, 'w': 40, 'h': 40, 'qty': 999, 'tare': 0} for i in range(3)]
+    prods=[{'selected': True, 'name': f'商品{i}', 'l': 3+i, 'w': 4+i % 3, 'h': 5+i % 2, 'qty': 3000, 'wt': 1, 'orient': '自動'}
+           for i in range(4)]
+    return pack_core._build_bins(pack_core._box_rows({'rows': boxes})), pack_core._build_items(pack_core._prod_rows({'rows': prods}))
+
+
+def test_candidates_interleave_before_truncation():
+    box_orders=[(i,) for i in range(100)]
+    item_orders=[f'io{j}' for j in range(30)]
+    cands=pack_core._opt_candidates(box_orders, item_orders, 200)
+    assert len(cands) == len(set(cands)) == 200
+    assert cands[0] == ((0,), 'io0')
+    # 依箱型順序為主截斷只會有 7 個箱型順序；交錯後兩邊各約 20 個
+    assert len({o for o, _ in cands}) >= 19
+    assert len({io for _, io in cands}) >= 19
+    # 沒超過上限：全部都在
+    assert len(pack_core._opt_candidates(box_orders[:4], item_orders[:3], 2000)) == 12
+
+
+def test_halted_candidate_returns_stopped():
+    bins, skus = _big()
+    halt=threading.Event()
+    halt.set()
+    pack_core._opt_init(bins, skus, 'py3dbp', True, halt, None)
+    t0=time.monotonic()
+    out=pack_core._opt_task((tuple(range(len(bins))), 'volume'))
+    assert out[3] and time.monotonic()-t0 < 1
+    pack_core._opt_init(bins, skus, 'py3dbp', True, None, time.time()-1)
+    assert pack_core._opt_task((tuple(range(len(bins))), 'volume'))[3]
+
+
+def _spin(arg):
+    # 模擬很久的候選：只靠 _opt_stop（halt / 截止時間）停下
+    end=time.time()+30
+    while time.time() < end and not pack_core._opt_stop():
+        time.sleep(0.01)
+    return arg
+
+def _wait_children_exit(timeout=3.0):
+    end=time.monotonic()+timeout
+    while multiprocessing.active_children() and time.monotonic() < end:
+        time.sleep(0.05)
+    return not multiprocessing.active_children()
+
+
+def test_running_candidates_stop_when_collection_ends():
+    halt=multiprocessing.Event()
+    t0=time.monotonic()
+    results, stopped = pack_core._run_parallel(
+        _spin, list(range(6)), 0.5, workers=2,
+        initializer=pack_core._opt_init, initargs=(None, None, None, None, halt, None), halt=halt
+    )
+    assert stopped and results == [] and time.monotonic()-t0 < 2
+    assert halt.is_set()
+    assert _wait_children_exit()
+
+
+def test_running_candidates_stop_at_deadline_without_halt():
+    results, stopped = pack_core._run_parallel(
+        _spin, list(range(6)), 0.3, workers=2,
+        initializer=pack_core._opt_init, initargs=(None, None, None, None, None, time.time()+0.6)
+    )
+    assert stopped
+    assert _wait_children_exit()
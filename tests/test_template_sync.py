@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""模板背景同步（_TemplateSync）對本機模擬伺服器：合併連續修改、失敗重試、取消（含送出中的 upsert）。"""
+import threading
+import time
+
+import pytest
+
+import pack_core
+
+
+@pytest.fixture
+def sync(tmp_path, monkeypatch):
+    monkeypatch.setattr(pack_core, '_SYNC_DELAY', 0.05)
+    monkeypatch.setattr(pack_core, '_SYNC_BACKOFF', (0.01, 0.02))
+    store=pack_core._TemplateStore(str(tmp_path/'tpl.sqlite3'), 60.0)
+    return pack_core._TemplateSync(store)
+
+def _client(url):
+    return pack_core.GASClient(url, 'dev', timeout=(2.0, 5.0), budget=5.0)
+
+def _watch(gas, fail=0, gate=None):
+    # 記錄每次 upsert 的內容；前 fail 次回傳失敗；gate 給了就停在送出前，等 gate.set()
+    calls=[]
+    started=threading.Event()
+    real=gas.upsert_and_list
+
+    def _upsert(sheet, name, payload):
+        calls.append(payload)
+        started.set()
+        if gate is not None:
+            gate.wait(5)
+        if len(calls) <= fail:
+            return False, '更新失敗：暫時錯誤', None
+        return real(sheet, name, payload)
+
+    gas.upsert_and_list=_upsert
+    return calls, started
+
+
+def test_rapid_edits_coalesce(stub, sync):
+    gas=_client(stub())
+    calls, _ = _watch(gas)
+    for i in range(5):
+        sync.submit(gas, 'box', '甲', {'v': i})
+    assert sync.flush(5)
+    assert calls == [{'v': 4}]
+    assert sync.status(gas, 'box', '甲')['state'] == 'synced'
+    assert gas.get_payload('box', '甲') == {'v': 4}
+    assert sync.store.listing(gas, 'box')['甲']['payload'] == {'v': 4}
+
+
+def test_edits_during_upsert_send_latest_once_more(stub, sync):
+    gas=_client(stub())
+    gate=threading.Event()
+    calls, started = _watch(gas, gate=gate)
+    sync.submit(gas, 'box', '甲', {'v': 1})
+    assert started.wait(5)
+    sync.submit(gas, 'box', '甲', {'v': 2})
+    sync.submit(gas, 'box', '甲', {'v': 3})
+    gate.set()
+    assert sync.flush(5)
+    assert calls == [{'v': 1}, {'v': 3}]
+    assert gas.get_payload('box', '甲') == {'v': 3}
+
+
+def test_retry_after_failures(stub, sync):
+    gas=_client(stub())
+    calls, _ = _watch(gas, fail=pack_core._SYNC_MAX_TRIES)
+    sync.submit(gas, 'box', '甲', {'v': 1})
+    assert sync.flush(5)
+    st=sync.status(gas, 'box', '甲')
+    assert st['state'] == 'failed' and st['attempts'] == pack_core._SYNC_MAX_TRIES and '暫時錯誤' in st['error']
+    assert gas.get_payload('box', '甲') is None
+
+    sync.retry(gas, 'box', '甲')
+    assert sync.flush(5)
+    assert sync.status(gas, 'box', '甲')['state'] == 'synced'
+    assert len(calls) == pack_core._SYNC_MAX_TRIES+1
+    assert gas.get_payload('box', '甲') == {'v': 1}
+
+
+def test_cancel_pending_drops_edit(stub, sync):
+    gas=_client(stub())
+    calls, _ = _watch(gas)
+    sync.submit(gas, 'box', '甲', {'v': 1})
+    assert sync.cancel(gas, 'box', '甲')
+    time.sleep(0.2)
+    assert calls == [] and sync.status(gas, 'box', '甲') is None
+
+
+def test_cancel_waits_for_inflight_upsert_then_delete_sticks(stub, sync):
+    gas=_client(stub())
+    gate=threading.Event()
+    calls, started = _watch(gas, gate=gate)
+    sync.submit(gas, 'box', '甲', {'v': 1})
+    assert started.wait(5)
+
+    # 送出中：取消要等 upsert 結束，逾時回傳 False；之後又排入的修改再取消，仍要等同一次 upsert
+    assert not sync.cancel(gas, 'box', '甲', timeout=0.1)
+    sync.submit(gas, 'box', '甲', {'v': 2})
+    done=[]
+    t=threading.Thread(target=lambda: done.append(sync.cancel(gas, 'box', '甲')))
+    t.start()
+    time.sleep(0.2)
+    assert not done
+    gate.set()
+    t.join(5)
+    assert done == [True]
+
+    # 接著刪除（同 app 的刪除流程）：雲端與本機都不會被剛才那次 upsert 蓋回去
+    ok, _, listing = gas.delete_and_list('box', '甲')
+    assert ok and '甲' not in listing
+    sync.store.apply_listing(gas, 'box', listing)
+    time.sleep(0.2)
+    assert calls == [{'v': 1}]
+    assert sync.status(gas, 'box', '甲') is None
+    assert gas.get_payload('box', '甲') is None
+    assert '甲' not in sync.store.listing(gas, 'box')